@@ -0,0 +1,226 @@
+import fnmatch
+import io
+import logging
+import os
+import struct
+from pathlib import PurePosixPath
+from zipfile import ZIP_STORED, ZipFile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# fixed part of the local file header that precedes the data of every member of a zip file
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+class ZipArchive:
+    def __init__(self, filename):
+        """
+        Read-only view of a zip archive of a FileTree dataset, see `ZipPath`. The members are indexed once when the
+        archive is opened. Members that are stored without compression (see `zip_dir`) are read with a single
+        positional read from the archive, or memory-mapped; compressed members are decompressed into memory.
+
+        The file is opened on first access in every process, so the archive can be used in DataLoader workers.
+
+        Args:
+            filename (str): path to the zip file
+        """
+        self.filename = os.path.abspath(filename)
+        with ZipFile(self.filename) as zf:
+            infos = zf.infolist()
+
+        self.members = {}
+        self.children = {"": set()}
+        for info in infos:
+            parts = info.filename.rstrip("/").split("/")
+            for i in range(len(parts)):
+                self.children.setdefault("/".join(parts[:i]), set()).add(parts[i])
+            if not info.is_dir():
+                self.members[info.filename] = info
+
+        self._data_offsets = {}
+        self._fd = None
+        self._zf = None
+        self._pid = None
+
+    @property
+    def root(self):
+        """
+        Returns:
+            ZipPath: the root of the dataset, i.e. the only top-level folder of the archive (as written by `zip_dir`)
+                or the root of the archive
+        """
+        top = self.children[""]
+        if len(top) == 1 and next(iter(top)) in self.children:
+            return ZipPath(self, next(iter(top)))
+        return ZipPath(self, "")
+
+    def _open(self):
+        if self._pid != os.getpid():
+            # file descriptors and ZipFile objects inherited from the parent share their position with it
+            self._fd = os.open(self.filename, os.O_RDONLY)
+            self._zf = ZipFile(self.filename)
+            self._pid = os.getpid()
+
+    def _data_offset(self, info):
+        # the local header can have a different extra field than the central directory, so it is read to find the data
+        if info.filename not in self._data_offsets:
+            self._open()
+            header = _LOCAL_HEADER.unpack(os.pread(self._fd, _LOCAL_HEADER.size, info.header_offset))
+            self._data_offsets[info.filename] = info.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1]
+        return self._data_offsets[info.filename]
+
+    def read_bytes(self, name, size=None):
+        """
+        Returns the (first `size`) bytes of the member `name`
+        """
+        info = self.members[name]
+        size = info.file_size if size is None else min(size, info.file_size)
+        self._open()
+        if info.compress_type == ZIP_STORED:
+            return os.pread(self._fd, size, self._data_offset(info))
+        with self._zf.open(info) as fid:
+            return fid.read(size)
+
+    def load(self, name, mmap_mode=None):
+        """
+        Loads the .npy member `name` like np.load. With `mmap_mode`, uncompressed members are memory-mapped from the
+        archive; the archive is read-only, so only the modes "r" and "c" are possible.
+        """
+        info = self.members[name]
+        if mmap_mode is None:
+            return np.load(io.BytesIO(self.read_bytes(name)))
+        if mmap_mode not in ("r", "c"):
+            raise ValueError("Members of a zip archive can only be memory-mapped with mmap_mode 'r' or 'c'")
+        if info.compress_type != ZIP_STORED:
+            logger.warning("%s is compressed in %s and is loaded into memory instead", name, self.filename)
+            return self.load(name)
+
+        # the header has a fixed part (magic string, version and header length) followed by the header itself
+        prefix = self.read_bytes(name, 12)
+        if prefix[6] == 1:
+            header_length = 10 + struct.unpack("<H", prefix[8:10])[0]
+        else:
+            header_length = 12 + struct.unpack("<I", prefix[8:12])[0]
+        fid = io.BytesIO(self.read_bytes(name, header_length))
+        version = np.lib.format.read_magic(fid)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fid)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fid)
+        if dtype.hasobject or 0 in shape or shape == ():
+            return self.load(name)
+        return np.memmap(
+            self.filename,
+            dtype=dtype,
+            mode=mmap_mode,
+            offset=self._data_offset(info) + header_length,
+            shape=shape,
+            order="F" if fortran_order else "C",
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_fd=None, _zf=None, _pid=None)
+        return state
+
+
+class ZipPath:
+    def __init__(self, archive, at=""):
+        """
+        Path of a file or folder inside a `ZipArchive`. Implements the parts of the interface of pathlib.Path that
+        FileTree datasets use to read their files, so datasets can be read from an archive without extracting it.
+        Use `load_npy` to load .npy files from both kinds of paths.
+
+        Args:
+            archive (ZipArchive): the archive
+            at (str): path inside the archive, without leading or trailing slash
+        """
+        self.archive = archive
+        self.at = at
+
+    def __truediv__(self, other):
+        parts = [part for part in "{}/{}".format(self.at, other).split("/") if part]
+        return ZipPath(self.archive, "/".join(parts))
+
+    def __eq__(self, other):
+        return isinstance(other, ZipPath) and (self.archive.filename, self.at) == (other.archive.filename, other.at)
+
+    def __hash__(self):
+        return hash((self.archive.filename, self.at))
+
+    def __str__(self):
+        return "{}/{}".format(self.archive.filename, self.at) if self.at else self.archive.filename
+
+    def __repr__(self):
+        return "ZipPath({!r}, {!r})".format(self.archive.filename, self.at)
+
+    @property
+    def name(self):
+        return PurePosixPath(self.at).name
+
+    @property
+    def stem(self):
+        return PurePosixPath(self.at).stem
+
+    @property
+    def suffix(self):
+        return PurePosixPath(self.at).suffix
+
+    @property
+    def parent(self):
+        return ZipPath(self.archive, "/".join(self.at.split("/")[:-1]))
+
+    def with_suffix(self, suffix):
+        return ZipPath(self.archive, str(PurePosixPath(self.at).with_suffix(suffix)))
+
+    def absolute(self):
+        return self
+
+    def relative_to(self, other):
+        if other.at and not self.at.startswith(other.at + "/") and self.at != other.at:
+            raise ValueError("{} is not in {}".format(self, other))
+        return PurePosixPath(self.at[len(other.at) :].lstrip("/"))
+
+    def exists(self):
+        return self.is_dir() or self.is_file()
+
+    def is_dir(self):
+        return self.at in self.archive.children
+
+    def is_file(self):
+        return self.at in self.archive.members
+
+    def iterdir(self):
+        for name in sorted(self.archive.children.get(self.at, ())):
+            yield self / name
+
+    def glob(self, pattern):
+        """
+        Entries of this folder whose names match `pattern`. Only patterns without slashes are supported.
+        """
+        for name in fnmatch.filter(sorted(self.archive.children.get(self.at, ())), pattern):
+            yield self / name
+
+    def stat(self):
+        # members of an archive only change together with the archive
+        return os.stat(self.archive.filename)
+
+    def open(self, mode="r"):
+        if any(m in mode for m in "wax+"):
+            raise OSError("{} is inside a zip archive, which is read-only".format(self))
+        data = self.archive.read_bytes(self.at)
+        return io.BytesIO(data) if "b" in mode else io.StringIO(data.decode())
+
+    def load(self, mmap_mode=None):
+        return self.archive.load(self.at, mmap_mode=mmap_mode)
+
+
+def load_npy(path, mmap_mode=None):
+    """
+    Loads a .npy file like np.load, from a pathlib.Path or from a `ZipPath` inside an archive
+    """
+    if isinstance(path, ZipPath):
+        return path.load(mmap_mode=mmap_mode)
+    return np.load(path, mmap_mode=mmap_mode)
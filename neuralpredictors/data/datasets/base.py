@@ -1,21 +1,26 @@
+import copy
 import json
 import logging
-from collections import namedtuple
+import os
 from datetime import datetime
 from pathlib import Path
-from zipfile import ZipFile
-import os
+from zipfile import ZIP_DEFLATED, ZipFile
 
+import h5py
 import numpy as np
 from torch.utils.data import Dataset
 
-from ...utils import no_transforms
 from ..exceptions import DoesNotExistException, InconsistentDataException
 from ..transforms import DataTransform, Invertible
-from ..utils import zip_dir
+from ..utils import datapoint_class, to_storage_dtype, zip_dir
+from .archive import ZipArchive, load_npy
+from .shared import SHARED_MEMORY_ROOT, publish_arrays, shared_memory_available, shared_session_dir
 
 logger = logging.getLogger(__name__)
 
+# dtype that data kept in a smaller storage dtype (see `FileTreeDatasetBase.set_storage_dtypes`) is cast to when loaded
+COMPUTE_DTYPE = np.float32
+
 
 class AttributeHandler:
     def __init__(self, name, h5_handle):
@@ -49,6 +54,54 @@ class AttributeHandler:
         return attrs.union(set(self.h5_handle[self.name].keys()))
 
 
+class LazyH5File:
+    def __init__(self, filename, chunk_cache_bytes=None, chunk_cache_slots=None):
+        """
+        Read-only handle of an hdf5 file that is opened on first access in every process. HDF5 handles cannot be
+        shared between processes, so a handle opened before a DataLoader forks its workers is not used by them: each
+        worker opens its own. Pickling the handle (e.g. for workers that are spawned) only keeps the file name.
+
+        Args:
+            filename: filename of the hdf5 file
+            chunk_cache_bytes (int, optional): size of the HDF5 chunk cache of every dataset in the file
+                (rdcc_nbytes of h5py.File). Defaults to the HDF5 default of 1 MB.
+            chunk_cache_slots (int, optional): number of hash table slots of the chunk cache (rdcc_nslots of
+                h5py.File), should be a prime about 100 times the number of chunks that fit into the cache.
+        """
+        self.filename = filename
+        self.chunk_cache_bytes = chunk_cache_bytes
+        self.chunk_cache_slots = chunk_cache_slots
+        self._fid = None
+        self._pid = None
+
+    @property
+    def file(self):
+        """
+        Returns:
+            h5py.File: the handle of the file in the current process
+        """
+        if self._fid is None or self._pid != os.getpid():
+            kwargs = {}
+            if self.chunk_cache_bytes is not None:
+                kwargs["rdcc_nbytes"] = self.chunk_cache_bytes
+            if self.chunk_cache_slots is not None:
+                kwargs["rdcc_nslots"] = self.chunk_cache_slots
+            self._fid = h5py.File(self.filename, "r", **kwargs)
+            self._pid = os.getpid()
+        return self._fid
+
+    def close(self):
+        if self._fid is not None and self._pid == os.getpid():
+            self._fid.close()
+        self._fid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_fid"] = None
+        state["_pid"] = None
+        return state
+
+
 class AttributeTransformer(AttributeHandler):
     def __init__(self, name, h5_handle, transforms, data_group):
         """
@@ -73,7 +126,7 @@ class AttributeTransformer(AttributeHandler):
         return ret[self.data_group]
 
 
-default_image_datapoint = namedtuple("DefaultDataPoint", ["images", "responses"])
+default_image_datapoint = datapoint_class(["images", "responses"], name="DefaultDataPoint")
 
 
 class TransformDataset(Dataset):
@@ -88,11 +141,10 @@ class TransformDataset(Dataset):
 
         self.data_keys = data_keys
         if set(data_keys) == {"images", "responses"}:
-            # this version IS serializable in pickle
             self.data_point = default_image_datapoint
         else:
-            # this version is NOT - you cannot use this with a dataloader with num_workers > 1
-            self.data_point = namedtuple("DataPoint", data_keys)
+            # serializable in pickle, so it can be used with a dataloader with num_workers > 0
+            self.data_point = datapoint_class(data_keys)
 
     def transform(self, x, exclude=None):
         """
@@ -130,28 +182,41 @@ class TransformDataset(Dataset):
 
 
 class DirectoryAttributeHandler:
-    def __init__(self, path, links=None):
+    def __init__(self, path, links=None, cache=None):
         """
         Class that can be used to represent a subdirectory of a FileTree as a property in a FileTree dataset.
         Args:
             path (pathlib.Path object): path to the subdiretory
             links (dict, optional): rename mapping for entries within the `path`. Defaults to None, in which case
                 no name mapping is performed when fetching the attribute.
+            cache (dict, optional): arrays that were already loaded, by path. Arrays are loaded once into it and a
+                copy is returned on every access. Handlers of subdirectories share the cache. Defaults to None, in
+                which case the arrays are loaded on every access.
         """
         self.links = links or {}
         self.path = path
+        self.cache = cache
 
     def __getattr__(self, item):
+        if item in ("links", "path", "cache") or item.startswith("__"):
+            # not set yet, e.g. while unpickling
+            raise AttributeError(item)
         item_path = self.resolve_item_path(item)
+        if self.cache is not None and item_path in self.cache:
+            val = self.cache[item_path]
+            return val.copy() if isinstance(val, np.ndarray) else val
 
         if item_path.exists() and item_path.is_dir():
-            val = DirectoryAttributeHandler(item_path, links=self.links)
+            val = DirectoryAttributeHandler(item_path, links=self.links, cache=self.cache)
         else:
             data_path = item_path.with_suffix(".npy")
             if data_path.exists() and data_path.is_file():
-                val = np.load(data_path)
+                val = load_npy(data_path)
             else:
                 raise AttributeError("Attribute {} not found".format(item))
+        if self.cache is not None:
+            self.cache[item_path] = val
+            return val.copy() if isinstance(val, np.ndarray) else val
         return val
 
     def resolve_item_path(self, item):
@@ -182,7 +247,7 @@ class DirectoryAttributeHandler:
 
 
 class DirectoryAttributeTransformer(DirectoryAttributeHandler):
-    def __init__(self, path, transforms, data_group, links=None):
+    def __init__(self, path, transforms, data_group, links=None, cache=None, index=None):
         """
         Class that can be used to represent a subdirectory of a FileTree as a property in a FileTree dataset.
         Like DirectoryAttributeHandler but allows for id_transform of transforms to be applied to the
@@ -193,25 +258,119 @@ class DirectoryAttributeTransformer(DirectoryAttributeHandler):
             data_group (str): Name of data_group that the transforms should be applied as
             links (dict, optional): rename mapping for entries within the `path`. Defaults to None, in which case
                 no name mapping is performed when fetching the attribute.
+            cache (dict, optional): see DirectoryAttributeHandler. The untransformed arrays are cached, the
+                transforms are applied on every access.
+            index (numpy index, optional): entries selected before the transforms are applied, e.g. the neurons
+                kept by FileTreeDataset.select_neurons. Defaults to None, in which case all entries are kept.
         """
 
-        super().__init__(path, links=links)
+        super().__init__(path, links=links, cache=cache)
         self.transforms = transforms
         self.data_group = data_group
+        self.index = index
 
     def __getattr__(self, item):
-        ret = {self.data_group: super().__getattr__(item)}
+        if item in ("transforms", "data_group", "index"):
+            raise AttributeError(item)
+        val = super().__getattr__(item)
+        if self.index is not None and isinstance(val, np.ndarray):
+            val = val[self.index]
+        ret = {self.data_group: val}
         for tr in self.transforms:
             ret = tr.id_transform(ret)
         return ret[self.data_group]
 
 
+class FileTreeIndex:
+    def __init__(self, basepath, config_file, default_config=None):
+        """
+        In-memory index of the FileTree metadata that is needed to load items: the content of config.json,
+        the resolved data directories and the arrays in meta/trials. Paths and arrays are resolved once and
+        then served from memory, so that loading an item does not touch the file system metadata. The arrays of
+        meta/ that are read through the dataset properties (neurons, trial_info and statistics) are kept in
+        `metadata`.
+
+        The index does not watch the file tree by itself. Use `is_stale` to check whether the modification
+        times of the dataset directory, data/, meta/trials, meta/neurons, meta/statistics or config.json changed
+        since it was built. Files that are replaced inside subfolders of meta/statistics are not detected, rebuild
+        the index with `FileTreeDatasetBase.refresh_index(force=True)` after rewriting them.
+
+        Args:
+            basepath (pathlib.Path or ZipPath object): root directory of the dataset
+            config_file (pathlib.Path or ZipPath object): path to config.json of the dataset
+            default_config (dict, optional): config used if config.json does not exist, e.g. in a read-only archive
+        """
+        self.basepath = basepath
+        self.config_file = config_file
+        self._mtimes = self._read_mtimes()
+
+        if config_file.exists() or default_config is None:
+            with config_file.open() as fid:
+                self.config = json.load(fid)
+        else:
+            self.config = copy.deepcopy(default_config)
+        self.links = self.config.get("links", {})
+        self.trial_info_keys = frozenset(e.stem for e in (basepath / "meta/trials").glob("*"))
+
+        self._data_paths = {}
+        self._trial_info = {}
+        self.metadata = {}
+
+    def _read_mtimes(self):
+        paths = (
+            self.basepath,
+            self.basepath / "data",
+            self.basepath / "meta/trials",
+            self.basepath / "meta/neurons",
+            self.basepath / "meta/statistics",
+            self.config_file,
+        )
+        return tuple(path.stat().st_mtime_ns if path.exists() else None for path in paths)
+
+    def is_stale(self):
+        """
+        Returns:
+            bool: True if the watched directories or config.json were modified since the index was built
+        """
+        return self._read_mtimes() != self._mtimes
+
+    def data_path(self, data_key):
+        """
+        Resolves the folder of `data_key` within basepath/data, taking "links" in the config into account.
+        See `FileTreeDatasetBase.resolve_data_path`.
+        """
+        if data_key not in self._data_paths:
+            datapath = self.basepath / "data" / self.links.get(data_key, data_key)
+            if not datapath.exists() or not datapath.is_dir():
+                raise DoesNotExistException("Data path {} is not a valid directory".format(datapath))
+            self._data_paths[data_key] = datapath
+        return self._data_paths[data_key]
+
+    def trial_info(self, key):
+        """
+        Returns:
+            np.array: the array meta/trials/`key`.npy, loaded on first access
+        """
+        if key not in self._trial_info:
+            self._trial_info[key] = load_npy(self.basepath / "meta/trials" / "{}.npy".format(key))
+        return self._trial_info[key]
+
+
 class FileTreeDatasetBase(TransformDataset):
     _default_config = {"links": {}}
     # specify list of transform types that are acceptable
     _transform_types = (DataTransform,)
 
-    def __init__(self, dirname, *data_keys, transforms=None, use_cache=True, output_rename=None, output_dict=False):
+    def __init__(
+        self,
+        dirname,
+        *data_keys,
+        transforms=None,
+        use_cache=True,
+        output_rename=None,
+        output_dict=False,
+        unzip=True,
+    ):
         """
         Dataset stored as a file tree. The tree needs to have the subdirs data, meta, meta/neurons, meta/statistics,
         and meta/trials. Please refer to convert_static_h5_dataset_to_folder in neuralpredictors.data.utils for an
@@ -292,9 +451,12 @@ class FileTreeDatasetBase(TransformDataset):
             └── trials [12 entries]
 
         Args:
-            dirname:     root directory name
+            dirname:     root directory name, or zip file of the directory (see `zip`)
             *data_keys:  data items to be extraced (must be subdirectories of root/data)
             transforms:  transforms to be applied to the data (see TransformDataset)
+            unzip:       if dirname is a zip file, extract it next to the zip file (if not done before). Otherwise,
+                         the data is read directly from the archive (see archive.ZipArchive), which is fastest if
+                         the archive is not compressed. The dataset is read-only then.
         """
         super().__init__(*data_keys, transforms=transforms)
 
@@ -310,10 +472,13 @@ class FileTreeDatasetBase(TransformDataset):
         self.rename_output = bool(output_rename)
         self._output_rename = output_rename
         renamed_keys = [output_rename.get(k, k) for k in data_keys]
-        self._output_point = namedtuple("OutputPoint", renamed_keys) if output_rename else self.data_point
+        self._output_point = datapoint_class(renamed_keys, name="OutputPoint") if output_rename else self.data_point
 
-        # if dirname is a zip file, auto expand into the container folder
-        if dirname.endswith(".zip"):
+        # if dirname is a zip file, auto expand into the container folder or read from the archive
+        self.archive = None
+        if dirname.endswith(".zip") and not unzip:
+            self.archive = ZipArchive(dirname)
+        elif dirname.endswith(".zip"):
             if not Path(dirname[:-4]).exists():
                 self.unzip(dirname, Path(dirname).absolute().parent)
             else:
@@ -321,12 +486,14 @@ class FileTreeDatasetBase(TransformDataset):
             dirname = dirname[:-4]
 
         self.dirname = dirname
-        self.basepath = Path(dirname).absolute()
+        self.basepath = self.archive.root if self.archive is not None else Path(dirname).absolute()
         self._config_file = self.basepath / "config.json"
 
-        # if no config file, create one based on default config
-        if not self._config_file.exists():
+        # if no config file, create one based on default config (archives fall back to the default config)
+        self._index = None
+        if not self._config_file.exists() and self.archive is None:
             self._save_config(self._default_config)
+        self.refresh_index()
 
         # verify that valid data path exists for each data_key and count number of files
         for data_key in data_keys:
@@ -336,11 +503,14 @@ class FileTreeDatasetBase(TransformDataset):
                 # only one combined file in merged_data => do not perform this check
                 continue
                 
-            if data_key not in self.trial_info.keys():
+            if data_key in self._index.trial_info_keys:
+                number_of_files.append(len(self._index.trial_info(data_key)))
+            elif self._only_in_merged_data(data_key):
+                # consolidated layout (see convert_static_h5_dataset_to_folder): the number of trials is in the header
+                number_of_files.append(load_npy(self.merged_data_path(data_key), mmap_mode="r").shape[0])
+            else:
                 datapath = self.resolve_data_path(data_key)
                 number_of_files.append(len(list(datapath.glob("*"))))
-            else:
-                number_of_files.append(len(self.trial_info[data_key]))
 
         # verify that all data_keys directories contain identical number of files (= number of data points)
         if not np.all(np.diff(number_of_files) == 0):
@@ -349,6 +519,16 @@ class FileTreeDatasetBase(TransformDataset):
         self._len = number_of_files[0]
 
         self._cache = {data_key: {} for data_key in data_keys}
+        # arrays with all trials of a data_key from merged_data, memory-mapped (see `memory_map_merged_data`)
+        # or in RAM (see `load_data_to_cache`)
+        self._merged_data = {}
+        # data_key -> path of the copy of its matrix in shared memory (see `share_merged_data`)
+        self._shared_paths = {}
+        # data_key -> dtype its data is kept in (see `set_storage_dtypes`)
+        self._storage_dtypes = {}
+        # positions of the neurons kept in the responses and their axis in a trial (see `select_neurons`)
+        self._neuron_idx = None
+        self._neuron_axis = -1
 
     def resolve_data_path(self, data_key):
         """
@@ -366,13 +546,22 @@ class FileTreeDatasetBase(TransformDataset):
         Returns:
             pathlib.Path object: Valid directory path to the target data_group
         """
-        if self.link_exists(data_key):
-            data_key = self.config["links"][data_key]
-        datapath = self.basepath / "data" / data_key
+        return self.refresh_index().data_path(data_key)
 
-        if not datapath.exists() or not datapath.is_dir():
-            raise DoesNotExistException("Data path {} is not a valid directory".format(datapath))
-        return datapath
+    def refresh_index(self, force=False):
+        """
+        Rebuilds the metadata index (see `FileTreeIndex`) if the file tree changed since it was built.
+        Loading items uses the index without this check.
+
+        Args:
+            force (bool, optional): rebuild the index even if no change was detected. Defaults to False.
+
+        Returns:
+            FileTreeIndex: the current metadata index
+        """
+        if force or self._index is None or self._index.is_stale():
+            self._index = FileTreeIndex(self.basepath, self._config_file, default_config=self._default_config)
+        return self._index
 
     @staticmethod
     def unzip(filename, path):
@@ -397,52 +586,201 @@ class FileTreeDatasetBase(TransformDataset):
         Returns:
             bool: True if a relevant entry is found in "links" config
         """
-        return "links" in self.config and link in self.config["links"]
+        return link in self.refresh_index().links
 
     @property
     def config(self):
-        with open(self._config_file) as fid:
-            return json.load(fid)
+        return copy.deepcopy(self.refresh_index().config)
 
     def _save_config(self, cfg):
         with open(self._config_file, "w") as fid:
-            return json.dump(cfg, fid)
+            json.dump(cfg, fid)
+        self.refresh_index(force=True)
 
     def __len__(self):
         return self._len
 
+    def _from_storage(self, data_key, val):
+        # data kept in a storage dtype is cast to COMPUTE_DTYPE before the transforms, for single items and batches
+        return val.astype(COMPUTE_DTYPE) if data_key in self._storage_dtypes else val
+
+    @property
+    def _neurons_group(self):
+        return "responses" if "responses" in self.data_keys else "targets"
+
+    @property
+    def neuron_idx(self):
+        """
+        Positions (in meta/neurons) of the neurons in the responses of the dataset, None if all neurons are kept,
+        see `select_neurons`
+        """
+        return self._neuron_idx
+
+    def _unselected(self, data_key):
+        """
+        Returns:
+            bool: True if `data_key` holds the responses and the matrix in merged_data still has all neurons, because
+                it is memory-mapped. The neurons are then selected when the trials are read.
+        """
+        return (
+            self._neuron_idx is not None
+            and data_key == self._neurons_group
+            and isinstance(self._merged_data.get(data_key), np.memmap)
+        )
+
+    def _select(self, data_key, val, batch=False):
+        """ Selects the neurons of `select_neurons` from the responses `val` of one trial, or of a batch """
+        if self._neuron_idx is None or data_key != self._neurons_group:
+            return val
+        axis = self._neuron_axis + (batch and self._neuron_axis >= 0)
+        # a copy in RAM, also if `val` is memory-mapped
+        return np.asarray(np.take(val, self._neuron_idx, axis=axis))
+
+    def select_neurons(self, idx, axis=-1):
+        """
+        Keeps only the neurons `idx` in the responses, instead of selecting them from every trial with a Subsample
+        transform: matrices of merged_data in RAM (see `load_data_to_cache`) and the cached trials are subset once,
+        trials read from disk or from memory-mapped matrices (which stay shared between processes) are subset when
+        they are loaded. The copies of the trials, the cache and the transforms then scale with the number of
+        selected neurons. The neuron metadata (`neurons`) is subset to the same neurons. Can be called before or
+        after the data is preloaded, and again to select a subset of the selected neurons.
+
+        Args:
+            idx (numpy index): positions of the neurons to keep, 1d list of indices or boolean array
+            axis (int): axis of the neurons in the responses of one trial, e.g. 0 for responses of shape
+                (neurons, time) of movies
+        """
+        idx = np.asarray(idx)
+        if idx.ndim != 1:
+            raise ValueError("Dimensionality of index array has to be 1")
+        if idx.dtype == bool:
+            idx = np.where(idx)[0]
+        if self._neuron_idx is not None and axis != self._neuron_axis:
+            raise ValueError("The neurons were selected on axis {} before".format(self._neuron_axis))
+
+        data_key = self._neurons_group
+        if data_key in self._merged_data and not isinstance(self._merged_data[data_key], np.memmap):
+            data = np.take(self._merged_data[data_key], idx, axis=axis + (axis >= 0))
+            self._merged_data[data_key] = data
+            self._cache[data_key] = {trial: data[trial] for trial in self._cache[data_key]}
+        else:
+            self._cache[data_key] = {k: np.take(v, idx, axis=axis) for k, v in self._cache[data_key].items()}
+        self._neuron_idx = idx if self._neuron_idx is None else self._neuron_idx[idx]
+        self._neuron_axis = axis
+
+    def _load(self, data_key, item):
+        """
+        Loads the untransformed value of `data_key` for a single item from the cache, merged_data or disk
+        """
+        if self.use_cache and item in self._cache[data_key]:
+            return self._from_storage(data_key, self._cache[data_key][item])
+        if data_key in self._merged_data:
+            val = self._merged_data[data_key][item]
+            if self._unselected(data_key):
+                # only the selected neurons are copied out of the memory map
+                return self._from_storage(data_key, self._select(data_key, val))
+            # copy the trial out of the memory map, only its pages are read from disk
+            return self._from_storage(data_key, val) if data_key in self._storage_dtypes else np.array(val)
+
+        index = self._index
+        if data_key in index.trial_info_keys:
+            val = index.trial_info(data_key)[item : item + 1]
+        else:
+            val = self._select(data_key, load_npy(index.data_path(data_key) / "{}.npy".format(item)))
+        if data_key in self._storage_dtypes:
+            # also when the cache is not used, so that every epoch sees the same values
+            val = to_storage_dtype(val, self._storage_dtypes[data_key])
+        if self.use_cache:
+            self._cache[data_key][item] = val
+        return self._from_storage(data_key, val)
+
+    def _output(self, x):
+        # apply output rename if necessary
+        if self.rename_output:
+            x = self._output_point(*x)
+
+        if self.output_dict:
+            x = x._asdict()
+
+        return x
+
     def __getitem__(self, item):
-        # load data from cache or disk
+        if isinstance(item, (list, tuple, np.ndarray)):
+            return self.get_batch(item)
+
+        # load data from cache or disk and create data point
+        x = self.data_point(*(self._load(data_key, item) for data_key in self.data_keys))
+
+        for tr in self.transforms:
+            # ensure only specified types of transforms are used
+            assert isinstance(tr, self._transform_types)
+            x = tr.indexed_transform(x, item)
+
+        return self._output(x)
+
+    def get_batch(self, items):
+        """
+        Loads several items at once and applies the transforms to the whole batch, see `DataTransform.batch_transform`.
+        Data in merged_data (see `load_data_to_cache` and `memory_map_merged_data`) is gathered with a single
+        indexing operation per data_key. Indexing the dataset with a list of items calls this method, so it can be
+        used in a DataLoader with a BatchSampler as sampler and batch_size=None.
+
+        Args:
+            items (list or np.array): indices of the items in the batch
+
+        Returns:
+            data point, whose entries have the batch as first dimension
+        """
         ret = []
         for data_key in self.data_keys:
-            if self.use_cache and item in self._cache[data_key]:
-                ret.append(self._cache[data_key][item])
+            if self._unselected(data_key) and self._merged_data[data_key].ndim == 2:
+                # gathers only the selected neurons of the trials from the memory map
+                data = self._merged_data[data_key][np.ix_(np.asarray(items), self._neuron_idx)]
+                ret.append(self._from_storage(data_key, data))
+            elif self._unselected(data_key):
+                data = np.asarray(self._merged_data[data_key][np.asarray(items)])
+                ret.append(self._from_storage(data_key, self._select(data_key, data, batch=True)))
+            elif data_key in self._merged_data:
+                ret.append(self._from_storage(data_key, np.asarray(self._merged_data[data_key][np.asarray(items)])))
             else:
-                if data_key in self.trial_info.keys():
-                    val = self.trial_info[data_key][item : item + 1]
-                else:
-                    datapath = self.resolve_data_path(data_key)
-                    val = np.load(datapath / "{}.npy".format(item))
-                if self.use_cache:
-                    self._cache[data_key][item] = val
-                ret.append(val)
-
-        # create data point and transform
+                ret.append(np.stack([self._load(data_key, item) for item in items]))
         x = self.data_point(*ret)
 
         for tr in self.transforms:
             # ensure only specified types of transforms are used
             assert isinstance(tr, self._transform_types)
-            x = tr(x)
+            x = tr.indexed_batch_transform(x, items)
 
-        # apply output rename if necessary
-        if self.rename_output:
-            x = self._output_point(*x)
+        return self._output(x)
 
-        if self.output_dict:
-            x = x._asdict()
+    def merged_data_path(self, data_key):
+        """
+        Path to the .npy matrix in the folder 'merged_data' that holds all trials of `data_key`
 
-        return x
+        Args:
+            data_key (str): data_key for which the merged matrix is requested
+
+        Raises:
+            DoesNotExistException: If the merged_data folder has not been created yet.
+
+        Returns:
+            pathlib.Path object: Path to the merged matrix of shape (nr_trials, *)
+        """
+        merged_data_folder = self.basepath / "merged_data"
+        if not merged_data_folder.exists():
+            raise DoesNotExistException(
+                "The merged_data folder has not been created yet. Use preload_from_merged_data=False "
+                "or create this folder with the notebook 01_create_additinal_variables.ipynb"
+            )
+        return merged_data_folder / "{}.npy".format(data_key)
+
+    def _only_in_merged_data(self, data_key):
+        """
+        Returns:
+            bool: True if `data_key` has a matrix in merged_data, but no folder with one file per trial in data
+        """
+        datapath = self.basepath / "data" / self._index.links.get(data_key, data_key)
+        return not datapath.is_dir() and (self.basepath / "merged_data" / "{}.npy".format(data_key)).exists()
 
     def load_data_to_cache(self):
         """ Load all data into the cache based on .npy matricies in folder 'merged_data'
@@ -452,20 +790,128 @@ class FileTreeDatasetBase(TransformDataset):
         
         Adrian 2022-09-24 """
         
-        merged_data_folder = os.path.join(self.dirname, 'merged_data')
-        if not os.path.exists( merged_data_folder ):
-            raise Exception(
-                "The merged_data folder has not been created yet. Use preload_from_merged_data=False "
-                "or create this folder with the notebook 01_create_additinal_variables.ipynb"
-            )
         for data_key in self.data_keys:  
-            file_name = os.path.join(merged_data_folder, '{}.npy'.format(data_key))
-            data = np.load( file_name )  # matrix with shape: (nr_trials, *)
+            if data_key in self._storage_dtypes:
+                # converted block by block from the memory map, the full precision matrix is never in RAM
+                data = load_npy(self.merged_data_path(data_key), mmap_mode="r")
+                data = to_storage_dtype(self._select(data_key, data, batch=True), self._storage_dtypes[data_key])
+            elif self._neuron_idx is not None and data_key == self._neurons_group:
+                # only the selected neurons are read into RAM (see `select_neurons`)
+                data = self._select(data_key, load_npy(self.merged_data_path(data_key), mmap_mode="r"), batch=True)
+            else:
+                data = load_npy(self.merged_data_path(data_key))  # matrix with shape: (nr_trials, *)
             
             # add the individual trials to the cache
             for trial in range( data.shape[0] ):
                 self._cache[data_key][trial] = data[trial]
-            
+            # keep the full matrix to gather batches with one indexing operation (see get_batch)
+            self._merged_data[data_key] = data
+
+    def set_storage_dtypes(self, storage_dtypes):
+        """
+        Keeps the data of some data_keys in a smaller dtype in the cache and in the matrices of merged_data, e.g.
+        {"images": "uint8", "responses": "float16"}. The data is converted when it is loaded (see `to_storage_dtype`,
+        conversions that change the values raise a ValueError) and cast to COMPUTE_DTYPE (float32) for every item
+        or batch before the transforms, so the normalization and rescaling are computed in float32.
+
+        Call this before `load_data_to_cache` or `share_merged_data`, which then store the matrices in these dtypes.
+        Matrices memory-mapped from disk with `memory_map_merged_data` keep the dtype of the files.
+
+        Args:
+            storage_dtypes (dict): data_key -> dtype
+        """
+        memory_mapped = [k for k in storage_dtypes if isinstance(self._merged_data.get(k), np.memmap)]
+        if memory_mapped:
+            raise ValueError(
+                "{} are memory-mapped and cannot be converted: memory-mapped files keep their on-disk dtype. Set "
+                "the storage dtypes before calling share_merged_data; they cannot be used together with "
+                "memory_map_merged_data".format(memory_mapped)
+            )
+
+        self._storage_dtypes = {k: np.dtype(v) for k, v in storage_dtypes.items() if k in self.data_keys}
+        for data_key, dtype in self._storage_dtypes.items():
+            if data_key in self._merged_data:
+                self._merged_data[data_key] = to_storage_dtype(self._merged_data[data_key], dtype)
+                data = self._merged_data[data_key]
+                self._cache[data_key] = {trial: data[trial] for trial in self._cache[data_key]}
+            else:
+                self._cache[data_key] = {k: to_storage_dtype(v, dtype) for k, v in self._cache[data_key].items()}
+
+    def memory_map_merged_data(self, mmap_mode="r"):
+        """
+        Serve all data_keys from memory-mapped .npy matrices in the folder 'merged_data'.
+
+        In contrast to `load_data_to_cache`, the matrices are not copied into RAM. Each item only reads the
+        pages of its own trial, which the OS keeps in the page cache and shares between processes reading
+        the same session. Items served from the memory map are not added to the cache.
+
+        Args:
+            mmap_mode (str, optional): mode passed on to `np.load`. Defaults to "r" (read-only).
+        """
+        merged_data = {}
+        for data_key in self.data_keys:
+            data = load_npy(self.merged_data_path(data_key), mmap_mode=mmap_mode)
+            if data.shape[0] != self._len:
+                raise InconsistentDataException(
+                    "merged_data/{}.npy has {} trials, but the dataset has {}".format(data_key, data.shape[0], self._len)
+                )
+            merged_data[data_key] = data
+        self._merged_data = merged_data
+
+    def share_merged_data(self, root=SHARED_MEMORY_ROOT):
+        """
+        Serve all data_keys from copies of the .npy matrices in the folder 'merged_data' in shared memory, which all
+        processes on the node that read this session use together: the first process copies the matrices to `root`,
+        the others wait for it and memory-map the same copies read-only. Concurrent trainings (e.g. the members of
+        an ensemble) then hold the data in RAM once, instead of once per process as with `load_data_to_cache`.
+
+        The copies stay in shared memory when the processes exit, so later trainings on the node can reuse them.
+        Remove unused sessions with `neuralpredictors.data.datasets.shared.remove_shared_sessions`.
+
+        Falls back to `memory_map_merged_data` if shared memory is not available (e.g. on Windows) or too small.
+
+        Args:
+            root (str, optional): folder in shared memory for the copies. Defaults to SHARED_MEMORY_ROOT.
+        """
+        sources = {data_key: self.merged_data_path(data_key) for data_key in self.data_keys}
+        n_bytes = sum(source.stat().st_size for source in sources.values()) if self.archive is None else 0
+        if not shared_memory_available(root, n_bytes):
+            logger.warning("Shared memory at %s is not available, memory-mapping merged_data instead", root)
+            self.memory_map_merged_data()
+            return
+
+        shared_paths = publish_arrays(sources, shared_session_dir(self.basepath, root), dtypes=self._storage_dtypes)
+        merged_data = {}
+        for data_key, path in shared_paths.items():
+            data = np.load(path, mmap_mode="r")
+            if data.shape[0] != self._len:
+                raise InconsistentDataException(
+                    "merged_data/{}.npy has {} trials, but the dataset has {}".format(data_key, data.shape[0], self._len)
+                )
+            merged_data[data_key] = data
+        self._merged_data = merged_data
+        self._shared_paths = shared_paths
+
+    def __getstate__(self):
+        # pickling happens e.g. for DataLoader workers that are not forked. Memory maps are reopened instead of
+        # copying their content, and the cached trials of matrices loaded into RAM are rebuilt as views of the matrix
+        state = self.__dict__.copy()
+        state["_merged_data"] = {k: v for k, v in self._merged_data.items() if not isinstance(v, np.memmap)}
+        state["_memory_mapped"] = {k: v.mode for k, v in self._merged_data.items() if isinstance(v, np.memmap)}
+        state["_cache"] = {k: {} if k in state["_merged_data"] else v for k, v in self._cache.items()}
+        return state
+
+    def __setstate__(self, state):
+        memory_mapped = state.pop("_memory_mapped")
+        self.__dict__.update(state)
+        for data_key, data in self._merged_data.items():
+            self._cache[data_key] = {trial: data[trial] for trial in range(data.shape[0])}
+        for data_key, mmap_mode in memory_mapped.items():
+            if data_key in self.__dict__.get("_shared_paths", {}):
+                # the process that pickled the dataset keeps the copy in shared memory in use
+                self._merged_data[data_key] = np.load(self._shared_paths[data_key], mmap_mode=mmap_mode)
+            else:
+                self._merged_data[data_key] = load_npy(self.merged_data_path(data_key), mmap_mode=mmap_mode)
 
     def add_log_entry(self, msg):
         """
@@ -487,17 +933,18 @@ class FileTreeDatasetBase(TransformDataset):
             with open(self.basepath / "change.log", "r") as fid:
                 logger.info("".join(fid.readlines()))
 
-    def zip(self, filename=None):
+    def zip(self, filename=None, compression=ZIP_DEFLATED):
         """
         Zips current dataset.
 
         Args:
             filename:  Filename for the zip. Directory name + zip by default.
+            compression:  compression of the zip file, see `zip_dir`
         """
 
         if filename is None:
             filename = str(self.basepath) + ".zip"
-        zip_dir(filename, self.basepath)
+        zip_dir(filename, self.basepath, compression=compression)
 
     def add_link(self, attr, new_name):
         """
@@ -521,21 +968,25 @@ class FileTreeDatasetBase(TransformDataset):
         config["links"][new_name] = attr
         self._save_config(config)
 
+    # the arrays of the metadata properties are loaded once and cached in the index (see FileTreeIndex)
     @property
     def neurons(self):
         return DirectoryAttributeTransformer(
             self.basepath / "meta/neurons",
             self.transforms,
-            data_group="responses" if "responses" in self.data_keys else "targets",
+            data_group=self._neurons_group,
+            cache=self.refresh_index().metadata,
+            index=self._neuron_idx,
         )
 
     @property
     def trial_info(self):
-        return DirectoryAttributeHandler(self.basepath / "meta/trials")
+        return DirectoryAttributeHandler(self.basepath / "meta/trials", cache=self.refresh_index().metadata)
 
     @property
     def statistics(self):
-        return DirectoryAttributeHandler(self.basepath / "meta/statistics", self.config["links"])
+        index = self.refresh_index()
+        return DirectoryAttributeHandler(self.basepath / "meta/statistics", index.links, cache=index.metadata)
 
     @staticmethod
     def match_order(target, permuted, not_exist_ok=False):
@@ -575,17 +1026,18 @@ class FileTreeDatasetBase(TransformDataset):
                 in which case missing values are filled with NaN
         """
 
-        with no_transforms(self):
-
-            if not self.n_neurons == len(values):
-                raise InconsistentDataException(
-                    f"Number of values ({len(values)}) and neurons in the datasets ({self.n_neurons}) is not consistent."
-                )
+        # the metadata of all neurons, also if only some are selected (see `select_neurons`)
+        neurons = DirectoryAttributeHandler(self.basepath / "meta/neurons", cache=self.refresh_index().metadata)
+        n_neurons = len(neurons.unit_ids)
+        if not n_neurons == len(values):
+            raise InconsistentDataException(
+                f"Number of values ({len(values)}) and neurons in the datasets ({n_neurons}) is not consistent."
+            )
 
         if not len(animal_id) == len(session) == len(scan_idx) == len(unit_id) == len(values):
             raise InconsistentDataException("number of trials and identifiers not consistent")
 
-        target = np.c_[(self.neurons.animal_ids, self.neurons.sessions, self.neurons.scan_idx, self.neurons.unit_ids)]
+        target = np.c_[(neurons.animal_ids, neurons.sessions, neurons.scan_idx, neurons.unit_ids)]
         permuted = np.c_[(animal_id, session, scan_idx, unit_id)]
 
         vals = np.ones((len(target),) + values.shape[1:], dtype=values.dtype) * (
@@ -1,21 +1,43 @@
-from collections import namedtuple
-
 import h5py
 import numpy as np
 from scipy.signal import convolve2d
 
 from ..transforms import DataTransform, Delay, MovieTransform, Subsequence
-from ..utils import recursively_load_dict_contents_from_group
+from ..utils import datapoint_class, recursively_load_dict_contents_from_group
 from .base import (
     AttributeTransformer,
     DirectoryAttributeHandler,
     FileTreeDatasetBase,
+    LazyH5File,
     TransformDataset,
 )
 
 
 class H5SequenceSet(TransformDataset):
-    def __init__(self, filename, *data_keys, output_rename=None, transforms=None, output_dict=False):
+    def __init__(
+        self,
+        filename,
+        *data_keys,
+        output_rename=None,
+        transforms=None,
+        output_dict=False,
+        chunk_cache_bytes=None,
+        chunk_cache_slots=None,
+    ):
+        """
+        Dataset for sequences stored in hdf5 files, with one hdf5 dataset per trial in the group of each data key.
+        The file is opened lazily in every process that reads from the dataset (see `LazyH5File`), so the dataset
+        can be used in a DataLoader with worker processes.
+
+        Args:
+            filename:       filename of the hdf5 file
+            *data_keys:     groups to be read from the file
+            output_rename:  dict renaming data keys in the output
+            transforms:     list of transforms applied to each datapoint
+            output_dict:    return the datapoints as dict instead of namedtuple
+            chunk_cache_bytes:  size of the HDF5 chunk cache of each dataset in bytes (default: HDF5 default of 1 MB)
+            chunk_cache_slots:  number of slots of the HDF5 chunk cache (default: HDF5 default)
+        """
         super().__init__(transforms=transforms)
 
         self.output_dict = output_dict
@@ -28,8 +50,8 @@ class H5SequenceSet(TransformDataset):
 
         self.output_rename = output_rename
 
-        self._fid = h5py.File(filename, "r")
-        self.data = self._fid
+        self._h5 = LazyH5File(filename, chunk_cache_bytes=chunk_cache_bytes, chunk_cache_slots=chunk_cache_slots)
+        self._content = None
         self.data_loaded = False
 
         # ensure that all elements of data_keys exist
@@ -48,20 +70,28 @@ class H5SequenceSet(TransformDataset):
         self.data_keys = data_keys
         self.transforms = transforms or []
 
-        self.data_point = namedtuple("DataPoint", data_keys)
+        self.data_point = datapoint_class(data_keys)
         renamed_keys = [output_rename.get(k, k) for k in data_keys]
-        self.output_point = namedtuple("OutputPoint", renamed_keys)
+        self.output_point = datapoint_class(renamed_keys, name="OutputPoint")
 
     def __dir__(self):
         attrs = set(super().__dir__())
         return attrs.union(set(self._fid.keys()))
 
+    @property
+    def _fid(self):
+        return self._h5.file
+
+    @property
+    def data(self):
+        return self._content if self.data_loaded else self._fid
+
     def load_content(self):
-        self.data = recursively_load_dict_contents_from_group(self._fid)
+        self._content = recursively_load_dict_contents_from_group(self._fid)
         self.data_loaded = True
 
     def unload_content(self):
-        self.data = self._fid
+        self._content = None
         self.data_loaded = False
 
     def __len__(self):
@@ -82,6 +112,9 @@ class H5SequenceSet(TransformDataset):
         return x
 
     def __getattr__(self, item):
+        if item.startswith("__") or "_h5" not in self.__dict__:
+            # special methods and attributes looked up before the dataset is initialized (e.g. while unpickling)
+            raise AttributeError(item)
         if item in self.data:
             item = self.data[item]
             if isinstance(item, h5py.Dataset):
@@ -109,8 +142,24 @@ class MovieSet(H5SequenceSet):
     it assumes that properties such as `neurons` and `stats` are present in the dataset.
     """
 
-    def __init__(self, filename, *data_groups, output_rename=None, transforms=None, stats_source="all"):
-        super().__init__(filename, *data_groups, output_rename=output_rename, transforms=transforms)
+    def __init__(
+        self,
+        filename,
+        *data_groups,
+        output_rename=None,
+        transforms=None,
+        stats_source="all",
+        chunk_cache_bytes=None,
+        chunk_cache_slots=None,
+    ):
+        super().__init__(
+            filename,
+            *data_groups,
+            output_rename=output_rename,
+            transforms=transforms,
+            chunk_cache_bytes=chunk_cache_bytes,
+            chunk_cache_slots=chunk_cache_slots,
+        )
         self.stats_source = stats_source
 
         # set to accept only MovieTransform
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+from ..utils import to_storage_dtype
+from .archive import load_npy
+
+logger = logging.getLogger(__name__)
+
+# folder in POSIX shared memory (tmpfs) that published sessions are copied to
+SHARED_MEMORY_ROOT = "/dev/shm/neuralpredictors"
+
+# held exclusively while arrays are copied into the folder of a session
+_PUBLISH_LOCK = "publish.lock"
+# held shared by every process that uses the arrays of a session, see `remove_shared_sessions`
+_USERS_LOCK = "users.lock"
+_MANIFEST = "manifest.json"
+
+# folder of a session -> file descriptor of its users lock, held by this process until it exits
+_attached = {}
+
+
+def shared_memory_available(root=SHARED_MEMORY_ROOT, n_bytes=0):
+    """
+    Returns:
+        bool: True if sessions can be published to `root`, i.e. if file locks are supported, the shared memory
+            file system exists and has at least `n_bytes` of free space
+    """
+    parent = Path(root).parent
+    return fcntl is not None and parent.is_dir() and shutil.disk_usage(str(parent)).free >= n_bytes
+
+
+def shared_session_dir(basepath, root=SHARED_MEMORY_ROOT):
+    """
+    Folder in `root` of the session at `basepath`. The name is unique for the absolute path of the session, so all
+    processes on a node that read the same session find the same folder.
+    """
+    digest = hashlib.sha1(str(basepath).encode()).hexdigest()[:12]
+    return Path(root) / "{}-{}".format(Path(str(basepath)).name, digest)
+
+
+def _lock(path, operation):
+    """
+    Opens the lock file `path` and locks it with flock. Returns the file descriptor, closing it releases the lock.
+    Retries if the file was removed (see `remove_shared_sessions`) while waiting for the lock.
+    """
+    while True:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o666)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, operation)
+            if os.path.exists(path) and os.stat(path).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+
+
+def _attach(shared_dir):
+    if shared_dir not in _attached:
+        _attached[shared_dir] = _lock(shared_dir / _USERS_LOCK, fcntl.LOCK_SH)
+
+
+def publish_arrays(sources, shared_dir, dtypes=None):
+    """
+    Copies the .npy files `sources` into `shared_dir`, unless an up-to-date copy is already there, and marks the
+    folder as used by this process. The first process publishes the files while holding a file lock, the others wait
+    for it and then find the copies. A copy is redone if its source or dtype changed (size or modification time),
+    processes that already use the old copy keep reading it.
+
+    Args:
+        sources (dict): name -> path of a .npy file (pathlib.Path or ZipPath)
+        shared_dir (pathlib.Path): folder of the session in shared memory, see `shared_session_dir`
+        dtypes (dict, optional): name -> dtype the copy is converted to (see `to_storage_dtype`), the other copies
+            keep the dtype of their source
+
+    Returns:
+        dict: name -> path of the copy in shared memory, memory-map it read-only to share its pages
+    """
+    _attach(shared_dir)
+
+    published = {}
+    fd = _lock(shared_dir / _PUBLISH_LOCK, fcntl.LOCK_EX)
+    try:
+        manifest_file = shared_dir / _MANIFEST
+        manifest = json.loads(manifest_file.read_text()) if manifest_file.exists() else {}
+        for name, source in sources.items():
+            stat = source.stat()
+            dtype = None if not dtypes or name not in dtypes else np.dtype(dtypes[name]).str
+            fingerprint = {"source": str(source), "bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns, "dtype": dtype}
+            target = shared_dir / "{}.npy".format(name)
+            if manifest.get(name) != fingerprint or not target.exists():
+                logger.info("Publishing %s to %s", source, target)
+                partial = target.with_name(target.name + ".partial")
+                if dtype is None:
+                    with source.open("rb") as fsrc, open(partial, "wb") as fdst:
+                        shutil.copyfileobj(fsrc, fdst, 16 * 1024 ** 2)
+                else:
+                    data = load_npy(source, mmap_mode="r")
+                    out = np.lib.format.open_memmap(str(partial), mode="w+", dtype=dtype, shape=data.shape)
+                    try:
+                        to_storage_dtype(data, dtype, out=out)
+                        out.flush()
+                    except BaseException:
+                        del out
+                        os.remove(partial)
+                        raise
+                    del out
+                os.replace(partial, target)
+                manifest[name] = fingerprint
+                manifest_partial = manifest_file.with_name(_MANIFEST + ".partial")
+                manifest_partial.write_text(json.dumps(manifest))
+                os.replace(manifest_partial, manifest_file)
+            published[name] = target
+    finally:
+        os.close(fd)
+    return published
+
+
+def remove_shared_sessions(root=SHARED_MEMORY_ROOT, basepaths=None):
+    """
+    Removes the sessions in `root` that no running process uses, to free the shared memory. The files of published
+    sessions stay in shared memory after the processes that used them exit, so that the next training on the node
+    does not have to copy them again.
+
+    Args:
+        root (str or Path): folder of the sessions in shared memory
+        basepaths (list, optional): only remove the copies of the sessions at these paths (absolute paths of the
+            folders or archives), defaults to all sessions
+
+    Returns:
+        list: folders that were removed
+    """
+    removed = []
+    if fcntl is None or not Path(root).is_dir():
+        return removed
+    if basepaths is None:
+        shared_dirs = sorted(Path(root).iterdir())
+    else:
+        shared_dirs = [shared_session_dir(basepath, root) for basepath in basepaths]
+    for shared_dir in shared_dirs:
+        if not shared_dir.is_dir() or shared_dir in _attached:
+            continue
+        fds = []
+        try:
+            # processes that wait for the locks of the removed folder retry with a new one, see `_lock`
+            for lock in (_USERS_LOCK, _PUBLISH_LOCK):
+                fds.append(os.open(str(shared_dir / lock), os.O_RDWR | os.O_CREAT, 0o666))
+                fcntl.flock(fds[-1], fcntl.LOCK_EX | fcntl.LOCK_NB)
+            shutil.rmtree(shared_dir, ignore_errors=True)
+            removed.append(shared_dir)
+        except BlockingIOError:
+            logger.info("%s is in use, not removing it", shared_dir)
+        finally:
+            for fd in fds:
+                os.close(fd)
+    return removed
@@ -1,10 +1,40 @@
-from collections import namedtuple
-
 import h5py
+import numpy as np
 
 from ...transforms import StaticTransform
-from ...utils import recursively_load_dict_contents_from_group
-from ..base import TransformDataset, default_image_datapoint
+from ...utils import datapoint_class, recursively_load_dict_contents_from_group
+from ..base import AttributeHandler, AttributeTransformer, LazyH5File, TransformDataset, default_image_datapoint
+
+# a batch is read as one contiguous slab if the slab has at most this many rows per requested row
+MAX_SLAB_ROWS_PER_ITEM = 4
+
+
+def read_rows(dataset, items, max_slab_rows_per_item=MAX_SLAB_ROWS_PER_ITEM):
+    """
+    Reads the rows `items` (in this order, repetitions allowed) of an hdf5 dataset with a single read. h5py only
+    accepts sorted, unique indices, so the rows are read in sorted order, either as the contiguous slab spanning all of
+    them (if it is at most `max_slab_rows_per_item` times as large as the batch) or as a selection of the rows, and are
+    then put into the requested order.
+
+    Args:
+        dataset (h5py.Dataset or np.ndarray): data with trials along the first dimension
+        items (list or np.array): indices of the rows
+
+    Returns:
+        np.array: the rows, stacked along the first dimension (no rows if `items` is empty)
+    """
+    items = np.asarray(items)
+    if len(items) == 0:
+        return np.empty((0, *dataset.shape[1:]), dtype=dataset.dtype)
+    if not isinstance(dataset, h5py.Dataset):
+        return np.asarray(dataset[items])
+    unique, inverse = np.unique(items, return_inverse=True)
+    start, stop = int(unique[0]), int(unique[-1]) + 1
+    if stop - start <= max_slab_rows_per_item * len(unique):
+        rows = dataset[start:stop][unique - start]
+    else:
+        rows = dataset[unique]
+    return rows[inverse]
 
 
 class StaticSet(TransformDataset):
@@ -16,26 +46,32 @@ class StaticSet(TransformDataset):
 
         self.data_keys = data_keys
         if set(data_keys) == {"images", "responses"}:
-            # this version IS serializable in pickle
             self.data_point = default_image_datapoint
         else:
-            # this version is NOT - you cannot use this with a dataloader with num_workers > 1
-            self.data_point = namedtuple("DataPoint", data_keys)
+            # serializable in pickle, so it can be used with a dataloader with num_workers > 0
+            self.data_point = datapoint_class(data_keys)
 
 
 class H5ArraySet(StaticSet):
-    def __init__(self, filename, *data_keys, transforms=None):
+    def __init__(self, filename, *data_keys, transforms=None, chunk_cache_bytes=None, chunk_cache_slots=None):
         """
         Dataset for static data stored in hdf5 files.
+
+        The file is opened lazily in every process that reads from the dataset (see `LazyH5File`), so the dataset
+        can be used in a DataLoader with worker processes. Indexing the dataset with a list of indices reads the batch
+        with one read per data key (see `get_batch`).
+
         Args:
             filename:      filename of the hdf5 file
             *data_keys:    data keys to be read from the file
             transforms:    list of transforms applied to each datapoint
+            chunk_cache_bytes:  size of the HDF5 chunk cache of each dataset in bytes (default: HDF5 default of 1 MB)
+            chunk_cache_slots:  number of slots of the HDF5 chunk cache (default: HDF5 default)
         """
         super().__init__(*data_keys, transforms=transforms)
 
-        self._fid = h5py.File(filename, "r")
-        self.data = self._fid
+        self._h5 = LazyH5File(filename, chunk_cache_bytes=chunk_cache_bytes, chunk_cache_slots=chunk_cache_slots)
+        self._content = None
         self.data_loaded = False
         m = None
         for key in data_keys:
@@ -46,19 +82,49 @@ class H5ArraySet(StaticSet):
                 assert m == len(self.data[key]), "Length of datasets do not match"
         self._len = m
 
+    @property
+    def _fid(self):
+        return self._h5.file
+
+    @property
+    def data(self):
+        return self._content if self.data_loaded else self._fid
+
     def load_content(self):
-        self.data = recursively_load_dict_contents_from_group(self._fid)
+        self._content = recursively_load_dict_contents_from_group(self._fid)
         self.data_loaded = True
 
     def unload_content(self):
-        self.data = self._fid
+        self._content = None
         self.data_loaded = False
 
     def __getitem__(self, item):
+        if isinstance(item, (list, tuple, np.ndarray)):
+            return self.get_batch(item)
+
         x = self.data_point(*(self.data[g][item] for g in self.data_keys))
         for tr in self.transforms:
             assert isinstance(tr, StaticTransform)
-            x = tr(x)
+            x = tr.indexed_transform(x, item)
+        return x
+
+    def get_batch(self, items):
+        """
+        Loads several items at once and applies the transforms to the whole batch, see `DataTransform.batch_transform`.
+        Each data key is read with a single read of the sorted items (see `read_rows`). Indexing the dataset with a
+        list of items calls this method, so it can be used in a DataLoader with a BatchSampler as sampler and
+        batch_size=None.
+
+        Args:
+            items (list or np.array): indices of the items in the batch
+
+        Returns:
+            data point, whose entries have the batch as first dimension
+        """
+        x = self.data_point(*(read_rows(self.data[g], items) for g in self.data_keys))
+        for tr in self.transforms:
+            assert isinstance(tr, StaticTransform)
+            x = tr.indexed_batch_transform(x, items)
         return x
 
     def __iter__(self):
@@ -74,6 +140,9 @@ class H5ArraySet(StaticSet):
         )
 
     def __getattr__(self, item):
+        if item.startswith("__") or "_h5" not in self.__dict__:
+            # special methods and attributes looked up before the dataset is initialized (e.g. while unpickling)
+            raise AttributeError(item)
         if item in self.data:
             item = self.data[item]
             if isinstance(item, h5py.Dataset):
@@ -88,7 +157,16 @@ class H5ArraySet(StaticSet):
 
 
 class StaticImageSet(H5ArraySet):
-    def __init__(self, filename, *data_keys, transforms=None, cache_raw=False, stats_source=None):
+    def __init__(
+        self,
+        filename,
+        *data_keys,
+        transforms=None,
+        cache_raw=False,
+        stats_source=None,
+        chunk_cache_bytes=None,
+        chunk_cache_slots=None,
+    ):
         """
         Dataset for h5 files.
         Args:
@@ -97,8 +175,16 @@ class StaticImageSet(H5ArraySet):
             transforms:     transforms applied to each data point
             cache_raw:      whether to cache the raw (untransformed) datapoints
             stats_source:   statistic source to be used.
+            chunk_cache_bytes:  see H5ArraySet
+            chunk_cache_slots:  see H5ArraySet
         """
-        super().__init__(filename, *data_keys, transforms=transforms)
+        super().__init__(
+            filename,
+            *data_keys,
+            transforms=transforms,
+            chunk_cache_bytes=chunk_cache_bytes,
+            chunk_cache_slots=chunk_cache_slots,
+        )
         self.cache_raw = cache_raw
         self.last_raw = None
         self.stats_source = stats_source if stats_source is not None else "all"
@@ -1,5 +1,5 @@
 import logging
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZipFile
 
 from ...exceptions import DoesNotExistException
 from ...transforms import StaticTransform
@@ -38,16 +38,17 @@ class FileTreeDataset(FileTreeDatasetBase):
             with open(self.basepath / "change.log", "r") as fid:
                 logger.info("".join(fid.readlines()))
 
-    def zip(self, filename=None):
+    def zip(self, filename=None, compression=ZIP_DEFLATED):
         """
         Zips current dataset.
         Args:
             filename:  Filename for the zip. Directory name + zip by default.
+            compression:  compression of the zip file, see `zip_dir`
         """
 
         if filename is None:
             filename = str(self.basepath) + ".zip"
-        zip_dir(filename, self.basepath)
+        zip_dir(filename, self.basepath, compression=compression)
 
     def unzip(self, filename, path):
         logger.info(f"Unzipping {filename} into {path}")
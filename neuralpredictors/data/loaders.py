@@ -0,0 +1,132 @@
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler
+from torch.utils.data.dataloader import default_collate
+
+
+class InMemoryLoader:
+    def __init__(self, dataset, sampler, batch_size, device="cpu", drop_last=False, chunk_size=None):
+        """
+        Replacement for a DataLoader over a dataset with deterministic transforms. Every sample the sampler can
+        return is loaded and transformed once, and stored in one contiguous tensor per field on `device`. Batches
+        are then cut out of these tensors by indexing. They are drawn from the sampler the same way a DataLoader
+        does, so the batches are the same as the ones of a DataLoader with the same sampler and batch_size.
+
+        Args:
+            dataset: dataset returning data points (namedtuple or dict) of numpy arrays or tensors. Datasets with a
+                `get_batch` method (e.g. FileTreeDataset) transform a whole chunk of samples at once.
+            sampler: sampler of dataset indices with an attribute `indices` listing all indices it can return
+                (e.g. SubsetRandomSampler or SubsetSequentialSampler)
+            batch_size (int): number of samples per batch
+            device (str or torch.device): device the tensors are stored on and the batches are returned on
+            drop_last (bool): whether to drop the last incomplete batch
+            chunk_size (int, optional): number of samples loaded and transformed at once while filling the tensors.
+                Defaults to batch_size.
+        """
+        if not hasattr(sampler, "indices"):
+            raise ValueError("The sampler of an InMemoryLoader needs to list the indices it samples from")
+
+        self.dataset = dataset
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.batch_sampler = BatchSampler(sampler, batch_size, drop_last)
+
+        # dataset indices of the stored samples, sorted to find the rows of a batch with searchsorted
+        self.indices = np.unique(np.asarray(sampler.indices))
+        self._output_type = None
+        self.tensors = {}
+        self._fill(chunk_size or batch_size)
+
+    def _load_chunk(self, indices):
+        if hasattr(self.dataset, "get_batch"):
+            return self.dataset.get_batch(indices)
+        return default_collate([self.dataset[i] for i in indices])
+
+    def _fill(self, chunk_size):
+        n = len(self.indices)
+        for start in range(0, n, chunk_size):
+            chunk = self._load_chunk(self.indices[start : start + chunk_size])
+            fields = chunk._asdict() if hasattr(chunk, "_asdict") else dict(chunk)
+            if self._output_type is None:
+                # namedtuples and dicts can both be created from keyword arguments
+                self._output_type = type(chunk)
+                for k, v in fields.items():
+                    v = torch.as_tensor(v)
+                    self.tensors[k] = torch.empty((n, *v.shape[1:]), dtype=v.dtype, device=self.device)
+            for k, v in fields.items():
+                self.tensors[k][start : start + chunk_size] = torch.as_tensor(v).to(self.device)
+
+    def __iter__(self):
+        for batch_indices in self.batch_sampler:
+            rows = torch.as_tensor(np.searchsorted(self.indices, batch_indices), device=self.device)
+            yield self._output_type(**{k: v.index_select(0, rows) for k, v in self.tensors.items()})
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+
+def pinned_collate(samples):
+    """
+    Collates a list of data points like default_collate, but stacks every field directly into page-locked host
+    memory, from which it can be copied to the gpu asynchronously. Pinning memory initializes CUDA, so this cannot be
+    used in DataLoader worker processes; use pin_memory=True of the DataLoader there instead.
+
+    Args:
+        samples (list): data points (namedtuples or dicts) of numpy arrays or tensors
+
+    Returns:
+        data point of the same type with the stacked fields
+    """
+    elem = samples[0]
+    if isinstance(elem, np.ndarray):
+        samples = [torch.as_tensor(sample) for sample in samples]
+        elem = samples[0]
+    if isinstance(elem, torch.Tensor):
+        out = torch.empty((len(samples), *elem.shape), dtype=elem.dtype, pin_memory=True)
+        return torch.stack(samples, out=out)
+    if isinstance(elem, tuple) and hasattr(elem, "_fields"):
+        return type(elem)(*(pinned_collate(list(field)) for field in zip(*samples)))
+    if isinstance(elem, dict):
+        return {k: pinned_collate([sample[k] for sample in samples]) for k in elem}
+    return default_collate(samples)
+
+
+def to_device(batch, device, non_blocking=True):
+    """
+    Moves every tensor of a batch (tensor, namedtuple or dict of tensors) to `device` with one copy per field.
+    Tensors that are already on `device` are returned as they are, without a copy.
+    """
+    if isinstance(batch, torch.Tensor):
+        return batch.to(device, non_blocking=non_blocking)
+    if isinstance(batch, tuple) and hasattr(batch, "_fields"):
+        return type(batch)(*(to_device(v, device, non_blocking) for v in batch))
+    if isinstance(batch, dict):
+        return {k: to_device(v, device, non_blocking) for k, v in batch.items()}
+    return batch
+
+
+class DeviceLoader:
+    def __init__(self, loader, device="cuda"):
+        """
+        Wraps a loader returning batches on the cpu and moves each batch to `device` with one non-blocking copy per
+        field. The copies only overlap with computation if the batches are in pinned memory (see `pinned_collate` and
+        the pin_memory argument of DataLoader). With device="cpu", the batches are returned unchanged.
+
+        Args:
+            loader: iterable of batches with a `dataset` attribute, e.g. a DataLoader
+            device (str or torch.device): device the batches are moved to
+        """
+        self.loader = loader
+        self.device = torch.device(device)
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def __iter__(self):
+        for batch in self.loader:
+            yield to_device(batch, self.device)
+
+    def __len__(self):
+        return len(self.loader)
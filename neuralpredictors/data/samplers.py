@@ -5,6 +5,8 @@ import numpy as np
 import torch
 from torch.utils.data import Sampler
 
+from .utils import repeat_groups
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,14 +22,16 @@ class RepeatsBatchSampler(Sampler):
         """
         if subset_index is None:
             subset_index = np.arange(len(keys))
-        _, inv = np.unique(keys[subset_index], return_inverse=True)
-        self.repeat_index = np.unique(inv)
-        self.repeat_sets = inv
+        subset_index = np.asarray(subset_index)
+        _, groups = repeat_groups(np.asarray(keys)[subset_index])
+        self.repeat_index = np.arange(len(groups))
         self.subset_index = subset_index
+        # indices of the samples of every batch, in the order of the sorted unique keys
+        self.groups = [subset_index[group] for group in groups]
 
     def __iter__(self):
-        for u in self.repeat_index:
-            yield list(self.subset_index[self.repeat_sets == u])
+        for group in self.groups:
+            yield list(group)
 
     def __len__(self):
         return len(self.repeat_index)
@@ -141,3 +145,96 @@ class BalancedSubsetSampler(Sampler):
 
     def __len__(self):
         return self.num_samples
+
+
+class BlockShuffleSampler(Sampler):
+    def __init__(self, indices, block_size=64, generator=None):
+        """
+        Samples elements randomly from a given list of indices, without replacement, while keeping indices that are
+        close to each other (and thus close on disk) close in the sampled order. The sorted indices are cut into
+        blocks of `block_size` neighbouring indices, the order of the blocks is shuffled and then the order within
+        each block. The block boundaries are shifted by a random offset in every epoch, so that the blocks are not
+        the same in every epoch.
+
+        Reading the data in this order lets memory-mapped or HDF5 backed datasets profit from readahead and the
+        page cache, at the price of batches that contain neighbouring trials more often than in a full shuffle.
+        Use `statistics` to compare the order with a full shuffle. With block_size=1, this is SubsetRandomSampler.
+
+        Arguments:
+            indices (list): a list of indices
+            block_size (int): number of neighbouring indices that are shuffled as one block
+            generator (torch.Generator, optional): generator used for the shuffling
+        """
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1, not {}".format(block_size))
+        self.indices = np.sort(np.asarray(indices))
+        self.block_size = block_size
+        self.generator = generator
+
+    def _order(self):
+        # positions in the sorted indices in the order of sampling
+        n = len(self.indices)
+        offset = int(torch.randint(1, self.block_size + 1, (1,), generator=self.generator))
+        block = (np.arange(n) + self.block_size - offset) // self.block_size
+        block_rank = torch.randperm(int(block[-1]) + 1, generator=self.generator).numpy() if n else block
+        within_block = torch.rand(n, generator=self.generator).numpy()
+        return np.lexsort((within_block, block_rank[block]))
+
+    def __iter__(self):
+        return iter(self.indices[self._order()].tolist())
+
+    def __len__(self):
+        return len(self.indices)
+
+    def statistics(self, batch_size, n_epochs=10, seed=0):
+        """
+        Statistics of the sampled order, computed over `n_epochs` epochs, for this sampler and for a full shuffle of
+        the same indices. Positions refer to the sorted indices, i.e. neighbouring positions are neighbouring trials.
+            mean_jump:               mean distance between the positions of consecutively sampled elements
+            sequential_fraction:     fraction of consecutively sampled elements that are at neighbouring positions
+            batch_span:              mean range of positions in a batch, relative to the batch size (at least 1)
+            neighbours_in_batch:     fraction of neighbouring positions that end up in the same batch
+            order_correlation:       mean absolute correlation between position and sampling order (0 for a shuffle)
+            max_position_bias:       largest deviation of the mean sampling order of an element from the mean,
+                                     relative to the number of elements (shrinks with n_epochs for a shuffle)
+
+        Args:
+            batch_size (int): size of the batches the sampled elements are grouped into
+            n_epochs (int): number of epochs that are drawn
+            seed (int): seed of the generator used to draw the epochs
+
+        Returns:
+            dict: "block_shuffle" and "random", each a dict with the statistics above
+        """
+        n = len(self.indices)
+        generator = self.generator
+        self.generator = torch.Generator().manual_seed(seed)
+        try:
+            orders = {
+                "block_shuffle": [self._order() for _ in range(n_epochs)],
+                "random": [torch.randperm(n, generator=self.generator).numpy() for _ in range(n_epochs)],
+            }
+        finally:
+            self.generator = generator
+
+        stats = {}
+        for name, epochs in orders.items():
+            jumps = np.concatenate([np.abs(np.diff(order)) for order in epochs])
+            batch_span, neighbours_in_batch, order_correlation = [], [], []
+            sampled_at = np.empty((n_epochs, n))
+            for epoch, order in enumerate(epochs):
+                batches = [order[i : i + batch_size] for i in range(0, n, batch_size)]
+                batch_span.extend((batch.max() - batch.min() + 1) / len(batch) for batch in batches)
+                sampled_at[epoch, order] = np.arange(n)
+                batch_of = sampled_at[epoch] // batch_size
+                neighbours_in_batch.append(np.mean(batch_of[1:] == batch_of[:-1]))
+                order_correlation.append(abs(np.corrcoef(np.arange(n), sampled_at[epoch])[0, 1]))
+            stats[name] = {
+                "mean_jump": float(jumps.mean()),
+                "sequential_fraction": float(np.mean(jumps == 1)),
+                "batch_span": float(np.mean(batch_span)),
+                "neighbours_in_batch": float(np.mean(neighbours_in_batch)),
+                "order_correlation": float(np.mean(order_correlation)),
+                "max_position_bias": float(np.abs(sampled_at.mean(axis=0) - (n - 1) / 2).max() / n),
+            }
+        return stats
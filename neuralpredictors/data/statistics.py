@@ -0,0 +1,262 @@
+"""
+Builds the statistics in meta/statistics of FileTreeDatasets, which the normalizers (e.g. NeuroNormalizer) read as
+meta/statistics/<data_key>/<source>/{mean,std,min,max,median}.npy
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from .utils import _save_npy_atomic
+
+logger = logging.getLogger(__name__)
+
+STATISTICS = ("mean", "std", "min", "max", "median")
+
+# data_keys whose statistics are taken over all values (scalars) instead of per element over the trials
+POOLED_KEYS = ("images", "inputs", "videos")
+
+# default size of the blocks of trials read at once
+STATISTICS_BLOCK_BYTES = 64 * 1024 ** 2
+
+# default memory for the sample of trials from which the median of one source is computed
+MEDIAN_SAMPLE_BYTES = 256 * 1024 ** 2
+
+
+class RunningStatistics:
+    def __init__(self, pooled=False, median_sample_bytes=MEDIAN_SAMPLE_BYTES, seed=0):
+        """
+        Statistics of trials that are added in blocks, in one pass and in bounded memory. Mean and variance are
+        combined block by block with the parallel form of Welford's algorithm, in float64. The median is computed
+        from a uniform sample of trials of at most `median_sample_bytes` (every trial gets a random key and the trials
+        with the smallest keys are kept), so it is exact as long as all trials fit into the sample. The sample does not
+        depend on how the trials are split into blocks.
+
+        Args:
+            pooled (bool): statistics over all values of all trials (scalars) instead of per element over the trials
+            median_sample_bytes (int): maximal size of the sample for the median
+            seed (int): seed of the random keys of the sample
+        """
+        self.pooled = pooled
+        self.median_sample_bytes = median_sample_bytes
+        self.n = 0
+        self.mean = self.m2 = self.min = self.max = None
+        self.dtype = None
+        self._rng = np.random.RandomState(seed)
+        self._sample = self._sample_keys = None
+
+    def update(self, block):
+        """
+        Adds the trials in `block` (trials along the first axis)
+        """
+        block = np.asarray(block)
+        if len(block) == 0:
+            return
+        axis = None if self.pooled else 0
+        n = block.size if self.pooled else len(block)
+        mean = block.mean(axis=axis, dtype=np.float64)
+        m2 = np.square(block - mean, dtype=np.float64).sum(axis=axis)
+        if self.n == 0:
+            self.mean, self.m2 = mean, m2
+            self.min, self.max = block.min(axis=axis), block.max(axis=axis)
+            self.dtype = block.dtype
+        else:
+            delta = mean - self.mean
+            total = self.n + n
+            self.mean = self.mean + delta * (n / total)
+            self.m2 = self.m2 + m2 + np.square(delta) * (self.n * n / total)
+            self.min = np.minimum(self.min, block.min(axis=axis))
+            self.max = np.maximum(self.max, block.max(axis=axis))
+        self.n += n
+        self._update_sample(block)
+
+    def _update_sample(self, block):
+        keys = self._rng.random_sample(len(block))
+        if self._sample is not None:
+            block = np.concatenate([self._sample, block])
+            keys = np.concatenate([self._sample_keys, keys])
+        capacity = max(1, self.median_sample_bytes // max(1, block[0].nbytes))
+        if len(block) > capacity:
+            keep = np.sort(np.argpartition(keys, capacity - 1)[:capacity])
+            block, keys = block[keep], keys[keep]
+        self._sample, self._sample_keys = block, keys
+
+    @property
+    def median_is_exact(self):
+        return self.n == (self._sample.size if self.pooled else len(self._sample))
+
+    def result(self):
+        """
+        Returns:
+            dict: mean, std (population std), min, max and median, in the floating point dtype of the trials
+                (float32 for integer data)
+        """
+        if self.n == 0:
+            raise ValueError("No trials were added")
+        dtype = np.result_type(self.dtype, np.float32)
+        median = np.median(self._sample, axis=None if self.pooled else 0)
+        stats = {
+            "mean": self.mean,
+            "std": np.sqrt(self.m2 / self.n),
+            "min": self.min,
+            "max": self.max,
+            "median": median,
+        }
+        return {k: np.asarray(v).astype(dtype) for k, v in stats.items()}
+
+
+def _iter_blocks(folder, data_key, block_bytes):
+    """
+    Yields the offset and the trials of `data_key` in blocks of about `block_bytes`, read from the memory-mapped
+    merged_data/<data_key>.npy if it exists (e.g. for derived keys like history), else from data/<data_key>/<i>.npy
+    """
+    merged_file = folder / "merged_data" / "{}.npy".format(data_key)
+    if merged_file.exists():
+        data = np.load(merged_file, mmap_mode="r")
+        rows = max(1, block_bytes // max(1, data[0].nbytes)) if len(data) else 1
+        for start in range(0, len(data), rows):
+            yield start, np.asarray(data[start : start + rows])
+        return
+
+    data_folder = folder / "data" / data_key
+    n_trials = len(list(data_folder.glob("*.npy")))
+    if n_trials == 0:
+        raise FileNotFoundError("Neither {} nor files in {} exist".format(merged_file, data_folder))
+    rows = max(1, block_bytes // max(1, np.load(data_folder / "0.npy", mmap_mode="r").nbytes))
+    for start in range(0, n_trials, rows):
+        stop = min(start + rows, n_trials)
+        yield start, np.stack([np.load(data_folder / "{}.npy".format(i)) for i in range(start, stop)])
+
+
+def _source_masks(folder, sources, n_trials):
+    tiers = None
+    masks = {}
+    for source, selection in sources.items():
+        if selection is None:
+            masks[source] = np.ones(n_trials, dtype=bool)
+            continue
+        if isinstance(selection, str) or (
+            isinstance(selection, (list, tuple)) and selection and all(isinstance(s, str) for s in selection)
+        ):
+            if tiers is None:
+                tiers = np.load(folder / "meta" / "trials" / "tiers.npy")
+            selection = np.isin(tiers, [selection] if isinstance(selection, str) else selection)
+        selection = np.asarray(selection)
+        if selection.dtype != bool:
+            selection = np.isin(np.arange(n_trials), selection)
+        if len(selection) != n_trials:
+            raise ValueError(
+                "Source {} selects from {} trials, but there are {}".format(source, len(selection), n_trials)
+            )
+        masks[source] = selection
+    return masks
+
+
+def _n_trials(folder, data_key):
+    merged_file = folder / "merged_data" / "{}.npy".format(data_key)
+    if merged_file.exists():
+        return len(np.load(merged_file, mmap_mode="r"))
+    return len(list((folder / "data" / data_key).glob("*.npy")))
+
+
+def _build_key_statistics(folder, data_key, sources, pooled, block_bytes, median_sample_bytes, seed):
+    masks = _source_masks(folder, sources, _n_trials(folder, data_key))
+    running = {
+        source: RunningStatistics(pooled=pooled, median_sample_bytes=median_sample_bytes, seed=seed)
+        for source in sources
+    }
+    for start, block in _iter_blocks(folder, data_key, block_bytes):
+        for source, mask in masks.items():
+            running[source].update(block[mask[start : start + len(block)]])
+
+    approximate = []
+    for source, stats in running.items():
+        outpath = folder / "meta" / "statistics" / data_key / source
+        outpath.mkdir(parents=True, exist_ok=True)
+        for name, value in stats.result().items():
+            _save_npy_atomic(outpath / "{}.npy".format(name), value)
+        if not stats.median_is_exact:
+            approximate.append(source)
+    return approximate
+
+
+def build_statistics(
+    folders,
+    data_keys=None,
+    sources=None,
+    pooled_keys=POOLED_KEYS,
+    n_workers=None,
+    overwrite=False,
+    block_bytes=STATISTICS_BLOCK_BYTES,
+    median_sample_bytes=MEDIAN_SAMPLE_BYTES,
+    seed=0,
+):
+    """
+    Computes the statistics of FileTreeDatasets and writes them to meta/statistics/<data_key>/<source>/, as mean.npy,
+    std.npy, min.npy, max.npy and median.npy. Every data_key is read once, in blocks of trials, from merged_data (if
+    the matrix exists) or from the per-trial files, and all sources are computed in the same pass (see
+    `RunningStatistics`). The data_keys are processed in parallel, one data_key of one dataset per process.
+
+    Args:
+        folders (str or list): folders of FileTreeDatasets
+        data_keys (list, optional): data_keys to compute the statistics of. Defaults to the folders in data/ and the
+            matrices in merged_data/ of each dataset (e.g. history and state).
+        sources (dict, optional): name of the source -> trials it is computed over: None for all trials, a tier name
+            or a list of tier names (from meta/trials/tiers.npy), or the indices or a boolean mask of the trials.
+            Defaults to {"all": None}.
+        pooled_keys (tuple): data_keys whose statistics are scalars over all values (like the images) instead of
+            per element over the trials
+        n_workers (int, optional): number of processes. Defaults to the number of cpus, 0 computes in this process.
+        overwrite (bool): recompute statistics that already exist
+        block_bytes (int): approximate size of the blocks of trials read at once
+        median_sample_bytes (int): memory for the sample of trials of the median of every source, the median is
+            exact if all trials of the source fit into it
+        seed (int): seed of the sample for the median
+
+    Returns:
+        dict: folder -> {data_key: "built" or "exists"}
+    """
+    if isinstance(folders, (str, Path)):
+        folders = [folders]
+    sources = {"all": None} if sources is None else sources
+
+    status, tasks = {}, []
+    for folder in map(Path, folders):
+        if data_keys is not None:
+            keys = data_keys
+        else:
+            keys = {p.name for p in (folder / "data").iterdir() if p.is_dir()}
+            if (folder / "merged_data").is_dir():
+                keys |= {p.stem for p in (folder / "merged_data").glob("*.npy")}
+            keys = sorted(keys)
+        status[str(folder)] = {}
+        for data_key in keys:
+            outpath = folder / "meta" / "statistics" / data_key
+            if not overwrite and all(
+                (outpath / source / "{}.npy".format(name)).exists() for source in sources for name in STATISTICS
+            ):
+                status[str(folder)][data_key] = "exists"
+            else:
+                tasks.append(
+                    (folder, data_key, sources, data_key in pooled_keys, block_bytes, median_sample_bytes, seed)
+                )
+
+    def record(task, approximate):
+        folder, data_key = task[:2]
+        status[str(folder)][data_key] = "built"
+        if approximate:
+            logger.info("Median of {}/{} for {} computed from a sample".format(folder, data_key, approximate))
+        logger.info("Computed statistics of {}/{}".format(folder, data_key))
+
+    if n_workers == 0:
+        for task in tqdm(tasks, desc="statistics"):
+            record(task, _build_key_statistics(*task))
+    elif tasks:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(_build_key_statistics, *task): task for task in tasks}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="statistics"):
+                record(futures[future], future.result())
+    return status
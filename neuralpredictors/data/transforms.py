@@ -1,9 +1,15 @@
-from collections import Iterable, namedtuple
+import hashlib
+import os
+import pickle
+from collections import Iterable
+from pathlib import Path
 
 import numpy as np
 import torch
 from skimage.transform import rescale
 
+from .utils import datapoint_class
+
 
 class Invertible:
     def inv(self, y):
@@ -26,6 +32,33 @@ class DataTransform:
     def __call__(self, *args, **kwargs):
         raise NotImplementedError
 
+    def batch_transform(self, x):
+        """
+        Applies the transform to a batch, i.e. a datapoint whose fields are stacked along a new first dimension.
+        Transforms that can operate on the stacked arrays at once override this method. By default, the
+        transform is applied to every sample of the batch and the results are stacked again.
+        """
+        samples = [self(x.__class__(*fields)) for fields in zip(*x)]
+        return samples[0].__class__(*(_stack(field) for field in zip(*samples)))
+
+    def indexed_transform(self, x, item):
+        """
+        Applies the transform to the datapoint of the item with index `item` in the dataset. Datasets that know
+        the index call this instead of __call__, so that transforms can cache their result per item
+        (see ScaleInputs). By default, the index is ignored.
+        """
+        return self(x)
+
+    def indexed_batch_transform(self, x, items):
+        """
+        Like `indexed_transform` for a batch with the indices `items`, see `batch_transform`.
+        """
+        return self.batch_transform(x)
+
+
+def _stack(values):
+    return torch.stack(values) if isinstance(values[0], torch.Tensor) else np.stack(values)
+
 
 class MovieTransform(DataTransform):
     """
@@ -76,6 +109,48 @@ class Subsequence(MovieTransform):
             }
         )
 
+    def batch_transform(self, x, offsets=None):
+        """
+        Selects the subsequences of a batch of clips of equal length. With a fixed offset, the subsequences are
+        views of the batch. Otherwise, every clip gets its own random offset (as with __call__ per clip), or the
+        offsets given in `offsets`, and the subsequences of all clips are gathered with one indexing operation per
+        data key.
+
+        Args:
+            x: batch of clips, the fields have the batch as first dimension
+            offsets (array, optional): start of the subsequence of every clip. Defaults to None, in which case
+                they are given by `offset`.
+        """
+        first_group = x._fields[0]
+        shape = getattr(x, first_group).shape
+        n, t = shape[0], shape[1 + int(first_group in self.channel_first)]
+
+        if offsets is None and self.offset >= 0:
+            i = self.offset
+            return x.__class__(
+                **{
+                    k: getattr(x, k)[:, :, i : i + self.frames, ...]
+                    if k in self.channel_first
+                    else getattr(x, k)[:, i : i + self.frames, ...]
+                    for k in x._fields
+                }
+            )
+
+        if offsets is None:
+            offsets = np.random.randint(0, t - self.frames, size=n)
+        # frames of the subsequence of every clip: batch x frames
+        frames = np.asarray(offsets)[:, None] + np.arange(self.frames)
+        clips = np.arange(n)[:, None]
+        key_entry = {}
+        for k in x._fields:
+            v = getattr(x, k)
+            if k in self.channel_first:
+                channels = np.arange(v.shape[1])[None, :, None]
+                key_entry[k] = v[clips[..., None], channels, frames[:, None, :]]
+            else:
+                key_entry[k] = v[clips, frames]
+        return x.__class__(**key_entry)
+
     def id_transform(self, id_map):
         # until a better solution is reached, skipping this
         return id_map
@@ -126,6 +201,18 @@ class Delay(MovieTransform):
 
         return x.__class__(**key_entry)
 
+    def batch_transform(self, x):
+        # the same slices of the time axis (after the batch dimension) for all clips, as views of the batch
+        first_group = x._fields[0]
+        t = getattr(x, first_group).shape[1 + int(first_group in self.channel_first)]
+        assert t > self.delay, "The sequence length {} has to be longer than the delay {}".format(t, self.delay)
+        key_entry = {}
+        for k in x._fields:
+            start, stop = (self.delay, t) if k in self.delay_groups else (0, t - self.delay)
+            key_entry[k] = getattr(x, k)[:, :, start:stop] if k in self.channel_first else getattr(x, k)[:, start:stop]
+
+        return x.__class__(**key_entry)
+
     def id_transform(self, id_map):
         # until a better solution is reached, skipping this
         return id_map
@@ -243,6 +330,17 @@ class Subsample(MovieTransform, StaticTransform):
             }
         )
 
+    def batch_transform(self, x):
+        # non-negative index positions refer to a single sample and are shifted by the batch dimension
+        return x.__class__(
+            **{
+                k: np.take(getattr(x, k), self.idx, self.target_index[k] + (self.target_index[k] >= 0))
+                if k in self.target_groups
+                else getattr(x, k)
+                for k in x._fields
+            }
+        )
+
     def __repr__(self):
         return self.__class__.__name__ + "(n={})".format(len(self.idx))
 
@@ -267,11 +365,17 @@ class ToTensor(MovieTransform, StaticTransform, Invertible):
             ]
         )
 
+    def batch_transform(self, x):
+        return self(x)
+
 
 class Identity(MovieTransform, StaticTransform, Invertible):
     def __call__(self, x):
         return x
 
+    def batch_transform(self, x):
+        return x
+
     def inv(self, y):
         return y
 
@@ -288,13 +392,16 @@ class Rename(MovieTransform, StaticTransform, Invertible):
             if self.origin_tuple_class is None:
                 self.origin_tuple_class = x.__class__
             renamed_fields = [self.name_map.get(f, f) for f in x._fields]
-            self.tuple_class = namedtuple("RenamedDataPoint", renamed_fields)
+            self.tuple_class = datapoint_class(renamed_fields, name="RenamedDataPoint")
         return self.tuple_class(*x)
 
+    def batch_transform(self, x):
+        return self(x)
+
     def inv(self, y):
         if self.origin_tuple_class is None:
             renamed_fields = [self.rev_map.get(f, f) for f in y._fields]
-            self.origin_tuple_class = namedtuple("OriginalDataPoint", renamed_fields)
+            self.origin_tuple_class = datapoint_class(renamed_fields, name="OriginalDataPoint")
         return self.origin_tuple_class(*y)
 
     def id_transform(self, id_map):
@@ -314,13 +421,23 @@ class NeuroNormalizer(MovieTransform, StaticTransform, Invertible):
     - eye_position is z-scored
     - reponses are divided by the per neuron std if the std is greater than
             1% of the mean std (to avoid division by 0)
+
+    Every normalization is an affine map, which is precomputed as one scale and offset vector per field (see
+    `affine`) and applied in a single multiply-add. With `subsample_idx`, the responses are subsampled to these
+    neurons at the same time, instead of by a Subsample transform after the normalizer. Datasets that keep only some
+    neurons (see FileTreeDataset.select_neurons) are normalized with the scales of these neurons, `subsample_idx`
+    then indexes the kept neurons. The results equal those of the former per-field functions up to float32 rounding
+    (see tests/test_normalizer.py). `to_module` returns the same normalization as a torch module, which normalizes
+    batches of tensors.
     """
 
     def __init__(self, data, stats_source="all", exclude=None,
                  inputs_mean=None, inputs_std=None,
-                 adjusted_normalization=True):
+                 adjusted_normalization=True, subsample_idx=None):
 
         self.exclude = exclude or []
+        self.subsample_idx = None if subsample_idx is None else np.asarray(subsample_idx)
+        assert self.subsample_idx is None or self.subsample_idx.ndim == 1, "Dimensionality of index array has to be 1"
 
         in_name = "images" if "images" in data.statistics.keys() else "inputs"
         out_name = "responses" if "responses" in data.statistics.keys() else "targets"
@@ -336,87 +453,259 @@ class NeuroNormalizer(MovieTransform, StaticTransform, Invertible):
         idx = s > threshold
         self._response_precision = np.ones_like(s) / threshold
         self._response_precision[idx] = 1 / s[idx]
-        transforms, itransforms = {}, {}
-
-        # -- inputs
-        transforms[in_name] = lambda x: (x - self._inputs_mean) / self._inputs_std
-        itransforms[in_name] = lambda x: x * self._inputs_std + self._inputs_mean
-
-        # -- responses
-        transforms[out_name] = lambda x: x * self._response_precision
-        itransforms[out_name] = lambda x: x / self._response_precision
-
-        # -- behavior
-        transforms["behavior"] = lambda x: x
+        neuron_idx = getattr(data, "neuron_idx", None)
+        if neuron_idx is not None:
+            # the dataset holds only these neurons (see FileTreeDataset.select_neurons)
+            self._response_precision = self._response_precision[neuron_idx]
 
         # -- trial_idx
-        trial_idx_mean = np.arange(data._len).mean()
-        trial_idx_std = np.arange(data._len).std()
-        transforms["trial_idx"] = lambda x: (x - trial_idx_mean) / trial_idx_std
-        itransforms["trial_idx"] = lambda x: x * trial_idx_std + trial_idx_mean
+        self._trial_idx_mean = np.arange(data._len).mean()
+        self._trial_idx_std = np.arange(data._len).std()
 
-        if eye_name in data.data_keys:
+        self._eye_name = eye_name if eye_name in data.data_keys else None
+        if self._eye_name is not None:
             self._eye_mean = np.array(data.statistics[eye_name][stats_source]["mean"])
             self._eye_std = np.array(data.statistics[eye_name][stats_source]["std"])
-            transforms[eye_name] = lambda x: (x - self._eye_mean) / self._eye_std
-            itransforms[eye_name] = lambda x: x * self._eye_std + self._eye_mean
 
+        self._behavior_normalization = None
         if "behavior" in data.data_keys:
             if adjusted_normalization == False:
                 s = np.array(data.statistics["behavior"][stats_source]["std"])
-
                 self._behavior_precision = 1 / s
-                # -- behavior
-                transforms["behavior"] = lambda x: x * self._behavior_precision
-                itransforms["behavior"] = lambda x: x / self._behavior_precision
-                
+                self._behavior_normalization = "precision"
             else:
-                # Normalize the behavior regressors more consistently across sessions
-                # Pupil is normalized from 0 to 1 based on min and max
-                # dt/t pupil is normalized to std=1  (already mean 0)
-                # Running: absolute value of speed is scaled to 0 to 1
-                
-                mins=data.statistics['behavior']['all']['min']
-                maxs=data.statistics['behavior']['all']['max']
-                stds=data.statistics['behavior']['all']['std']
-                
-                transforms["behavior"] = lambda x: np.array( [ 
-                                        (x[0] - mins[0]) / (maxs[0]-mins[0]),
-                                         x[1] / stds[1],
-                                         np.abs( x[2] ) / np.max( [-mins[2], maxs[2]] ),
-                                        ] )
-                itransforms["behavior"] = lambda x: np.nan    # not used
-  
-
-        self._transforms = transforms
-        self._itransforms = itransforms
+                self._behavior_min = data.statistics['behavior']['all']['min']
+                self._behavior_max = data.statistics['behavior']['all']['max']
+                self._behavior_std = data.statistics['behavior']['all']['std']
+                self._behavior_normalization = "adjusted"
+
+        self._in_name, self._out_name = in_name, out_name
+        self.affine = self._build_affine()
+
+    def _build_affine(self):
+        """
+        Builds the normalization of every field as scale and offset (float32, broadcasting over the last axis): the
+        field x is normalized to x * scale + offset. The scale of the responses is subsampled to `subsample_idx`. The
+        adjusted behavior normalization also takes the absolute value of the running speed, which is done after the
+        scaling (with a positive scale and no offset), where `absolute` is True.
+
+        Returns:
+            dict: field -> (scale, offset or None, absolute or None)
+        """
+        def affine(scale, offset=None, absolute=None):
+            scale = np.asarray(scale, dtype=np.float64)
+            if offset is not None:
+                offset = np.asarray(offset, dtype=np.float64).astype(np.float32)
+            return scale.astype(np.float32), offset, None if absolute is None else np.asarray(absolute)
+
+        fields = {}
+        inputs_std = np.asarray(self._inputs_std, dtype=np.float64)
+        fields[self._in_name] = affine(1 / inputs_std, -np.asarray(self._inputs_mean, dtype=np.float64) / inputs_std)
+
+        precision = self._response_precision
+        fields[self._out_name] = affine(precision if self.subsample_idx is None else precision[self.subsample_idx])
+
+        trial_idx_std = np.float64(self._trial_idx_std)
+        fields["trial_idx"] = affine(1 / trial_idx_std, -self._trial_idx_mean / trial_idx_std)
+
+        if self._eye_name is not None:
+            eye_std = np.asarray(self._eye_std, dtype=np.float64)
+            fields[self._eye_name] = affine(1 / eye_std, -np.asarray(self._eye_mean, dtype=np.float64) / eye_std)
+
+        if self._behavior_normalization == "precision":
+            fields["behavior"] = affine(self._behavior_precision)
+        elif self._behavior_normalization == "adjusted":
+            mins, maxs, stds = (np.asarray(v, dtype=np.float64) for v in (self._behavior_min, self._behavior_max,
+                                                                          self._behavior_std))
+            pupil_range = maxs[0] - mins[0]
+            fields["behavior"] = affine(
+                [1 / pupil_range, 1 / stds[1], 1 / max(-mins[2], maxs[2])],
+                [-mins[0] / pupil_range, 0, 0],
+                [False, False, True],
+            )
+        return fields
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "affine" not in state:
+            # pickled before the normalization was precomputed
+            self.subsample_idx = None
+            self.affine = self._build_affine()
+
+    def _normalize(self, k, v):
+        if k == self._out_name and self.subsample_idx is not None:
+            # responses are subsampled whether they are normalized or not
+            v = np.take(v, self.subsample_idx, -1)
+        if k in self.exclude:
+            return v
+        scale, offset, absolute = self.affine[k]
+        out = np.multiply(v, scale, dtype=np.float32)
+        if absolute is not None:
+            out[..., absolute] = np.abs(out[..., absolute])
+        if offset is not None:
+            out += offset
+        return out
 
     def __call__(self, x):
         """
         Apply transformation
         """
-        return x.__class__(
-            **{k: (self._transforms[k](v) if k not in self.exclude else v) for k, v in zip(x._fields, x)}
-        )
+        return x.__class__(**{k: self._normalize(k, v) for k, v in zip(x._fields, x)})
+
+    def batch_transform(self, x):
+        # all normalizations broadcast over a leading batch dimension
+        return self(x)
 
     def inv(self, x):
-        return x.__class__(
-            **{k: (self._itransforms[k](v) if k not in self.exclude else v) for k, v in zip(x._fields, x)}
+        def invert(k, v):
+            if k in self.exclude:
+                return v
+            scale, offset, absolute = self.affine[k]
+            if absolute is not None:
+                # the absolute value of the adjusted behavior normalization cannot be inverted
+                return np.nan
+            return (v if offset is None else v - offset) / scale
+
+        return x.__class__(**{k: invert(k, v) for k, v in zip(x._fields, x)})
+
+    def id_transform(self, id_map):
+        if self.subsample_idx is None:
+            return id_map
+        return {k: v[self.subsample_idx] if k == self._out_name else v for k, v in id_map.items()}
+
+    def to_module(self, channels=None, subsample=True):
+        """
+        Args:
+            channels (dict, optional): fields that consist of channels of other fields, see FusedNeuroNormalizer
+            subsample (bool): whether the module subsamples the responses to `subsample_idx`. If False, the responses
+                passed to the module have to be subsampled already.
+
+        Returns:
+            FusedNeuroNormalizer: torch module with the same normalization, for batches of tensors
+        """
+        return FusedNeuroNormalizer(
+            {k: v for k, v in self.affine.items() if k not in self.exclude},
+            subsample_idx=None if not subsample or self.subsample_idx is None else {self._out_name: self.subsample_idx},
+            channels=channels,
+            in_name=self._in_name,
+            out_name=self._out_name,
         )
 
     def __repr__(self):
         return super().__repr__() + ("(not {})".format(", ".join(self.exclude)) if self.exclude is not None else "")
 
 
+class FusedNeuroNormalizer(torch.nn.Module):
+    def __init__(self, affine, subsample_idx=None, channels=None, in_name="images", out_name="responses"):
+        """
+        Normalizes the fields of a batch of tensors with one multiply-add per field, like NeuroNormalizer does for
+        numpy arrays (see `NeuroNormalizer.affine` and `NeuroNormalizer.to_module`). The scales, offsets and indices
+        are buffers, so they move with the module to the device of the batches and are saved in its state_dict.
+
+        Fields that consist of channels of other fields, like images with the behavior appended as channels (see
+        AddBehaviorAsChannels), are described by `channels`: field -> list of (source field, number of channels) in
+        the order of the channels (axis 1 of the batch). Every channel is normalized like its source field. One
+        entry may have None as number of channels, it then takes the channels not used by the others (e.g. the
+        channels of the images themselves). Channels with the source None are passed on unchanged.
+
+        Args:
+            affine (dict): field -> (scale, offset or None, absolute or None), broadcasting over the last axis
+            subsample_idx (dict, optional): field -> indices of the last axis that are selected before normalizing
+            channels (dict, optional): field -> list of (source field or None, number of channels or None)
+            in_name (str): field of the inputs
+            out_name (str): field of the responses, see `normalize_targets`
+        """
+        super().__init__()
+        self.fields = list(affine)
+        for k, (scale, offset, absolute) in affine.items():
+            self.register_buffer("{}_scale".format(k), torch.as_tensor(scale, dtype=torch.float32))
+            self.register_buffer(
+                "{}_offset".format(k), None if offset is None else torch.as_tensor(offset, dtype=torch.float32)
+            )
+            self.register_buffer("{}_absolute".format(k), None if absolute is None else torch.as_tensor(absolute))
+        self.subsampled = list(subsample_idx or {})
+        for k, idx in (subsample_idx or {}).items():
+            self.register_buffer("{}_idx".format(k), torch.as_tensor(np.asarray(idx), dtype=torch.long))
+        self.channels = {k: [tuple(segment) for segment in v] for k, v in (channels or {}).items()}
+        self.in_name, self.out_name = in_name, out_name
+
+    def _affine(self, k):
+        return tuple(getattr(self, "{}_{}".format(k, n)) for n in ("scale", "offset", "absolute"))
+
+    def _channel_affine(self, k, v):
+        """
+        Scale, offset and absolute of the channels of `v`, shaped to broadcast over the batch and the dimensions
+        after the channels
+        """
+        segments = self.channels[k]
+        n_channels = v.shape[1]
+        n_rest = n_channels - sum(n for _, n in segments if n is not None)
+        scales, offsets, absolutes = [], [], []
+        for source, n in segments:
+            n = n_rest if n is None else n
+            scale, offset, absolute = self._affine(source) if source in self.fields else (None, None, None)
+            scales.append(v.new_ones(n) if scale is None else scale.to(v.dtype).expand(n))
+            offsets.append(v.new_zeros(n) if offset is None else offset.to(v.dtype).expand(n))
+            absolutes.append(
+                torch.zeros(n, dtype=torch.bool, device=v.device) if absolute is None else absolute.expand(n)
+            )
+        shape = (n_channels,) + (1,) * (v.dim() - 2)
+        return tuple(torch.cat(values).view(shape) for values in (scales, offsets, absolutes))
+
+    def normalize(self, k, v):
+        if k in self.subsampled:
+            v = v.index_select(-1, getattr(self, "{}_idx".format(k)))
+        if k in self.channels:
+            scale, offset, absolute = self._channel_affine(k, v)
+            if not absolute.any():
+                absolute = None
+        elif k in self.fields:
+            scale, offset, absolute = self._affine(k)
+        else:
+            return v
+        if absolute is None:
+            return v * scale if offset is None else torch.addcmul(offset, v, scale)
+        out = v * scale
+        out = torch.where(absolute, out.abs(), out)
+        return out if offset is None else out + offset
+
+    def normalize_targets(self, responses):
+        """
+        Returns:
+            the responses in the units that a model trained on the normalized responses predicts
+        """
+        return self.normalize(self.out_name, responses)
+
+    def forward(self, x):
+        """
+        Args:
+            x (namedtuple or dict): batch of tensors, fields without a normalization are passed on unchanged
+
+        Returns:
+            the normalized batch, of the same type as `x`
+        """
+        if isinstance(x, dict):
+            return {k: self.normalize(k, v) for k, v in x.items()}
+        fields = [k for k in self.fields + self.subsampled + list(self.channels) if k in x._fields]
+        return x._replace(**{k: self.normalize(k, getattr(x, k)) for k in fields})
+
+    def extra_repr(self):
+        return "fields={}, channels={}".format(self.fields, self.channels)
+
+
 class AddBehaviorAsChannels(MovieTransform, StaticTransform, Invertible):
     """
     Given a StaticImage object that includes "images", "responses", and "behavior", it returns three variables:
         - input image concatinated with behavior as new channel(s)
         - responses
         - behavior
+
+    With lazy=True, the behavior is not expanded into image planes but appended to the field "channel_constants",
+    from which the first layer of the core broadcasts it (see Stacked2dCore's constant_input_channels).
     """
 
-    def __init__(self):
+    def __init__(self, lazy=False):
+        self.lazy = lazy
         self.transforms, self.itransforms = {}, {}
         self.transforms["images"] = lambda img, behavior: np.concatenate(
             (
@@ -438,6 +727,8 @@ class AddBehaviorAsChannels(MovieTransform, StaticTransform, Invertible):
         self.transforms["state"] = lambda x: x
 
     def __call__(self, x):
+        if self.lazy:
+            return _append_channel_constants(x, x.behavior)
 
         key_vals = {k: v for k, v in zip(x._fields, x)}
         dd = {
@@ -462,6 +753,38 @@ class AddBehaviorAsChannels(MovieTransform, StaticTransform, Invertible):
         
         return x.__class__(**dd)
 
+    def batch_transform(self, x):
+        if self.lazy:
+            return _append_channel_constants(x, x.behavior)
+        return x._replace(images=_concatenate_as_channels(x.images, x.behavior))
+
+    def __getstate__(self):
+        # the lambdas cannot be pickled, they are recreated by __init__ when unpickling
+        return {"lazy": self.lazy}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def _concatenate_as_channels(images, values):
+    """
+    Appends the per-sample vectors `values` (batch, n) as n constant channels to `images` (batch, c, h, w).
+    The constant channels are broadcast views, so only the concatenated output is allocated.
+    """
+    channels = np.broadcast_to(values[:, :, None, None], values.shape + images.shape[-2:])
+    return np.concatenate((images, channels), axis=1)
+
+
+def _append_channel_constants(x, values):
+    """
+    Appends `values` (n or batch x n) as n constant channels to the field "channel_constants" of the data point `x`,
+    which is added if it does not exist yet. The channels are appended in the same order as they would be to the
+    images.
+    """
+    if "channel_constants" in x._fields:
+        return x._replace(channel_constants=np.concatenate((x.channel_constants, values), axis=-1))
+    return datapoint_class(x._fields + ("channel_constants",), name=x.__class__.__name__)(*x, values)
+
 
 class AddPupilCenterAsChannels(MovieTransform, StaticTransform, Invertible):
     """
@@ -470,9 +793,12 @@ class AddPupilCenterAsChannels(MovieTransform, StaticTransform, Invertible):
         - responses
         - behavior
         - pupil center
+
+    With lazy=True, the pupil center is appended to the field "channel_constants" instead, see AddBehaviorAsChannels.
     """
 
-    def __init__(self):
+    def __init__(self, lazy=False):
+        self.lazy = lazy
         self.transforms, self.itransforms = {}, {}
         self.transforms["images"] = lambda img, pupil_center: np.concatenate(
             (
@@ -487,6 +813,8 @@ class AddPupilCenterAsChannels(MovieTransform, StaticTransform, Invertible):
         self.transforms["pupil_center"] = lambda x: x
 
     def __call__(self, x):
+        if self.lazy:
+            return _append_channel_constants(x, x.pupil_center)
 
         key_vals = {k: v for k, v in zip(x._fields, x)}
         dd = {
@@ -501,6 +829,18 @@ class AddPupilCenterAsChannels(MovieTransform, StaticTransform, Invertible):
             dd["trial_idx"] = self.transforms["trial_idx"](key_vals["trial_idx"])
         return x.__class__(**dd)
 
+    def batch_transform(self, x):
+        if self.lazy:
+            return _append_channel_constants(x, x.pupil_center)
+        return x._replace(images=_concatenate_as_channels(x.images, x.pupil_center))
+
+    def __getstate__(self):
+        # the lambdas cannot be pickled, they are recreated by __init__ when unpickling
+        return {"lazy": self.lazy}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
 
 class SelectInputChannel(StaticTransform):
     """
@@ -516,10 +856,132 @@ class SelectInputChannel(StaticTransform):
         key_vals["images"] = img[:, (self.grab_channel,)] if len(img.shape) == 4 else img[self.grab_channel, ...]
         return x.__class__(**key_vals)
 
+    def batch_transform(self, x):
+        return x._replace(images=x.images[:, self.grab_channel, ...])
+
+
+class RescaleCache:
+    def __init__(self, path=None, in_memory=False):
+        """
+        Cache of the images rescaled by ScaleInputs for the items of one dataset. The images are stored per item
+        index in a folder named after a checksum of the source of the images (see `set_source`) and the settings of
+        the rescaling, so a changed dataset, normalization or scale never reads stale images.
+
+        Args:
+            path (str or Path, optional): folder in which the rescaled images are stored as .npy files. If None,
+                the images are only kept in memory.
+            in_memory (bool, optional): whether to additionally keep the rescaled images in memory. Always True
+                if path is None.
+        """
+        self.path = None if path is None else Path(path)
+        self.in_memory = in_memory or path is None
+        self.source_checksum = None
+        self._memory = {}
+        self._folders = {}
+        self.hits = 0
+        self.misses = 0
+
+    def set_source(self, dataset, transforms):
+        """
+        Sets the checksum of the source of the images that are rescaled: the data keys of the dataset, the size and
+        modification time of every file of its data (the files of every data key, merged_data, meta/trials and
+        config.json) and the state of the transforms applied before the rescaling. Files rewritten in place are
+        detected by their modification time, whether or not the modification time of their folder changes.
+        Archives are identified by the size and modification time of the archive.
+
+        Args:
+            dataset (FileTreeDatasetBase): dataset the items come from
+            transforms (list): transforms applied before the rescaling
+        """
+        h = hashlib.sha256(repr(dataset.data_keys).encode())
+        if dataset.archive is not None:
+            # members of an archive only change together with the archive
+            stat = os.stat(dataset.archive.filename)
+            h.update("{}:{}:{}".format(dataset.archive.filename, stat.st_size, stat.st_mtime_ns).encode())
+        else:
+            links = dataset.config.get("links", {})
+            sources = [dataset.basepath / "config.json", dataset.basepath / "meta" / "trials"]
+            for data_key in dataset.data_keys:
+                folder = links.get(data_key, data_key)
+                sources += [
+                    dataset.basepath / "data" / folder,
+                    dataset.basepath / "merged_data" / "{}.npy".format(data_key),
+                ]
+            for source in sources:
+                files = sorted(source.iterdir()) if source.is_dir() else [source]
+                for file in files:
+                    stat = file.stat() if file.exists() else None
+                    h.update(
+                        "{}:{}:{}".format(
+                            file.relative_to(dataset.basepath),
+                            None if stat is None else stat.st_size,
+                            None if stat is None else stat.st_mtime_ns,
+                        ).encode()
+                    )
+        h.update(pickle.dumps(transforms))
+        self.source_checksum = h.hexdigest()
+        self._folders = {}
+
+    def _folder(self, settings):
+        if settings not in self._folders:
+            key = hashlib.sha256("{}|{}".format(self.source_checksum, settings).encode()).hexdigest()
+            self._folders[settings] = self.path / key[:32] if self.path is not None else key
+        return self._folders[settings]
+
+    def get(self, item, settings, compute):
+        """
+        Returns the rescaled image of an item from the cache, or computes it with `compute()` and stores it.
+
+        Args:
+            item (int): index of the item in the dataset
+            settings (str): description of all settings of the rescaling that change its result
+            compute (callable): returns the rescaled image
+        """
+        if self.source_checksum is None:
+            raise ValueError("The source of the RescaleCache has not been set, see set_source")
+        folder = self._folder(settings)
+        key = (folder, int(item))
+        if key in self._memory:
+            self.hits += 1
+            return self._memory[key]
+
+        ret = None
+        if self.path is not None:
+            try:
+                ret = np.load(folder / "{}.npy".format(int(item)))
+            except FileNotFoundError:
+                pass
+
+        if ret is None:
+            self.misses += 1
+            ret = compute()
+            if self.path is not None:
+                self._save(folder / "{}.npy".format(int(item)), ret)
+        else:
+            self.hits += 1
+
+        if self.in_memory:
+            self._memory[key] = ret
+        return ret
+
+    @staticmethod
+    def _save(file, value):
+        file.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so that other processes never read a partially written file
+        tmp_file = file.with_name("{}.{}.tmp".format(file.name, os.getpid()))
+        with open(tmp_file, "wb") as fid:
+            np.save(fid, value)
+        os.replace(tmp_file, file)
+
+    def clear_memory(self):
+        self._memory = {}
+
 
 class ScaleInputs(StaticTransform, Invertible):
     """
-    Applies skimage.transform.rescale to the data_key "images".
+    Applies skimage.transform.rescale to the data_key "images". If a RescaleCache is given, datasets that pass the
+    index of the items (see DataTransform.indexed_transform) rescale the image of every item only once and read it
+    from the cache afterwards.
     """
 
     def __init__(
@@ -531,6 +993,7 @@ class ScaleInputs(StaticTransform, Invertible):
         clip=True,
         in_name="images",
         channel_axis=0,
+        cache=None,
     ):
 
         self.scale = scale
@@ -540,11 +1003,42 @@ class ScaleInputs(StaticTransform, Invertible):
         self.clip = clip
         self.in_name = in_name
         self.channel_axis = channel_axis
+        self.cache = cache
 
     def __call__(self, x):
         key_vals = {k: v for k, v in zip(x._fields, x)}
-        img = key_vals[self.in_name]
-        key_vals[self.in_name] = rescale(
+        key_vals[self.in_name] = self._rescale(key_vals[self.in_name])
+        return x.__class__(**key_vals)
+
+    def batch_transform(self, x):
+        # rescaling the stacked batch in one call would also interpolate along the batch axis and is slower than
+        # rescaling the images one by one. Only the images are unstacked, all other fields are passed on as they are.
+        images = getattr(x, self.in_name)
+        return x._replace(**{self.in_name: np.stack([self._rescale(img) for img in images])})
+
+    def indexed_transform(self, x, item):
+        if self.cache is None:
+            return self(x)
+        img = self.cache.get(item, self.settings, lambda: self._rescale(getattr(x, self.in_name)))
+        return x._replace(**{self.in_name: img})
+
+    def indexed_batch_transform(self, x, items):
+        if self.cache is None:
+            return self.batch_transform(x)
+        images = [
+            self.cache.get(item, self.settings, lambda: self._rescale(img))
+            for item, img in zip(items, getattr(x, self.in_name))
+        ]
+        return x._replace(**{self.in_name: np.stack(images)})
+
+    @property
+    def settings(self):
+        return "scale={}|mode={}|anti_aliasing={}|clip={}|preserve_range={}|channel_axis={}".format(
+            self.scale, self.mode, self.anti_aliasing, self.clip, self.preserve_range, self.channel_axis
+        )
+
+    def _rescale(self, img):
+        return rescale(
             img,
             scale=self.scale,
             mode=self.mode,
@@ -553,4 +1047,3 @@ class ScaleInputs(StaticTransform, Invertible):
             preserve_range=self.preserve_range,
             channel_axis=self.channel_axis,
         )
-        return x.__class__(**key_vals)
@@ -1,5 +1,9 @@
+import json
 import logging
-from collections import Mapping
+import os
+import time
+from collections import Mapping, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
 from zipfile import ZIP_DEFLATED, ZipFile
 
@@ -9,25 +13,79 @@ from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
 
+# separates the name of a datapoint class from its fields in the name it is registered under in this module
+_DATAPOINT_SEPARATOR = "__"
 
-def zip_dir(zip_name: str, source_dir):
+# file in merged_data that records from which per-trial files each merged matrix was built
+MERGED_DATA_MANIFEST = "manifest.json"
+
+# default size of the blocks of trials read at once from an hdf5 dataset during conversion
+CONVERSION_BLOCK_BYTES = 64 * 1024 ** 2
+
+
+def zip_dir(zip_name: str, source_dir, compression=ZIP_DEFLATED):
     """
-    Zips all files in `source_dir` into a zip file named `zip_name`.
+    Zips all files in `source_dir` into a zip file named `zip_name`. Use compression=ZIP_STORED for archives that
+    FileTree datasets read directly (unzip=False), their .npy files can then be memory-mapped from the archive.
     """
     src_path = Path(source_dir).absolute().resolve(strict=True)
-    with ZipFile(zip_name, "w", ZIP_DEFLATED) as zf:
+    with ZipFile(zip_name, "w", compression) as zf:
         for file in tqdm(src_path.rglob("*")):
             zf.write(file, file.relative_to(src_path.parent))
 
 
+def _save_npy_atomic(path, val):
+    """
+    Saves `val` to `path` like np.save, but through a temporary file, so that an interrupted write never leaves a
+    truncated .npy file at `path`.
+    """
+    partial_path = path.with_name(path.name + ".partial")
+    with open(partial_path, "wb") as fh:
+        np.save(fh, val)
+    os.replace(partial_path, path)
+
+
 def _savenpy(path, val, overwrite):
     if not np.isscalar(val) and len(val.shape) > 0 and val[0].dtype.char == "S":  # convert bytes to unicode
         val = val.astype(str)
     if not path.exists() or overwrite:
-        logger.info("Saving", path)
-        np.save(path, val)
+        logger.info("Saving %s", path)
+        _save_npy_atomic(path, val)
     else:
-        logger.warn("Not overwriting", path)
+        logger.warning("Not overwriting %s", path)
+
+
+def _run_bounded(pool, tasks, max_pending, callback=None):
+    """
+    Submits the tasks (tuples of function and arguments) to `pool`, with at most `max_pending` of them submitted
+    but not finished at any time. `tasks` is consumed lazily, so work done to create a task (e.g. reading a block of
+    data) is throttled as well. `callback` is called with the result of every task in the calling thread.
+    """
+    pending = set()
+
+    def collect(done):
+        for future in done:
+            result = future.result()
+            if callback is not None:
+                callback(result)
+
+    for fn, *args in tasks:
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        pending.add(pool.submit(fn, *args))
+    done, _ = wait(pending)
+    collect(done)
+
+
+def _throughput_report(n_trials, n_bytes, seconds):
+    return {
+        "trials": n_trials,
+        "megabytes": n_bytes / 1024 ** 2,
+        "seconds": seconds,
+        "trials_per_s": n_trials / seconds if seconds > 0 else float("inf"),
+        "megabytes_per_s": n_bytes / 1024 ** 2 / seconds if seconds > 0 else float("inf"),
+    }
 
 
 def convert_movies_h5_dataset_to_folder(
@@ -35,15 +93,27 @@ def convert_movies_h5_dataset_to_folder(
     outpath=None,
     overwrite=False,
     data_keys=("inputs", "responses", "behavior", "eye_position"),
+    n_workers=4,
+    max_pending=None,
 ):
     """
     Converts an HDF5 dataset used for mouse movie data into a directory structure
     that can be used by the FileTreeDataset.
 
+    The trials are read from the hdf5 file in this thread and written by a pool of `n_workers` writer threads.
+    Files are written atomically and existing files are neither read nor written again (unless `overwrite`), so an
+    interrupted conversion can be resumed by running it again.
+
     Args:
         filename:       filename of the hdf5 file
         outpath:        location of the FileTreeDataset (default .)
         overwrite:      overwrite existing files
+        n_workers:      number of writer threads
+        max_pending:    maximal number of trials read but not written yet (default 2 * n_workers)
+
+    Returns:
+        dict: data_key -> throughput report (trials, megabytes, seconds, trials_per_s, megabytes_per_s) of the trials
+            converted in this run
     """
     if not isinstance(data_keys, Mapping):
         data_keys = {k: k for k in data_keys}
@@ -51,16 +121,27 @@ def convert_movies_h5_dataset_to_folder(
     h5file = Path(filename)
     outpath = Path(outpath) or h5file.with_suffix("")  # drop extension to form target output
 
-    with h5py.File(filename, "r") as fid:
+    report = {}
+    with h5py.File(filename, "r") as fid, ThreadPoolExecutor(max_workers=n_workers) as pool:
         for data_key, mapped_name in data_keys.items():
             subpath = outpath / "data/{}".format(mapped_name)
             subpath.mkdir(exist_ok=True, parents=True)
-            for key in tqdm(
-                fid[data_key].keys(),
-                desc="Saving {}".format(data_key),
-            ):
-                outfile = subpath / "{}.npy".format(key)
-                _savenpy(outfile, fid[data_key][key][()], overwrite)
+            start, n_trials, n_bytes = time.perf_counter(), 0, 0
+
+            def tasks():
+                nonlocal n_trials, n_bytes
+                for key in tqdm(fid[data_key].keys(), desc="Saving {}".format(data_key)):
+                    outfile = subpath / "{}.npy".format(key)
+                    if outfile.exists() and not overwrite:
+                        continue
+                    value = fid[data_key][key][()]
+                    n_trials += 1
+                    n_bytes += np.asarray(value).nbytes
+                    yield _savenpy, outfile, value, overwrite
+
+            _run_bounded(pool, tasks(), max_pending or 2 * n_workers)
+            report[data_key] = _throughput_report(n_trials, n_bytes, time.perf_counter() - start)
+            logger.info("Converted %s: %s", data_key, report[data_key])
 
         # map data for trials
         trial_info_keys = [
@@ -110,35 +191,158 @@ def convert_movies_h5_dataset_to_folder(
         logger.info("Saving statistics")
         fid["statistics"].visititems(statistics_func)
 
+    return report
+
 
-def convert_static_h5_dataset_to_folder(filename, outpath=None, overwrite=False, ignore_all_behaviors=False):
+def _h5_block_rows(dataset, block_bytes):
+    """
+    Number of trials per block, such that a block has about `block_bytes` bytes and, for chunked datasets, consists
+    of whole chunks along the trial dimension.
+    """
+    trial_bytes = max(1, dataset.dtype.itemsize * int(np.prod(dataset.shape[1:])))
+    rows = max(1, block_bytes // trial_bytes)
+    if dataset.chunks is not None:
+        chunk_rows = dataset.chunks[0]
+        rows = max(chunk_rows, rows // chunk_rows * chunk_rows)
+    return int(rows)
+
+
+def _open_partial_merged(merged_file, dtype, shape, block_rows, overwrite):
+    """
+    Opens the memory-mapped file that the matrix `merged_file` is written to, together with the start trials of the
+    blocks that are already in it from an interrupted conversion.
+    """
+    partial_file = merged_file.with_name(merged_file.name + ".partial")
+    progress_file = merged_file.with_name(merged_file.name + ".progress")
+    if not overwrite and partial_file.exists() and progress_file.exists():
+        with open(progress_file) as fh:
+            progress = json.load(fh)
+        if progress["block_rows"] == block_rows:
+            merged = np.lib.format.open_memmap(partial_file, mode="r+")
+            if merged.dtype == dtype and merged.shape == shape:
+                return merged, set(progress["done"])
+            del merged
+    merged_file.parent.mkdir(exist_ok=True, parents=True)
+    return np.lib.format.open_memmap(partial_file, mode="w+", dtype=dtype, shape=shape), set()
+
+
+def _write_block(block, start, outfiles, merged):
+    for i, outfile in outfiles:
+        _save_npy_atomic(outfile, block[i - start])
+    if merged is not None:
+        merged[start : start + len(block)] = block
+    return start
+
+
+def _convert_h5_data_key(dataset, outpath, data_key, layout, overwrite, pool, block_bytes, max_pending):
+    """
+    Converts one hdf5 dataset with trials along the first dimension to data/`data_key`/<trial>.npy and/or
+    merged_data/`data_key`.npy, see `convert_static_h5_dataset_to_folder`.
+    """
+    n_trials = dataset.shape[0]
+    block_rows = _h5_block_rows(dataset, block_bytes)
+    data_folder = outpath / "data" / data_key
+    merged_file = outpath / "merged_data" / "{}.npy".format(data_key)
+    write_files = layout in ("legacy", "both")
+    merged, done = None, set()
+    if write_files:
+        data_folder.mkdir(exist_ok=True, parents=True)
+    if layout in ("consolidated", "both") and (overwrite or not merged_file.exists()):
+        merged, done = _open_partial_merged(merged_file, dataset.dtype, dataset.shape, block_rows, overwrite)
+    progress_file = merged_file.with_name(merged_file.name + ".progress")
+
+    start_time, n_read, n_bytes = time.perf_counter(), 0, 0
+
+    def tasks():
+        nonlocal n_read, n_bytes
+        for start in tqdm(range(0, n_trials, block_rows), desc="Saving {}".format(data_key)):
+            stop = min(start + block_rows, n_trials)
+            outfiles = []
+            if write_files:
+                outfiles = [(i, data_folder / "{}.npy".format(i)) for i in range(start, stop)]
+                outfiles = [(i, f) for i, f in outfiles if overwrite or not f.exists()]
+            write_merged = merged is not None and start not in done
+            if not outfiles and not write_merged:
+                continue
+            block = dataset[start:stop]
+            n_read += stop - start
+            n_bytes += block.nbytes
+            yield _write_block, block, start, outfiles, merged if write_merged else None
+
+    def block_written(start):
+        if merged is not None:
+            done.add(start)
+            with open(progress_file, "w") as fh:
+                json.dump({"block_rows": block_rows, "done": sorted(done)}, fh)
+
+    _run_bounded(pool, tasks(), max_pending, callback=block_written)
+
+    if merged is not None:
+        partial_file = Path(merged.filename)
+        merged.flush()
+        del merged
+        os.replace(partial_file, merged_file)
+        progress_file.unlink()
+        if write_files:
+            # the per-trial files are the sources of the matrix, see `build_merged_data`
+            manifest_file = merged_file.parent / MERGED_DATA_MANIFEST
+            manifest = _read_manifest(manifest_file)
+            source, output = _source_fingerprint(data_folder), _output_fingerprint(merged_file)
+            manifest[data_key] = {"source": source, "output": output}
+            _write_manifest(manifest_file, manifest)
+
+    return _throughput_report(n_read, n_bytes, time.perf_counter() - start_time)
+
+
+def convert_static_h5_dataset_to_folder(
+    filename,
+    outpath=None,
+    overwrite=False,
+    ignore_all_behaviors=False,
+    layout="legacy",
+    n_workers=4,
+    block_bytes=CONVERSION_BLOCK_BYTES,
+    max_pending=None,
+):
     """
     Converts a h5 dataset used for mouse data into a directory structure that can be used by the FileTreeDataset.
 
+    The trials of every data_key are read in blocks of whole hdf5 chunks and written by a pool of writer threads.
+    Output files are written atomically, and trials (or blocks of the merged matrices) that were already written are
+    neither read nor written again (unless `overwrite`), so an interrupted conversion can be resumed by running it
+    again with the same arguments.
+
     Args:
         filename:       filename of the hdf5 file
         outpath:        location of the FileTreeDataset (default .)
         overwrite:      overwrite existing files
+        ignore_all_behaviors: only convert images and responses
+        layout:         "legacy" writes one file per trial to data/<data_key>/<trial>.npy, "consolidated" writes
+                        one matrix with all trials to merged_data/<data_key>.npy, which FileTreeDatasets read with
+                        `load_data_to_cache` or `memory_map_merged_data`, and "both" writes both
+        n_workers:      number of writer threads
+        block_bytes:    approximate size of the blocks read at once
+        max_pending:    maximal number of blocks read but not written yet (default 2 * n_workers)
 
+    Returns:
+        dict: data_key -> throughput report (trials, megabytes, seconds, trials_per_s, megabytes_per_s) of the trials
+            converted in this run
     """
+    if layout not in ("legacy", "consolidated", "both"):
+        raise ValueError("layout must be 'legacy', 'consolidated' or 'both', not {}".format(layout))
     h5file = Path(filename)
-    outpath = outpath or (h5file.parent / h5file.stem)
+    outpath = Path(outpath or (h5file.parent / h5file.stem))
 
-    with h5py.File(filename) as fid:
+    report = {}
+    with h5py.File(filename, "r") as fid, ThreadPoolExecutor(max_workers=n_workers) as pool:
         attributes = (
             ["images", "responses", "behavior", "pupil_center"] if not ignore_all_behaviors else ["images", "responses"]
         )
         for data_key in attributes:
-            subpath = outpath / "data/{}".format(data_key)
-            subpath.mkdir(exist_ok=True, parents=True)
-            for i, value in tqdm(
-                enumerate(fid[data_key]),
-                total=fid[data_key].shape[0],
-                desc="Saving {}".format(data_key),
-            ):
-                outfile = subpath / "{}.npy".format(i)
-                if not outfile.exists() or overwrite:
-                    np.save(outfile, value)
+            report[data_key] = _convert_h5_data_key(
+                fid[data_key], outpath, data_key, layout, overwrite, pool, block_bytes, max_pending or 2 * n_workers
+            )
+            logger.info("Converted %s: %s", data_key, report[data_key])
 
         # save tiers
         for data_key in ["tiers"]:
@@ -173,6 +377,141 @@ def convert_static_h5_dataset_to_folder(filename, outpath=None, overwrite=False,
 
         fid["statistics"].visititems(statistics_func)
 
+    return report
+
+
+def _source_fingerprint(data_folder):
+    """
+    Summary of the per-trial .npy files in `data_folder` that changes whenever a file is added, removed or rewritten.
+    """
+    n_files, n_bytes, mtime_ns = 0, 0, 0
+    with os.scandir(data_folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                n_files += 1
+                n_bytes += stat.st_size
+                mtime_ns = max(mtime_ns, stat.st_mtime_ns)
+    return {"files": n_files, "bytes": n_bytes, "mtime_ns": mtime_ns}
+
+
+def _output_fingerprint(path):
+    stat = path.stat()
+    return {"bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _merge_data_key(data_folder, merged_file, n_files, check_nans=True):
+    """
+    Stacks the files 0.npy, ..., <n_files - 1>.npy of `data_folder` into the matrix `merged_file` with shape
+    (n_files, *shape of a trial) and the dtype of the first trial. The trials are written one by one into a
+    memory-mapped .npy file, which replaces `merged_file` only once it is complete.
+
+    Returns:
+        fingerprint of the written file
+    """
+    data_folder, merged_file = Path(data_folder), Path(merged_file)
+    first = np.load(data_folder / "0.npy")
+    partial_file = merged_file.with_name(merged_file.name + ".partial")
+    merged = np.lib.format.open_memmap(partial_file, mode="w+", dtype=first.dtype, shape=(n_files, *first.shape))
+    try:
+        for nr in range(n_files):
+            trial = first if nr == 0 else np.load(data_folder / "{}.npy".format(nr))
+            if trial.shape != first.shape:
+                raise ValueError(
+                    "{}/{}.npy has shape {}, but 0.npy has shape {}".format(data_folder, nr, trial.shape, first.shape)
+                )
+            if check_nans and np.issubdtype(trial.dtype, np.inexact) and np.isnan(trial).any():
+                raise ValueError("{}/{}.npy contains NaNs".format(data_folder, nr))
+            merged[nr] = trial
+        merged.flush()
+    except BaseException:
+        del merged
+        partial_file.unlink()
+        raise
+    del merged
+    os.replace(partial_file, merged_file)
+    return _output_fingerprint(merged_file)
+
+
+def _read_manifest(path):
+    if not path.exists():
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def _write_manifest(path, manifest):
+    tmp_path = path.with_name(path.name + ".partial")
+    with open(tmp_path, "w") as fh:
+        json.dump(manifest, fh, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def build_merged_data(folders, data_keys=None, n_workers=None, overwrite=False, check_nans=True):
+    """
+    Builds or refreshes the folder 'merged_data' of FileTreeDatasets. For every data_key, the per-trial files in
+    data/<data_key> are stacked into merged_data/<data_key>.npy (see `FileTreeDatasetBase.load_data_to_cache`), keeping
+    the dtype of the files. Matrices are built in parallel, one data_key of one dataset per process.
+
+    The sources of every matrix are recorded in merged_data/manifest.json. A matrix is only rebuilt if files were
+    added to, removed from or changed in its data folder since it was built, or if the matrix itself changed.
+    Files in merged_data that do not correspond to a data folder (e.g. trial_id.npy) are left untouched.
+
+    Args:
+        folders (str or list): folders of FileTreeDatasets
+        data_keys (list, optional): data_keys to merge. Defaults to all folders in data/ of each dataset.
+        n_workers (int, optional): number of processes. Defaults to the number of cpus, 0 builds in this process.
+        overwrite (bool): rebuild all matrices, even if their sources did not change
+        check_nans (bool): raise a ValueError if a floating point trial contains NaNs
+
+    Returns:
+        dict: folder -> {data_key: "built" or "unchanged"}
+    """
+    if isinstance(folders, (str, Path)):
+        folders = [folders]
+
+    status, manifests, tasks = {}, {}, []
+    for folder in map(Path, folders):
+        data_folder, merged_folder = folder / "data", folder / "merged_data"
+        keys = data_keys if data_keys is not None else sorted(p.name for p in data_folder.iterdir() if p.is_dir())
+        merged_folder.mkdir(exist_ok=True)
+        manifests[folder] = _read_manifest(merged_folder / MERGED_DATA_MANIFEST)
+        status[str(folder)] = {}
+        for data_key in keys:
+            source = _source_fingerprint(data_folder / data_key)
+            merged_file = merged_folder / "{}.npy".format(data_key)
+            entry = manifests[folder].get(data_key)
+            if (
+                not overwrite
+                and entry is not None
+                and entry["source"] == source
+                and merged_file.exists()
+                and entry["output"] == _output_fingerprint(merged_file)
+            ):
+                status[str(folder)][data_key] = "unchanged"
+            else:
+                tasks.append((folder, data_key, source, data_folder / data_key, merged_file))
+
+    def record(task, output):
+        folder, data_key, source = task[:3]
+        manifests[folder][data_key] = {"source": source, "output": output}
+        # written after every matrix, so an interrupted build keeps the matrices that were completed
+        _write_manifest(folder / "merged_data" / MERGED_DATA_MANIFEST, manifests[folder])
+        status[str(folder)][data_key] = "built"
+        logger.info("Merged {}/data/{}".format(folder, data_key))
+
+    if n_workers == 0:
+        for task in tqdm(tasks, desc="merged_data"):
+            record(task, _merge_data_key(task[3], task[4], task[2]["files"], check_nans))
+    elif tasks:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {
+                pool.submit(_merge_data_key, task[3], task[4], task[2]["files"], check_nans): task for task in tasks
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="merged_data"):
+                record(futures[future], future.result())
+    return status
+
 
 def load_dict_from_hdf5(filename):
     """
@@ -215,3 +554,125 @@ def recursively_load_dict_contents_from_group(h5file, path="/"):
             else:
                 ans[key] = recursively_load_dict_contents_from_group(h5file, path + key + "/")
     return ans
+
+
+def repeat_groups(keys):
+    """
+    Groups the positions of identical entries of `keys`, e.g. the trials showing the same image. The groups are found
+    with one sort of the keys, instead of comparing all keys with every unique key.
+
+    Args:
+        keys (np.array): key of every element, e.g. the image id of every trial. Shape: (n,)
+
+    Returns:
+        tuple: the sorted unique keys and a list with one array per unique key holding the positions of its elements
+            in ascending order
+    """
+    unique, inverse = np.unique(np.asarray(keys), return_inverse=True)
+    if len(unique) == 0:
+        return unique, []
+    order = np.argsort(inverse, kind="stable")
+    boundaries = np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1]
+    return unique, np.split(order, boundaries)
+
+
+def to_storage_dtype(data, dtype, out=None, block_bytes=CONVERSION_BLOCK_BYTES):
+    """
+    Converts `data` to the (smaller) storage dtype `dtype`, in blocks of trials along the first axis, so that data
+    memory-mapped from disk is never loaded in full precision at once. Conversions that would change the data
+    are refused: integer dtypes only take integer values within their range, floating point dtypes only values
+    within their range (e.g. below 65504 for float16, smaller values are rounded to its precision).
+
+    Args:
+        data (np.array): data with trials along the first axis
+        dtype (str or np.dtype): storage dtype, e.g. "uint8" or "float16"
+        out (np.array, optional): array of the shape of `data` and dtype `dtype` to write to, e.g. a memory map
+        block_bytes (int): approximate size of the blocks of `data` converted at once
+
+    Returns:
+        np.array: the converted data (`out` if given)
+
+    Raises:
+        ValueError: if the data cannot be represented in `dtype`
+    """
+    dtype = np.dtype(dtype)
+    if data.dtype == dtype and out is None:
+        return data
+    if data.ndim == 0:
+        return to_storage_dtype(data.reshape(1), dtype).reshape(())
+    if out is None:
+        out = np.empty(data.shape, dtype=dtype)
+    rows = max(1, block_bytes // max(1, data[:1].nbytes))
+    for start in range(0, len(data), rows):
+        block = np.asarray(data[start : start + rows])
+        converted = block.astype(dtype)
+        if np.issubdtype(dtype, np.integer):
+            lossless = np.array_equal(converted, block)
+        else:
+            lossless = np.count_nonzero(np.isinf(converted)) == np.count_nonzero(np.isinf(block))
+        if not lossless:
+            raise ValueError("The data cannot be stored as {} without changing its values".format(dtype))
+        out[start : start + rows] = converted
+    return out
+
+
+def first_positions(keys, ids):
+    """
+    Finds the position of the first occurrence of every id in `keys`, like
+    `[np.where(keys == i)[0][0] for i in ids]`, with one sort of the keys and a binary search for all ids.
+
+    Args:
+        keys (np.array): key of every element, e.g. the unit id of every neuron. Shape: (n,)
+        ids (array-like): ids to look up
+
+    Returns:
+        np.array: positions of the ids in `keys`, in the order of `ids`
+
+    Raises:
+        ValueError: if an id does not occur in `keys`
+    """
+    keys, ids = np.asarray(keys), np.asarray(ids)
+    # equal keys keep their order in a stable sort, so the leftmost match is the first occurrence
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    positions = np.searchsorted(sorted_keys, ids)
+    found = positions < len(keys)
+    found[found] = sorted_keys[positions[found]] == ids[found]
+    if not found.all():
+        raise ValueError("{} not found".format(ids[~found].tolist()))
+    return order[positions]
+
+
+def datapoint_class(fields, name="DataPoint"):
+    """
+    Returns a namedtuple class `name` with the given fields, that can be pickled, e.g. to send data points from the
+    worker processes of a DataLoader to the main process. Classes created with namedtuple inside a function cannot be
+    found by pickle. The classes returned here are registered in this module under a name built from `name` and the
+    fields, and are recreated on demand by the module's __getattr__ in processes that have not created them yet.
+    Calling the function again with the same arguments returns the same class.
+
+    Args:
+        fields (iterable of str): names of the fields. They must not contain a double underscore.
+        name (str): name of the class, must end with "Point"
+
+    Returns:
+        namedtuple class
+    """
+    fields = tuple(fields)
+    if not name.endswith("Point") or any(_DATAPOINT_SEPARATOR in f for f in (name,) + fields):
+        raise ValueError("Cannot create a picklable datapoint class {} with fields {}".format(name, fields))
+    qualname = _DATAPOINT_SEPARATOR.join((name,) + fields)
+    cls = globals().get(qualname)
+    if cls is None:
+        cls = namedtuple(name, fields, module=__name__)
+        cls.__qualname__ = qualname
+        globals()[qualname] = cls
+    return cls
+
+
+def __getattr__(name):
+    # recreates the classes of datapoint_class when they are unpickled in a new process
+    name_and_fields = name.split(_DATAPOINT_SEPARATOR)
+    if len(name_and_fields) > 1 and name_and_fields[0].endswith("Point"):
+        return datapoint_class(name_and_fields[1:], name=name_and_fields[0])
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -10,4 +10,4 @@ This includes:
 """
 
 from .affine import Bias2DLayer, Scale2DLayer
-from .conv import DepthSeparableConv2d
+from .conv import ConstantChannelConv2d, DepthSeparableConv2d
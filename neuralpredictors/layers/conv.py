@@ -1,3 +1,4 @@
+import torch
 from torch import nn
 
 
@@ -28,3 +29,53 @@ class DepthSeparableConv2d(nn.Sequential):
             ),
         )
         self.add_module("out_depth_conv", nn.Conv2d(out_channels, out_channels, 1, bias=bias))
+
+
+class ConstantChannelConv2d(nn.Conv2d):
+    def __init__(self, *args, constant_channels=0, **kwargs):
+        """
+        nn.Conv2d whose last `constant_channels` input channels are constant over space for every sample, e.g.
+        behavioral variables added as channels to an image. Instead of materializing these channels as full planes,
+        they can be passed as one value per sample and channel (`constants` in forward). Their contribution to the
+        output is then added like a bias: the convolution of a plane of ones with the weights of each constant channel
+        (which is not constant close to the border if the input is padded), scaled by the value of the channel.
+        This equals the convolution of the input with the materialized channels up to floating point rounding, and
+        the parameters are the same as of the nn.Conv2d with all input channels.
+
+        Args:
+            *args, **kwargs: arguments of nn.Conv2d. in_channels includes the constant channels, groups must be 1.
+            constant_channels (int): number of constant input channels, which are the last channels of the input
+        """
+        super().__init__(*args, **kwargs)
+        if constant_channels and self.groups != 1:
+            raise ValueError("Constant channels are only supported for groups=1")
+        self.constant_channels = constant_channels
+
+    def forward(self, input, constants=None):
+        """
+        Args:
+            input (torch.Tensor): batch x channels x height x width. Either contains all in_channels, or only the
+                channels that are not constant.
+            constants (torch.Tensor, optional): batch x constant_channels. Values of the constant channels, if they
+                are not part of the input. If None, the missing constant channels are treated as zeros.
+        """
+        n_input_channels = self.in_channels - self.constant_channels
+        if input.shape[1] == self.in_channels and constants is None:
+            return super().forward(input)
+        if input.shape[1] != n_input_channels:
+            raise ValueError(
+                "Expected {} channels without the {} constant channels, but got {}".format(
+                    n_input_channels, self.constant_channels, input.shape[1]
+                )
+            )
+
+        ret = self._conv_forward(input, self.weight[:, :n_input_channels], self.bias)
+        if constants is None:
+            return ret
+
+        # response of every output channel to a plane of ones in each constant channel
+        constant_weight = self.weight[:, n_input_channels:].transpose(0, 1)
+        ones = input.new_ones((1, 1, *input.shape[2:]))
+        maps = self._conv_forward(ones, constant_weight.reshape(-1, 1, *self.kernel_size), None)
+        maps = maps.view(self.constant_channels, self.out_channels, *maps.shape[2:])
+        return ret + torch.einsum("bc,cohw->bohw", constants.to(maps.dtype), maps)
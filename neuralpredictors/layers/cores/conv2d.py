@@ -11,7 +11,7 @@ from ... import regularizers
 from ..activations import AdaptiveELU
 from ..affine import Bias2DLayer, Scale2DLayer
 from ..attention import AttentionConv
-from ..conv import DepthSeparableConv2d
+from ..conv import ConstantChannelConv2d, DepthSeparableConv2d
 from ..hermite import (
     HermiteConv2D,
     RotationEquivariantBatchNorm2D,
@@ -59,6 +59,7 @@ class Stacked2dCore(Core, nn.Module):
         depth_separable=False,
         attention_conv=False,
         linear=False,
+        constant_input_channels=0,
     ):
         """
         Args:
@@ -97,6 +98,10 @@ class Stacked2dCore(Core, nn.Module):
             depth_separable: Boolean, if True, uses depth-separable convolutions in all layers after the first one.
             attention_conv: Boolean, if True, uses self-attention instead of convolution for all layers after the first one.
             linear:         Boolean, if True, removes all nonlinearities
+            constant_input_channels: Integer, number of the last input channels that are constant over space (e.g.
+                            behavior added as channels). They are included in input_channels, but may be passed to
+                            forward as one value per sample (`constants`) instead of as full planes, and are then
+                            broadcast by the first layer (see neuralpredictors.layers.conv.ConstantChannelConv2d).
 
             To enable learning batch_norms bias and scale independently, the arguments bias, batch_norm and batch_norm_scale
             work together: By default, all are true. In this case there won't be a bias learned in the convolutional layer, but
@@ -143,6 +148,7 @@ class Stacked2dCore(Core, nn.Module):
         else:
             self.stack = [*range(self.num_layers)[stack:]] if isinstance(stack, int) else stack
         self.linear = linear
+        self.constant_input_channels = constant_input_channels
 
         if depth_separable:
             self.conv_layer_name = "ds_conv"
@@ -195,13 +201,20 @@ class Stacked2dCore(Core, nn.Module):
 
     def add_first_layer(self):
         layer = OrderedDict()
-        layer["conv"] = nn.Conv2d(
-            self.input_channels,
-            self.hidden_channels,
-            self.input_kern,
+        conv_kwargs = dict(
             padding=self.input_kern // 2 if self.pad_input else 0,
             bias=self.bias and not self.batch_norm,
         )
+        if self.constant_input_channels:
+            layer["conv"] = ConstantChannelConv2d(
+                self.input_channels,
+                self.hidden_channels,
+                self.input_kern,
+                constant_channels=self.constant_input_channels,
+                **conv_kwargs,
+            )
+        else:
+            layer["conv"] = nn.Conv2d(self.input_channels, self.hidden_channels, self.input_kern, **conv_kwargs)
         self.add_bn_layer(layer)
         self.add_activation(layer)
         self.features.add_module("layer0", nn.Sequential(layer))
@@ -237,11 +250,23 @@ class Stacked2dCore(Core, nn.Module):
             """
             super().__init__(**kwargs)
 
-    def forward(self, input_):
+    def forward(self, input_, constants=None):
+        """
+        Args:
+            input_: batch x channels x height x width
+            constants (optional): batch x constant_input_channels. Values of the constant input channels, if they are
+                not included in input_ (see constant_input_channels)
+        """
         ret = []
         for l, feat in enumerate(self.features):
             do_skip = l >= 1 and self.skip > 1
-            input_ = feat(input_ if not do_skip else torch.cat(ret[-min(self.skip, l) :], dim=1))
+            if l == 0 and constants is not None:
+                # the first conv broadcasts the constant channels, the rest of the layer is applied as usual
+                input_ = feat.conv(input_, constants)
+                for module in list(feat)[1:]:
+                    input_ = module(input_)
+            else:
+                input_ = feat(input_ if not do_skip else torch.cat(ret[-min(self.skip, l) :], dim=1))
             ret.append(input_)
 
         return torch.cat([ret[ind] for ind in self.stack], dim=1)
@@ -1,8 +1,20 @@
 from torch import nn
 
 
+def _normalize_batch(normalizer, inputs, behavior, pupil_center, trial_idx, channel_constants):
+    """
+    Normalizes the inputs of a batch with a FusedNeuroNormalizer (see neuralpredictors.data.transforms), fields that
+    are None are passed on
+    """
+    fields = (("behavior", behavior), ("pupil_center", pupil_center), ("trial_idx", trial_idx),
+              ("channel_constants", channel_constants))
+    return (normalizer.normalize(normalizer.in_name, inputs),) + tuple(
+        v if v is None else normalizer.normalize(k, v) for k, v in fields
+    )
+
+
 class ModulatedFiringRateEncoder(nn.Module):
-    def __init__(self, core, readout, *, shifter=None, modulator=None, elu_offset=0.0):
+    def __init__(self, core, readout, *, shifter=None, modulator=None, elu_offset=0.0, normalizer=None):
         """
         An Encoder that wraps the core, readout and optionally a shifter amd modulator into one model.
         The output is one positive value that can be interpreted as a firing rate, for example for a Poisson distribution.
@@ -12,6 +24,8 @@ class ModulatedFiringRateEncoder(nn.Module):
             elu_offset (float): Offset value in the final elu non-linearity. Defaults to 0.
             shifter (optional[nn.ModuleDict]): Shifter network. Refer to neuralpredictors.layers.shifters. Defaults to None.
             modulator (optional[nn.ModuleDict]): Modulator network. Modulator networks are now implemented. Defaults to None.
+            normalizer (optional[nn.ModuleDict]): FusedNeuroNormalizer per data_key that normalizes the batches of
+                unnormalized dataloaders (normalize="model"). Refer to neuralpredictors.data.transforms. Defaults to None.
         """
         super().__init__()
         self.core = core
@@ -19,6 +33,7 @@ class ModulatedFiringRateEncoder(nn.Module):
         self.shifter = shifter
         self.modulator = modulator
         self.offset = elu_offset
+        self.normalizer = normalizer
 
     def forward(
         self,
@@ -34,9 +49,16 @@ class ModulatedFiringRateEncoder(nn.Module):
         history=None,
         state=None,
         rank_id=None,
+        channel_constants=None,
         **kwargs
     ):
-        x = self.core(inputs)
+        if self.normalizer is not None:
+            # the batch is normalized here, on its device, instead of sample by sample in the dataloader
+            inputs, behavior, pupil_center, trial_idx, channel_constants = _normalize_batch(
+                self.normalizer[data_key], inputs, behavior, pupil_center, trial_idx, channel_constants
+            )
+        # constant input channels (e.g. behavior) that are not materialized as planes are broadcast by the core
+        x = self.core(inputs) if channel_constants is None else self.core(inputs, constants=channel_constants)
         if detach_core:
             x = x.detach()
 
@@ -68,7 +90,7 @@ class ModulatedFiringRateEncoder(nn.Module):
 
 
 class FiringRateEncoder(nn.Module):
-    def __init__(self, core, readout, *, shifter=None, modulator=None, elu_offset=0.0):
+    def __init__(self, core, readout, *, shifter=None, modulator=None, elu_offset=0.0, normalizer=None):
         """
         An Encoder that wraps the core, readout and optionally a shifter amd modulator into one model.
         The output is one positive value that can be interpreted as a firing rate, for example for a Poisson distribution.
@@ -78,6 +100,8 @@ class FiringRateEncoder(nn.Module):
             elu_offset (float): Offset value in the final elu non-linearity. Defaults to 0.
             shifter (optional[nn.ModuleDict]): Shifter network. Refer to neuralpredictors.layers.shifters. Defaults to None.
             modulator (optional[nn.ModuleDict]): Modulator network. Modulator networks are not implemented atm (24/06/2021). Defaults to None.
+            normalizer (optional[nn.ModuleDict]): FusedNeuroNormalizer per data_key that normalizes the batches of
+                unnormalized dataloaders (normalize="model"). Refer to neuralpredictors.data.transforms. Defaults to None.
         """
         super().__init__()
         self.core = core
@@ -85,6 +109,7 @@ class FiringRateEncoder(nn.Module):
         self.shifter = shifter
         self.modulator = modulator
         self.offset = elu_offset
+        self.normalizer = normalizer
 
     def forward(
         self,
@@ -97,9 +122,16 @@ class FiringRateEncoder(nn.Module):
         trial_idx=None,
         shift=None,
         detach_core=False,
+        channel_constants=None,
         **kwargs
     ):
-        x = self.core(inputs)
+        if self.normalizer is not None:
+            # the batch is normalized here, on its device, instead of sample by sample in the dataloader
+            inputs, behavior, pupil_center, trial_idx, channel_constants = _normalize_batch(
+                self.normalizer[data_key], inputs, behavior, pupil_center, trial_idx, channel_constants
+            )
+        # constant input channels (e.g. behavior) that are not materialized as planes are broadcast by the core
+        x = self.core(inputs) if channel_constants is None else self.core(inputs, constants=channel_constants)
         if detach_core:
             x = x.detach()
 
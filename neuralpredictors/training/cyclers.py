@@ -1,3 +1,8 @@
+import queue
+import threading
+import time
+
+
 def cycle(iterable):
     # see https://github.com/pytorch/pytorch/issues/23900
     iterator = iter(iterable)
@@ -109,3 +114,90 @@ class ShortCycler:
 
     def __len__(self):
         return len(self.loaders) * self.min_batches
+
+
+class PrefetchCycler:
+    """
+    Wraps a cycler (e.g. LongCycler, ShortCycler or Exhauster) and fetches its (data_key, batch) pairs in a background
+    thread, keeping up to `queue_size` of them ready in a queue. The pairs are returned in exactly the order and
+    number of the wrapped cycler, while the loaders fetch and transform the next batches during the training step.
+
+    Counters of the last (or current) pass are kept for the trainer, see `stats`.
+    """
+
+    def __init__(self, cycler, queue_size=2):
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1, not {}".format(queue_size))
+        self.cycler = cycler
+        self.queue_size = queue_size
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.batches = 0
+        self.stalls = 0
+        self.stall_time = 0.0
+        self._queue_depth_sum = 0
+
+    @property
+    def stats(self):
+        """
+        Returns:
+            dict: batches returned, stalls (batches that were not ready when requested), stall_s (seconds spent
+                waiting for them) and mean_queue_depth (batches ready when a batch was requested)
+        """
+        return {
+            "batches": self.batches,
+            "stalls": self.stalls,
+            "stall_s": self.stall_time,
+            "mean_queue_depth": self._queue_depth_sum / self.batches if self.batches else 0.0,
+        }
+
+    def _produce(self, buffer, stop):
+        try:
+            for item in self.cycler:
+                while not stop.is_set():
+                    try:
+                        buffer.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            item, error = StopIteration, None
+        except BaseException as e:
+            # forwarded to the training loop and raised there
+            item, error = None, e
+        while not stop.is_set():
+            try:
+                buffer.put((item, error), timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        self._reset_counters()
+        buffer = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(buffer, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                depth = buffer.qsize()
+                start = time.perf_counter()
+                item, error = buffer.get()
+                if error is not None:
+                    raise error
+                if item is StopIteration:
+                    return
+                if depth == 0:
+                    self.stalls += 1
+                    self.stall_time += time.perf_counter() - start
+                self.batches += 1
+                self._queue_depth_sum += depth
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def __len__(self):
+        return len(self.cycler)
@@ -55,36 +55,11 @@ folders = [x.replace("\\", "/") for x in folders]
 folders
 
 # %%
-for folder in folders:
-    print('Working on folder: {}'.format(folder), flush=True)
-
-    # find the different data folders with individual files per trial
-    subfolders = glob.glob(os.path.join(folder, 'data', '*'))
-    subnames = [os.path.basename(f) for f in subfolders]
-    # subnames are e.g. ['behavior', 'pupil_center', 'images', 'responses']
-
-    # create new directory if it does not exist
-    save_folder = os.path.join(folder, 'merged_data')
-    if not os.path.exists(save_folder):
-        os.makedirs(save_folder)
-
-    # iterate through all folders, load individual files and save as one large matrix
-    for subname in subnames:
-        data_folder = os.path.join(folder, 'data', subname)
-        nr_files = len(glob.glob(os.path.join(data_folder, '*')))
-        shape = np.load(os.path.join(data_folder, '0.npy')).shape
-        data = np.empty((nr_files, *shape))
-
-        for nr in tqdm(range(nr_files), desc=subname):
-            data[nr] = np.load(os.path.join(data_folder, '{}.npy'.format(nr)))
-
-        # (nr_trials, *) e.g. (5983, 3) for behavior
-        data_mat = np.array(data)
+from neuralpredictors.data.utils import build_merged_data
 
-        # assert no nans
-        assert not np.isnan(data_mat).any(), f'Nans in data_mat {subname}'
-        
-        np.save(os.path.join(save_folder, '{}.npy'.format(subname)), data_mat)
+# stacks the individual trial files of every folder in data/ in parallel, keeping their dtype. Matrices whose trial
+# files did not change since the last run are skipped, see scripts/build_merged_data.py to run this from the shell
+build_merged_data(folders)
 
 # %% [markdown]
 # ## Part 2: Extract trial order from timestamps and save
@@ -510,3 +485,13 @@ for key in keys:
     np.save(f"{merged_folder}/state.npy", reordered_nmf)
 
 
+# %% [markdown]
+# ## Statistics of the additional variables
+# The normalizers read meta/statistics/<variable>/all/{mean,std,min,max,median}.npy. Compute them for the new
+# variables in one pass over merged_data (see scripts/build_statistics.py to run this from the shell)
+
+# %%
+from neuralpredictors.data.statistics import build_statistics
+
+build_statistics(folders, data_keys=['history', 'state'], overwrite=True)
+
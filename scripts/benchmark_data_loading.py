@@ -0,0 +1,96 @@
+""" Script to compare the throughput of the different data loading backends
+
+Iterates once over the train loader of a session for every backend and prints samples per second.
+Example:
+    python scripts/benchmark_data_loading.py -p notebooks/data/IM_prezipped/<animal>/<session> -n 50
+"""
+
+import sys, os
+if 'scripts' in os.getcwd():
+    # change to main directory
+    os.chdir('..')
+sys.path.insert(0, '.')
+
+import argparse
+import time
+
+from sensorium.datasets.mouse_loaders import static_loader
+
+# name of the backend -> value of the argument preload_from_merged_data
+BACKENDS = {
+    'files': False,
+    'cache': True,
+    'mmap': 'mmap',
+}
+
+
+def time_loader(loader, n_batches=None):
+    """ Iterate over the loader and return (number of samples, seconds) """
+    n_samples = 0
+    start = time.perf_counter()
+    for batch_nr, batch in enumerate(loader):
+        n_samples += batch[0].shape[0]
+        if n_batches is not None and batch_nr + 1 >= n_batches:
+            break
+    return n_samples, time.perf_counter() - start
+
+
+def benchmark_backend(path, backend, batch_size=128, n_batches=None, epochs=2, **loader_kwargs):
+    """ Build the loader for one backend and time `epochs` passes through the train set
+
+    Returns:
+        dict with the setup time and the samples per second of each epoch
+    """
+    start = time.perf_counter()
+    loaders = static_loader(
+        path,
+        batch_size,
+        tier='train',
+        cuda=False,
+        preload_from_merged_data=BACKENDS[backend],
+        **loader_kwargs,
+    )
+    result = {'backend': backend, 'setup_s': time.perf_counter() - start}
+    for epoch in range(epochs):
+        n_samples, seconds = time_loader(loaders['train'], n_batches=n_batches)
+        result['epoch{}_samples_per_s'.format(epoch)] = n_samples / seconds
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--path', required=True, help='folder of one session (FileTreeDataset)')
+    parser.add_argument('-b', '--batch_size', type=int, default=128)
+    parser.add_argument('-n', '--n_batches', type=int, default=None, help='limit the number of batches per epoch')
+    parser.add_argument('-e', '--epochs', type=int, default=2)
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--scale', type=float, default=0.25)
+    parser.add_argument('--fetch_batches', action='store_true', help='fetch and transform whole batches at once')
+    parser.add_argument('--num_workers', type=int, default=0, help='number of DataLoader worker processes')
+    parser.add_argument('--in_memory', action='store_true', help='slice batches from tensors of transformed samples')
+    parser.add_argument('--rescale_cache', action='store_true', help='cache the rescaled images in the dataset folder')
+    parser.add_argument('--lazy_constant_channels', action='store_true',
+                        help='pass behavior and pupil center as vectors instead of image channels')
+    parser.add_argument('--block_shuffle', type=int, default=None,
+                        help='shuffle the training set in blocks of this many neighbouring trials')
+    args = parser.parse_args()
+
+    for backend in args.backends:
+        result = benchmark_backend(
+            args.path,
+            backend,
+            batch_size=args.batch_size,
+            n_batches=args.n_batches,
+            epochs=args.epochs,
+            scale=args.scale,
+            fetch_batches=args.fetch_batches,
+            num_workers=args.num_workers,
+            in_memory=args.in_memory,
+            rescale_cache=args.rescale_cache,
+            lazy_constant_channels=args.lazy_constant_channels,
+            block_shuffle=args.block_shuffle,
+            include_behavior=True,
+            include_eye_position=True,
+        )
+        print(', '.join('{}: {:.2f}'.format(k, v) if isinstance(v, float) else '{}: {}'.format(k, v)
+                        for k, v in result.items()), flush=True)
@@ -0,0 +1,262 @@
+""" Script to benchmark the data pipeline on synthetic sessions, without the real data
+
+Writes synthetic sessions with the shapes of the Sensorium data (see sensorium/datasets/synthetic.py) and times
+static_loaders end-to-end for every combination of backend (preload_from_merged_data) and transform stack:
+    setup_s:          building the dataloaders of all sessions
+    first_batch_s:    from the start of the setup until the first training batch is available
+    samples_per_s:    training samples per second of the following batches
+    peak_rss_mb:      peak resident memory of the process, including the imports (about the same for all runs)
+    workers_peak_rss_mb: peak of the summed resident memory of the DataLoader workers (with --num_workers)
+Every combination runs in a new process, so the peak memory of one does not hide that of another.
+The results can be saved with --output and compared with a saved baseline, the script then exits with an error if
+the throughput dropped or the memory grew by more than --tolerance.
+Example:
+    python scripts/benchmark_synthetic.py --image_shape full --n_trials 1200 -o benchmark.json
+    python scripts/benchmark_synthetic.py --image_shape full --n_trials 1200 --baseline benchmark.json
+"""
+
+import sys, os
+if 'scripts' in os.getcwd():
+    # change to main directory
+    os.chdir('..')
+sys.path.insert(0, '.')
+
+import argparse
+import json
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from neuralpredictors.data.datasets.shared import remove_shared_sessions
+from neuralpredictors.training import LongCycler
+from sensorium.datasets.mouse_loaders import static_loaders
+from sensorium.datasets.synthetic import IMAGE_SHAPES, make_synthetic_session
+
+# name of the backend -> value of the argument preload_from_merged_data
+BACKENDS = {
+    'files': False,
+    'cache': True,
+    'mmap': 'mmap',
+    'shared': 'shared',
+}
+
+# name of the transform stack -> arguments of static_loaders
+STACKS = {
+    # images and responses only
+    'plain': dict(normalize=False),
+    # normalized images, responses, behavior and pupil center, the behavior as image channels
+    'behavior': dict(normalize=True, include_behavior=True, include_eye_position=True),
+    # all inputs of the ensemble models, as in saved_models/02_jobs/config_m4_ens0.yaml
+    'm4': dict(
+        normalize=True,
+        include_behavior=True,
+        include_eye_position=True,
+        include_trial_id=True,
+        include_rank_id=True,
+        include_history=True,
+        include_behav_state=True,
+        adjusted_normalization=True,
+        use_ensemble_tier=True,
+        ensemble_nr=0,
+    ),
+}
+
+# stacks with data_keys that only exist in merged_data (ids and regressors), which the files backend does not read
+MERGED_DATA_STACKS = ('m4',)
+
+# results that get worse when they grow, the others get worse when they shrink
+LOWER_IS_BETTER = ('setup_s', 'first_batch_s', 'peak_rss_mb', 'workers_peak_rss_mb')
+
+# changes of times and memory below these are noise, whatever their relative size
+NOISE = {'_s': 0.1, '_mb': 20.0}
+
+
+def _status_kb(pid, field):
+    """ Value of `field` (e.g. VmRSS) in /proc/<pid>/status in kB, None if the process or field does not exist """
+    try:
+        with open('/proc/{}/status'.format(pid)) as fh:
+            for line in fh:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB. ru_maxrss is only used without /proc, because a process created by
+    fork and exec inherits the peak of its parent there.
+    """
+    peak = _status_kb('self', 'VmHWM')
+    if peak is not None:
+        return peak / 1024
+    if resource is None:
+        return float('nan')
+    # kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** (2 if sys.platform == 'darwin' else 1)
+
+
+class ChildrenMemory(threading.Thread):
+    """ Samples the summed resident memory of the child processes (the DataLoader workers) and keeps its peak in MB """
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_mb = 0.0 if os.path.isdir('/proc/self/task') else float('nan')
+        self._finished = threading.Event()
+
+    def _children(self):
+        pids = set()
+        for task in os.listdir('/proc/self/task'):
+            try:
+                with open('/proc/self/task/{}/children'.format(task)) as fh:
+                    pids.update(fh.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def run(self):
+        while self.peak_mb == self.peak_mb and not self._finished.wait(self.interval):
+            rss = sum(_status_kb(pid, 'VmRSS') or 0 for pid in self._children())
+            self.peak_mb = max(self.peak_mb, rss / 1024)
+
+    def stop(self):
+        self._finished.set()
+        self.join()
+        return self.peak_mb
+
+
+def run_benchmark(paths, backend, stack, n_batches, **loader_kwargs):
+    """ Builds the dataloaders of `paths` and times the training batches, meant to run in a new process """
+    children = ChildrenMemory()
+    children.start()
+    start = time.perf_counter()
+    dataloaders = static_loaders(paths, preload_from_merged_data=BACKENDS[backend], **STACKS[stack], **loader_kwargs)
+    setup = time.perf_counter() - start
+
+    batches = iter(LongCycler(dataloaders['train']))
+    next(batches)
+    first_batch = time.perf_counter() - start
+
+    n_samples, start = 0, time.perf_counter()
+    for data_key, batch in islice(batches, n_batches):
+        n_samples += batch[0].shape[0]
+    seconds = time.perf_counter() - start
+    return {
+        'setup_s': setup,
+        'first_batch_s': first_batch,
+        'samples_per_s': n_samples / seconds if seconds > 0 else float('nan'),
+        'peak_rss_mb': peak_rss_mb(),
+        'workers_peak_rss_mb': children.stop(),
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """ The results that are more than `tolerance` (relative) worse than in `baseline` """
+    found = []
+    for name, result in results.items():
+        for key, value in result.items():
+            reference = baseline.get(name, {}).get(key)
+            if not reference or value != value:  # missing, zero or nan
+                continue
+            change = (value - reference) / reference
+            noise = max([n for suffix, n in NOISE.items() if key.endswith(suffix)], default=0.0)
+            if abs(value - reference) > noise and (change if key in LOWER_IS_BETTER else -change) > tolerance:
+                found.append('{} {}: {:.2f} -> {:.2f}'.format(name, key, reference, value))
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image_shape', default='small', choices=list(IMAGE_SHAPES))
+    parser.add_argument('--n_sessions', type=int, default=1)
+    parser.add_argument('--n_trials', type=int, default=1200, help='trials per session')
+    parser.add_argument('--n_neurons', type=int, default=8000)
+    parser.add_argument('--n_test_images', type=int, default=20, help='images of each test tier, shown 10 times')
+    parser.add_argument('--workdir', default=None,
+                        help='folder of the sessions, reused if it has them. Default: a temporary folder, which '
+                             'is removed at the end')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--stacks', nargs='+', default=list(STACKS), choices=list(STACKS))
+    parser.add_argument('-b', '--batch_size', type=int, default=128)
+    parser.add_argument('-n', '--n_batches', type=int, default=50, help='number of batches timed after the first')
+    parser.add_argument('--scale', type=float, default=None,
+                        help='rescaling of the images. Default: 0.25 for full images, which gives the size of the '
+                             'small ones')
+    parser.add_argument('--fetch_batches', action='store_true', help='fetch and transform whole batches at once')
+    parser.add_argument('--num_workers', type=int, default=0, help='number of DataLoader worker processes')
+    parser.add_argument('--in_memory', action='store_true', help='slice batches from tensors of transformed samples')
+    parser.add_argument('--storage_dtypes', action='store_true', help='store the data in low precision')
+    parser.add_argument('-o', '--output', default=None, help='json file to save the results to')
+    parser.add_argument('--baseline', default=None, help='json file of earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='largest accepted relative loss of throughput or growth of time and memory')
+    args = parser.parse_args()
+
+    image_shape = IMAGE_SHAPES[args.image_shape]
+    scale = args.scale if args.scale is not None else (0.25 if args.image_shape == 'full' else None)
+    workdir = Path(args.workdir if args.workdir is not None else tempfile.mkdtemp())
+    paths = []
+    try:
+        for i in range(args.n_sessions):
+            name = 'synthetic_{}x{}_{}trials_{}neurons_{}'.format(*image_shape, args.n_trials, args.n_neurons, i)
+            path = workdir / name
+            if not (path / 'meta' / 'statistics').is_dir():
+                start = time.perf_counter()
+                make_synthetic_session(path, n_trials=args.n_trials, n_neurons=args.n_neurons, image_shape=image_shape,
+                                       n_test_images=args.n_test_images, animal_id=i + 1, seed=i)
+                print('wrote {} in {:.1f}s'.format(path, time.perf_counter() - start), flush=True)
+            paths.append(str(path))
+
+        loader_kwargs = dict(
+            batch_size=args.batch_size,
+            scale=scale,
+            cuda=False,
+            seed=0,
+            fetch_batches=args.fetch_batches,
+            num_workers=args.num_workers,
+            in_memory=args.in_memory,
+            storage_dtypes=args.storage_dtypes or None,
+        )
+        results = {}
+        for backend in args.backends:
+            if args.storage_dtypes and backend in ('files', 'mmap'):
+                # storage dtypes apply to data loaded into memory
+                continue
+            for stack in args.stacks:
+                if backend == 'files' and stack in MERGED_DATA_STACKS:
+                    print('{}/{}: skipped, the stack needs merged_data'.format(backend, stack), flush=True)
+                    continue
+                # a new process for every run, spawned so that it does not inherit the memory of this one
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    result = pool.submit(run_benchmark, paths, backend, stack, args.n_batches, **loader_kwargs).result()
+                name = '{}/{}'.format(backend, stack)
+                results[name] = result
+                print('{}: '.format(name) + ', '.join('{}: {:.2f}'.format(k, v) for k, v in result.items()), flush=True)
+    finally:
+        # only the copies of the synthetic sessions, the other sessions in shared memory are kept for later trainings
+        remove_shared_sessions(basepaths=[Path(path).absolute() for path in paths])
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=4)
+    if args.baseline is not None:
+        with open(args.baseline) as fh:
+            found = regressions(results, json.load(fh), args.tolerance)
+        for regression in found:
+            print('regression: ' + regression)
+        if found:
+            sys.exit(1)
@@ -0,0 +1,109 @@
+""" Micro-benchmark of moving batches to the gpu
+
+Compares, for synthetic samples shaped like the sensorium data, the number of host-to-device transfers and the
+latency per batch of
+    per_sample: every field of every sample is moved on its own (as ToTensor(cuda=True) does) and stacked on the gpu
+    collate:    the batch is stacked in pageable host memory and moved with one blocking copy per field
+    pinned:     the batch is stacked in page-locked memory (pinned_collate) and moved with one non-blocking copy
+                per field (DeviceLoader)
+On the cpu no data is copied, the script then only measures the cost of collating.
+Example:
+    python scripts/benchmark_transfer.py -b 128 -n 50
+"""
+
+import sys, os
+if 'scripts' in os.getcwd():
+    # change to main directory
+    os.chdir('..')
+sys.path.insert(0, '.')
+
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+from neuralpredictors.data.loaders import pinned_collate, to_device
+
+DataPoint = namedtuple('DataPoint', ['images', 'responses', 'behavior', 'pupil_center'])
+
+
+def make_samples(batch_size, image_shape, n_neurons):
+    """ Synthetic samples with the fields and shapes of a batch returned by static_loader """
+    return [
+        DataPoint(
+            images=torch.rand(*image_shape),
+            responses=torch.rand(n_neurons),
+            behavior=torch.rand(3),
+            pupil_center=torch.rand(2),
+        )
+        for _ in range(batch_size)
+    ]
+
+
+def count_transfers(batch, device):
+    """ Number of tensors in the data point that need to be copied to `device` """
+    return sum(v.device != device for v in batch)
+
+
+def per_sample(samples, device):
+    transfers = sum(count_transfers(sample, device) for sample in samples)
+    return default_collate([to_device(sample, device, non_blocking=False) for sample in samples]), transfers
+
+
+def collate(samples, device):
+    batch = default_collate(samples)
+    return to_device(batch, device, non_blocking=False), count_transfers(batch, device)
+
+
+def pinned(samples, device):
+    # page-locked memory needs CUDA, on the cpu the batch is already where it needs to be
+    batch = pinned_collate(samples) if device.type == 'cuda' else default_collate(samples)
+    return to_device(batch, device, non_blocking=True), count_transfers(batch, device)
+
+
+STRATEGIES = {
+    'per_sample': per_sample,
+    'collate': collate,
+    'pinned': pinned,
+}
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def benchmark_strategy(strategy, samples, device, n_batches=50, warmup=5):
+    """ Returns the transfers per batch and the median latency per batch in ms """
+    latencies = []
+    for batch_nr in range(warmup + n_batches):
+        synchronize(device)
+        start = time.perf_counter()
+        batch, transfers = STRATEGIES[strategy](samples, device)
+        # wait for the asynchronous copies, as the first operation on the batch would
+        synchronize(device)
+        if batch_nr >= warmup:
+            latencies.append(time.perf_counter() - start)
+    return {'strategy': strategy, 'transfers_per_batch': transfers, 'ms_per_batch': 1000 * float(np.median(latencies))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--batch_size', type=int, default=128)
+    parser.add_argument('-n', '--n_batches', type=int, default=50)
+    parser.add_argument('-d', '--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--image_shape', type=int, nargs='+', default=[4, 36, 64], help='channels, height, width')
+    parser.add_argument('--n_neurons', type=int, default=8000)
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES), choices=list(STRATEGIES))
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    samples = make_samples(args.batch_size, args.image_shape, args.n_neurons)
+    print('device: {}, batch_size: {}'.format(device, args.batch_size))
+    for strategy in args.strategies:
+        result = benchmark_strategy(strategy, samples, device, n_batches=args.n_batches)
+        print(', '.join('{}: {:.3f}'.format(k, v) if isinstance(v, float) else '{}: {}'.format(k, v)
+                        for k, v in result.items()), flush=True)
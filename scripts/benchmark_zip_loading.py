@@ -0,0 +1,114 @@
+""" Script to compare reading a zipped session directly with extracting it first
+
+Zips the session once without compression (stored) and once with compression (deflated), then measures for every
+mode the time until the first training batch is available, the samples per second of the following batches and the
+disk space used next to the archive:
+    extract:      the archive is extracted next to it and the folder is read (default of FileTreeDataset)
+    zip:          the stored archive is read directly (read_from_zip=True)
+    zip_deflated: the deflated archive is read directly, every file is decompressed when it is read
+The archives and extracted folders are written to a temporary folder (or --workdir), which is removed at the end.
+Example:
+    python scripts/benchmark_zip_loading.py -p notebooks/data/IM_prezipped/<animal>/<session> -n 20
+"""
+
+import sys, os
+if 'scripts' in os.getcwd():
+    # change to main directory
+    os.chdir('..')
+sys.path.insert(0, '.')
+
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+from neuralpredictors.data.utils import zip_dir
+from sensorium.datasets.mouse_loaders import static_loader
+
+MODES = {
+    # name -> (compression of the archive, read_from_zip)
+    'extract': (ZIP_DEFLATED, False),
+    'zip': (ZIP_STORED, True),
+    'zip_deflated': (ZIP_DEFLATED, True),
+}
+
+
+def folder_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+
+def time_to_first_batch(archive, read_from_zip, batch_size=128, n_batches=10, **loader_kwargs):
+    """ Builds the train loader from `archive` and times the first and the following `n_batches` batches """
+    extracted = Path(str(archive)[:-4])
+    shutil.rmtree(extracted, ignore_errors=True)
+
+    start = time.perf_counter()
+    loader = static_loader(str(archive), batch_size, tier='train', cuda=False, read_from_zip=read_from_zip,
+                           **loader_kwargs)['train']
+    setup = time.perf_counter() - start
+    batches = iter(loader)
+    next(batches)
+    first_batch = time.perf_counter() - start
+
+    n_samples, start = 0, time.perf_counter()
+    for batch_nr, batch in enumerate(batches):
+        n_samples += batch[0].shape[0]
+        if batch_nr + 1 >= n_batches:
+            break
+    seconds = time.perf_counter() - start
+
+    result = {
+        'setup_s': setup,
+        'first_batch_s': first_batch,
+        'samples_per_s': n_samples / seconds if seconds > 0 else float('nan'),
+        'extracted_mb': folder_size(extracted) / 1024 ** 2 if extracted.exists() else 0.0,
+    }
+    shutil.rmtree(extracted, ignore_errors=True)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--path', required=True, help='folder of one session (FileTreeDataset)')
+    parser.add_argument('-b', '--batch_size', type=int, default=128)
+    parser.add_argument('-n', '--n_batches', type=int, default=10, help='number of batches timed after the first')
+    parser.add_argument('-r', '--repeats', type=int, default=1)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--workdir', default=None, help='folder for the archives (default: a temporary folder)')
+    parser.add_argument('--scale', type=float, default=0.25)
+    parser.add_argument('--mmap', action='store_true', help='memory-map merged_data (preload_from_merged_data="mmap")')
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(dir=args.workdir))
+    session = Path(args.path).absolute()
+    try:
+        archives = {}
+        for compression in sorted({MODES[mode][0] for mode in args.modes}):
+            # the archive keeps the name of the session folder, which is also the name of the extracted folder
+            archive = workdir / str(compression) / (session.name + '.zip')
+            archive.parent.mkdir()
+            start = time.perf_counter()
+            zip_dir(archive, session, compression=compression)
+            archives[compression] = archive
+            print('zipped with compression {} in {:.2f}s: {:.1f} MB'.format(
+                compression, time.perf_counter() - start, archive.stat().st_size / 1024 ** 2), flush=True)
+
+        for mode in args.modes:
+            compression, read_from_zip = MODES[mode]
+            for repeat in range(args.repeats):
+                result = time_to_first_batch(
+                    archives[compression],
+                    read_from_zip,
+                    batch_size=args.batch_size,
+                    n_batches=args.n_batches,
+                    scale=args.scale,
+                    preload_from_merged_data='mmap' if args.mmap else False,
+                    include_behavior=True,
+                    include_eye_position=True,
+                )
+                print('mode: {}, '.format(mode) + ', '.join('{}: {:.2f}'.format(k, v) for k, v in result.items()),
+                      flush=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,51 @@
+""" Script to build or refresh the folder merged_data of FileTreeDatasets
+
+Stacks the per-trial files of every data_key into merged_data/<data_key>.npy, in parallel and in the dtype of the
+files. Matrices whose per-trial files did not change since the last build are skipped, so after adding a session only
+that session is merged.
+Example:
+    python scripts/build_merged_data.py notebooks/data/IM_prezipped -j 8
+"""
+
+import sys, os
+if 'scripts' in os.getcwd():
+    # change to main directory
+    os.chdir('..')
+sys.path.insert(0, '.')
+
+import argparse
+from pathlib import Path
+
+from neuralpredictors.data.utils import build_merged_data
+
+
+def find_sessions(path, max_depth=2):
+    """ `path` if it is a FileTreeDataset, else the FileTreeDatasets up to `max_depth` levels below it """
+    path = Path(path)
+    if (path / 'data').is_dir():
+        return [path]
+    if max_depth == 0:
+        return []
+    return [session for folder in sorted(path.iterdir()) if folder.is_dir() and folder.name != 'merged_data'
+            for session in find_sessions(folder, max_depth - 1)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+',
+                        help='folders of sessions, or folders with sessions up to two levels below them')
+    parser.add_argument('-k', '--data_keys', nargs='+', default=None, help='default: all folders in data/')
+    parser.add_argument('-j', '--n_workers', type=int, default=None,
+                        help='number of processes (default: number of cpus, 0: no extra processes)')
+    parser.add_argument('--overwrite', action='store_true', help='rebuild all matrices, even if nothing changed')
+    args = parser.parse_args()
+
+    sessions = [session for path in args.paths for session in find_sessions(path)]
+    if not sessions:
+        raise FileNotFoundError('No sessions (folders with a subfolder data) found in {}'.format(args.paths))
+
+    status = build_merged_data(sessions, data_keys=args.data_keys, n_workers=args.n_workers,
+                               overwrite=args.overwrite)
+    for session, keys in status.items():
+        built = [k for k, v in keys.items() if v == 'built']
+        print('{}: built {}, unchanged {}'.format(session, built or 'nothing', len(keys) - len(built)))
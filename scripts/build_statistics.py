@@ -0,0 +1,67 @@
+""" Script to compute the statistics in meta/statistics of FileTreeDatasets
+
+Reads every data_key once in blocks of trials (from merged_data if the matrix exists, e.g. for history and state) and
+writes meta/statistics/<data_key>/<source>/{mean,std,min,max,median}.npy, the files the normalizers read. Existing
+statistics are kept unless --overwrite is given.
+Example:
+    python scripts/build_statistics.py notebooks/data/IM_prezipped -k history state -j 8
+    python scripts/build_statistics.py notebooks/data/IM_prezipped -s all train=train,validation --overwrite
+"""
+
+import sys, os
+if 'scripts' in os.getcwd():
+    # change to main directory
+    os.chdir('..')
+sys.path.insert(0, '.')
+
+import argparse
+from pathlib import Path
+
+from neuralpredictors.data.statistics import MEDIAN_SAMPLE_BYTES, STATISTICS_BLOCK_BYTES, build_statistics
+
+
+def find_sessions(path, max_depth=2):
+    """ `path` if it is a FileTreeDataset, else the FileTreeDatasets up to `max_depth` levels below it """
+    path = Path(path)
+    if (path / 'data').is_dir():
+        return [path]
+    if max_depth == 0:
+        return []
+    return [session for folder in sorted(path.iterdir()) if folder.is_dir() and folder.name != 'merged_data'
+            for session in find_sessions(folder, max_depth - 1)]
+
+
+def parse_source(text):
+    """ 'all' -> all trials, 'name=tier1,tier2' -> the trials of these tiers """
+    name, _, tiers = text.partition('=')
+    return name, tiers.split(',') if tiers else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+',
+                        help='folders of sessions, or folders with sessions up to two levels below them')
+    parser.add_argument('-k', '--data_keys', nargs='+', default=None,
+                        help='default: all folders in data/ and matrices in merged_data/')
+    parser.add_argument('-s', '--sources', nargs='+', default=['all'],
+                        help='sources as name (all trials) or name=tier1,tier2 (trials of these tiers)')
+    parser.add_argument('-j', '--n_workers', type=int, default=None,
+                        help='number of processes (default: number of cpus, 0: no extra processes)')
+    parser.add_argument('--block_mb', type=float, default=STATISTICS_BLOCK_BYTES / 1024 ** 2,
+                        help='approximate size of the blocks of trials read at once')
+    parser.add_argument('--median_mb', type=float, default=MEDIAN_SAMPLE_BYTES / 1024 ** 2,
+                        help='memory for the sample of trials of the median, per source')
+    parser.add_argument('--overwrite', action='store_true', help='recompute statistics that already exist')
+    args = parser.parse_args()
+
+    sessions = [session for path in args.paths for session in find_sessions(path)]
+    if not sessions:
+        raise FileNotFoundError('No sessions (folders with a subfolder data) found in {}'.format(args.paths))
+
+    status = build_statistics(sessions, data_keys=args.data_keys, sources=dict(map(parse_source, args.sources)),
+                              n_workers=args.n_workers, overwrite=args.overwrite,
+                              block_bytes=int(args.block_mb * 1024 ** 2),
+                              median_sample_bytes=int(args.median_mb * 1024 ** 2))
+    for session, keys in status.items():
+        built = [k for k, v in keys.items() if v == 'built']
+        print('{}: built {}, existing {}'.format(session, built or 'nothing', len(keys) - len(built)))
@@ -0,0 +1,145 @@
+""" Script to check the low-precision storage of the data (storage_dtypes of static_loaders) against float storage
+
+Builds the dataloaders once with the data stored in the dtypes of merged_data (float path) and once with
+storage_dtypes (uint8 images, float16 responses, behavior and history by default), both preloaded into RAM, and
+reports for each:
+    memory:     bytes of the stored matrices of all sessions
+    throughput: samples per second of the training batches
+    accuracy:   largest difference of the validation batches to the float path, relative to the std of each field
+With a model config (a yaml file as in saved_models/02_jobs) the validation correlation of the model is compared as
+well, with the weights of --state_dict or of the untrained model. The script exits with an error if the correlation
+changes by more than --tolerance.
+Example:
+    python scripts/check_storage_dtypes.py -c saved_models/model_m4_ens0/config.yaml \
+        -s saved_models/model_m4_ens0/saved_model_v1.pth
+"""
+
+import sys, os
+if 'scripts' in os.getcwd():
+    # change to main directory
+    os.chdir('..')
+sys.path.insert(0, '.')
+
+import argparse
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from neuralpredictors.training import LongCycler
+from sensorium.datasets.mouse_loaders import LOW_PRECISION_STORAGE, static_loaders
+from sensorium.utility.scores import get_correlations
+from sensorium.utility.training import read_config
+
+
+def find_sessions(path, max_depth=2):
+    """ `path` if it is a FileTreeDataset, else the FileTreeDatasets up to `max_depth` levels below it """
+    path = Path(path)
+    if (path / 'data').is_dir():
+        return [path]
+    if max_depth == 0:
+        return []
+    return [session for folder in sorted(path.iterdir()) if folder.is_dir() and folder.name != 'merged_data'
+            for session in find_sessions(folder, max_depth - 1)]
+
+
+def datasets(dataloaders):
+    """ The datasets of the training loaders, one per session """
+    return [getattr(loader, 'loader', loader).dataset for loader in dataloaders['train'].values()]
+
+
+def stored_bytes(dataset):
+    """ Bytes of the data of `dataset` in RAM: the matrices of merged_data and the cached trials of other data_keys """
+    n_bytes = sum(data.nbytes for data in dataset._merged_data.values())
+    for data_key, cache in dataset._cache.items():
+        if data_key not in dataset._merged_data:
+            n_bytes += sum(np.asarray(v).nbytes for v in cache.values())
+    return n_bytes
+
+
+def samples_per_second(dataloaders, n_batches):
+    batches = LongCycler(dataloaders['train'])
+    n_samples, start = 0, time.perf_counter()
+    for data_key, batch in islice(batches, n_batches):
+        n_samples += batch[0].shape[0]
+    return n_samples / (time.perf_counter() - start)
+
+
+def relative_differences(reference, dataloaders):
+    """ Largest absolute difference of every field of the validation batches, divided by the std of the field """
+    differences = {}
+    for data_key, loader in reference['validation'].items():
+        for batch_ref, batch in zip(loader, dataloaders['validation'][data_key]):
+            for field, ref, value in zip(batch_ref._fields, batch_ref, batch):
+                ref, value = ref.double(), value.double()
+                scale = ref.std().item() or 1.0
+                diff = (ref - value).abs().max().item() / scale
+                differences[field] = max(differences.get(field, 0.0), diff)
+    return differences
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--paths', nargs='+', default=['notebooks/data/IM_prezipped'],
+                        help='folders of sessions, or folders with sessions up to two levels below them')
+    parser.add_argument('-c', '--config', default=None,
+                        help='config of a model (dataset_config, model_fn, model_config and model_seed)')
+    parser.add_argument('-s', '--state_dict', default=None, help='weights of the model')
+    parser.add_argument('--storage_dtypes', type=json.loads, default=LOW_PRECISION_STORAGE,
+                        help='data_key -> dtype as json, default: {}'.format(json.dumps(LOW_PRECISION_STORAGE)))
+    parser.add_argument('-n', '--n_batches', type=int, default=100, help='number of batches for the throughput')
+    parser.add_argument('--tolerance', type=float, default=1e-3,
+                        help='largest accepted change of the mean validation correlation')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    paths = [str(session) for path in args.paths for session in find_sessions(path)]
+    config = read_config(args.config) if args.config is not None else {}
+    dataset_config = dict(config.get('dataset_config', dict(
+        batch_size=128, normalize=True, include_behavior=True, include_eye_position=True, scale=0.25,
+    )))
+    dataset_config.update(preload_from_merged_data=True, cuda=args.device == 'cuda', seed=0)
+
+    results, loaders = {}, {}
+    for name, storage_dtypes in [('float', None), ('low precision', args.storage_dtypes)]:
+        start = time.perf_counter()
+        loaders[name] = static_loaders(paths, storage_dtypes=storage_dtypes, **dataset_config)
+        results[name] = {
+            'setup_s': time.perf_counter() - start,
+            'memory_mb': sum(map(stored_bytes, datasets(loaders[name]))) / 1024 ** 2,
+            'samples_per_s': samples_per_second(loaders[name], args.n_batches),
+        }
+
+    differences = relative_differences(loaders['float'], loaders['low precision'])
+    print('largest difference to the float path relative to the std: ' +
+          ', '.join('{}: {:.2e}'.format(k, v) for k, v in differences.items()))
+
+    correlation_change = None
+    if args.config is not None:
+        from nnfabrik.builder import get_model
+
+        for name in loaders:
+            model = get_model(model_fn=config['model_fn'], model_config=config['model_config'],
+                              dataloaders=loaders['float'], seed=config['model_seed'])
+            if args.state_dict is not None:
+                model.load_state_dict(torch.load(args.state_dict, map_location='cpu'))
+            model.to(args.device).eval()
+            results[name]['validation_correlation'] = np.mean(get_correlations(
+                model, loaders[name]['validation'], device=args.device, as_dict=False, per_neuron=False))
+        correlation_change = abs(results['low precision']['validation_correlation']
+                                 - results['float']['validation_correlation'])
+
+    for name, result in results.items():
+        print('{}: '.format(name) + ', '.join('{}: {:.4f}'.format(k, v) for k, v in result.items()), flush=True)
+    print('memory: {:.1f}x less, throughput: {:.2f}x'.format(
+        results['float']['memory_mb'] / results['low precision']['memory_mb'],
+        results['low precision']['samples_per_s'] / results['float']['samples_per_s']))
+
+    if correlation_change is not None:
+        print('change of the validation correlation: {:.2e} (tolerance {:.0e})'.format(correlation_change,
+                                                                                        args.tolerance))
+        if correlation_change > args.tolerance:
+            sys.exit(1)
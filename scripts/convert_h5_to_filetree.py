@@ -0,0 +1,56 @@
+""" Script to convert hdf5 sessions into the folder structure of the FileTreeDataset
+
+Reads the trials in blocks of whole hdf5 chunks, writes them with a pool of writer threads and prints the throughput
+per data_key. Running the script again resumes an interrupted conversion.
+Example:
+    python scripts/convert_h5_to_filetree.py static22564-2-13-preproc0.h5 --layout both -j 8
+"""
+
+import sys, os
+if 'scripts' in os.getcwd():
+    # change to main directory
+    os.chdir('..')
+sys.path.insert(0, '.')
+
+import argparse
+
+from neuralpredictors.data.utils import (
+    CONVERSION_BLOCK_BYTES,
+    convert_movies_h5_dataset_to_folder,
+    convert_static_h5_dataset_to_folder,
+)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filenames', nargs='+', help='hdf5 files, each is converted to a folder next to it')
+    parser.add_argument('-o', '--outpath', default=None, help='output folder (only with a single file)')
+    parser.add_argument('--layout', default='legacy', choices=['legacy', 'consolidated', 'both'],
+                        help='files per trial in data/, matrices in merged_data/ or both (static data only)')
+    parser.add_argument('-j', '--n_workers', type=int, default=4, help='number of writer threads')
+    parser.add_argument('--block_mb', type=float, default=CONVERSION_BLOCK_BYTES / 1024 ** 2,
+                        help='approximate size of the blocks read at once (static data only)')
+    parser.add_argument('--movies', action='store_true', help='the files contain movie data')
+    parser.add_argument('--ignore_all_behaviors', action='store_true', help='only convert images and responses')
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+
+    if args.outpath is not None and len(args.filenames) > 1:
+        raise ValueError('--outpath can only be used with a single file')
+    if args.movies and args.layout != 'legacy':
+        raise ValueError('Movie trials have different lengths and can only be converted with --layout legacy')
+
+    for filename in args.filenames:
+        if args.movies:
+            outpath = args.outpath or os.path.splitext(filename)[0]
+            report = convert_movies_h5_dataset_to_folder(filename, outpath=outpath, overwrite=args.overwrite,
+                                                         n_workers=args.n_workers)
+        else:
+            report = convert_static_h5_dataset_to_folder(filename, outpath=args.outpath, overwrite=args.overwrite,
+                                                         ignore_all_behaviors=args.ignore_all_behaviors,
+                                                         layout=args.layout, n_workers=args.n_workers,
+                                                         block_bytes=int(args.block_mb * 1024 ** 2))
+        print(filename)
+        for data_key, result in report.items():
+            print('    {}: '.format(data_key) + ', '.join(
+                '{}: {:.2f}'.format(k, v) if isinstance(v, float) else '{}: {}'.format(k, v) for k, v in result.items()
+            ), flush=True)
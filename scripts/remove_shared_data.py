@@ -0,0 +1,25 @@
+""" Script to free the shared memory used by sessions loaded with preload_from_merged_data="shared"
+
+Removes the copies of the sessions in shared memory that no running process uses. Sessions that are in use are
+skipped.
+Example:
+    python scripts/remove_shared_data.py
+"""
+
+import sys, os
+if 'scripts' in os.getcwd():
+    # change to main directory
+    os.chdir('..')
+sys.path.insert(0, '.')
+
+import argparse
+
+from neuralpredictors.data.datasets.shared import SHARED_MEMORY_ROOT, remove_shared_sessions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default=SHARED_MEMORY_ROOT, help='folder of the sessions in shared memory')
+    args = parser.parse_args()
+
+    removed = remove_shared_sessions(args.root)
+    print('removed {} session(s){}'.format(len(removed), ''.join('\n    {}'.format(r) for r in removed)))
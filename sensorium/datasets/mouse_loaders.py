@@ -1,9 +1,12 @@
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from itertools import zip_longest
 import numpy as np
 import os
+import time
+from pathlib import Path
 from torch.utils.data import DataLoader
-from torch.utils.data.sampler import SubsetRandomSampler
+from torch.utils.data.sampler import BatchSampler, SubsetRandomSampler
 from nnfabrik.utility.nn_helpers import set_random_seed
 from neuralpredictors.data.datasets import StaticImageSet, FileTreeDataset
 
@@ -17,10 +20,59 @@ from neuralpredictors.data.transforms import (
     AddBehaviorAsChannels,
     SelectInputChannel,
     ScaleInputs,
+    RescaleCache,
     AddPupilCenterAsChannels,
 )
 
-from neuralpredictors.data.samplers import SubsetSequentialSampler
+from neuralpredictors.data.loaders import DeviceLoader, InMemoryLoader, pinned_collate
+from neuralpredictors.data.samplers import BlockShuffleSampler, SubsetSequentialSampler
+from neuralpredictors.data.utils import first_positions
+
+
+# storage dtypes of storage_dtypes=True: the stimuli are 8-bit images, responses and regressors tolerate float16
+LOW_PRECISION_STORAGE = {"images": "uint8", "responses": "float16", "behavior": "float16", "history": "float16"}
+
+
+def seed_worker(worker_id):
+    """
+    Seeds numpy and random in DataLoader worker processes to ensure reproducibility. Defined at module level, so it
+    can be pickled for workers that are not forked.
+    """
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+
+def selection_random_state(seed=None):
+    """
+    Returns the RandomState that neurons and images are randomly selected with: seeded with `seed`, or a copy of the
+    global numpy random state if seed is None. The draws equal those from the seeded global state, but the global
+    state is never changed, so sessions can be built concurrently.
+    """
+    random_state = np.random.RandomState()
+    if seed is None:
+        random_state.set_state(np.random.get_state())
+    else:
+        random_state.seed(seed)
+    return random_state
+
+
+class StageTimer:
+    """
+    Adds the seconds since the previous call (or since construction) to timings[stage] when called with a stage.
+    Does nothing if timings is None.
+    """
+
+    def __init__(self, timings=None):
+        self.timings = timings
+        self.last = time.perf_counter()
+
+    def __call__(self, stage):
+        now = time.perf_counter()
+        if self.timings is not None:
+            self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last
+        self.last = now
+
 
 def static_loader(
     path: str = None,
@@ -37,9 +89,9 @@ def static_loader(
     image_base_seed=None,
     get_key: bool = False,
     cuda: bool = True,
-    normalize: bool = True,
+    normalize=True,
     # exclude: str = None,
-    exclude: list = [],
+    exclude: list = None,
     include_behavior: bool = False,
     add_behavior_as_channels: bool = True,
     select_input_channel: int = None,
@@ -62,6 +114,19 @@ def static_loader(
     adjusted_normalization=False,
     use_ensemble_tier=False,
     ensemble_nr=0,
+    fetch_batches=False,
+    num_workers=0,
+    persistent_workers=False,
+    prefetch_factor=2,
+    in_memory=False,
+    rescale_cache=None,
+    rescale_cache_in_memory=False,
+    lazy_constant_channels=False,
+    chunk_cache_bytes=None,
+    block_shuffle=None,
+    read_from_zip=False,
+    storage_dtypes=None,
+    timings=None,
 ):
     """
     returns a single data loader
@@ -80,16 +145,66 @@ def static_loader(
         image_base_seed (float, optional): base seed for image selection. Get's multiplied by image_n to obtain final seed
         get_key (bool, optional): whether to return the data key, along with the dataloaders.
         cuda (bool, optional): whether to place the data on gpu or not.
-        normalize (bool, optional): whether to normalize the data (see also exclude)
-        exclude (str, optional): data to exclude from data-normalization. Only relevant if normalize=True. Defaults to 'images'
+        normalize (bool or str, optional): whether to normalize the data (see also exclude). With "model", the
+                                          loader returns the data without normalization and the model normalizes
+                                          the batches on its device, with the module of
+                                          NeuroNormalizer.to_module that the model builders take from
+                                          `dataset.deferred_normalizer` and store with the weights of the model
+        exclude (list, optional): data to exclude from data-normalization. Only relevant if normalize=True. Defaults to none
         include_behavior (bool, optional): whether to include behavioral data
         select_input_channel (int, optional): Only for color images. Select a color channel
         file_tree (bool, optional): whether to use the file tree dataset format. If False, equivalent to the HDF5 format
         image_condition (str, or list of str, optional): selection of images based on the image condition
-        preload_from_merged_data (bool, optional): Parameter to use data from .npy matrix with all trials instead of
-                                                   indiviual files to speed up first run through the data
+        preload_from_merged_data (bool or str, optional): Parameter to use data from .npy matrix with all trials instead of
+                                                   indiviual files to speed up first run through the data.
+                                                   If True, the matrices are copied into the dataset cache. If "mmap",
+                                                   the matrices are memory-mapped and trials are read on access.
+                                                   If "shared", the matrices are copied once into shared memory
+                                                   (/dev/shm) and memory-mapped from there by all processes on the
+                                                   node, e.g. the members of an ensemble trained at the same time
+                                                   (see FileTreeDataset.share_merged_data).
         include_trial_id (bool, optional): Include trial_id in batch along with other data to reconstruct later
                                            the order of the predictions from different split parts
+        fetch_batches (bool, optional): Load each batch with one call to the dataset and apply the transforms to the
+                                        stacked batch instead of to every sample (see FileTreeDataset.get_batch
+                                        and StaticImageSet.get_batch)
+        num_workers (int, optional): number of worker processes of the DataLoader that load and transform the data.
+        persistent_workers (bool, optional): keep the worker processes alive between epochs. Only used if
+                                             num_workers > 0.
+        prefetch_factor (int, optional): number of batches loaded in advance by each worker. Only used if
+                                         num_workers > 0.
+        in_memory (bool, optional): transform all samples of a tier once and keep them as tensors on the gpu (or
+                                    the cpu if cuda=False), from which the batches are sliced
+                                    (see neuralpredictors.data.loaders.InMemoryLoader). Replaces the DataLoader, so
+                                    fetch_batches and the worker arguments are not used.
+        rescale_cache (bool or str, optional): store the images rescaled with `scale` on disk and read them from
+                                               there when they are needed again (see
+                                               neuralpredictors.data.transforms.RescaleCache). If True, the cache
+                                               is the folder cache/rescaled_images of the dataset, if a str, the
+                                               folder with that path.
+        rescale_cache_in_memory (bool, optional): additionally keep the rescaled images in memory
+        lazy_constant_channels (bool, optional): instead of expanding behavior and pupil center into image channels,
+                                                 pass them as one value per sample and channel in the field
+                                                 channel_constants. The first layer of the core broadcasts them
+                                                 (see Stacked2dCore's constant_input_channels).
+        chunk_cache_bytes (int, optional): size of the HDF5 chunk cache per dataset in bytes. Only used if
+                                           file_tree=False, defaults to the HDF5 default of 1 MB.
+        block_shuffle (int, optional): shuffle the training set in blocks of this many neighbouring trials, and
+                                       within the blocks, instead of trial by trial. Improves readahead and page
+                                       cache use of memory-mapped and HDF5 data (see
+                                       neuralpredictors.data.samplers.BlockShuffleSampler).
+        read_from_zip (bool, optional): if the path is a zip file of a file tree dataset, read the data directly
+                                        from the archive instead of extracting it first. Fastest for archives
+                                        written without compression (see FileTreeDataset.zip).
+        storage_dtypes (bool or dict, optional): keep the data of these data_keys in a smaller dtype in the cache and
+                                                 in merged_data loaded into RAM or shared memory, and cast it to
+                                                 float32 when batches are loaded (see
+                                                 FileTreeDataset.set_storage_dtypes). If True, LOW_PRECISION_STORAGE
+                                                 (uint8 images, float16 responses, behavior and history). Check the
+                                                 effect on a model with scripts/check_storage_dtypes.py.
+        timings (dict, optional): if given, the seconds spent in each stage of building the loaders are added to it:
+                                  dataset, neurons, preload, transforms, tiers (image selection and samplers) and
+                                  loaders
                                                 
     Returns:
         if get_key is False returns a dictionary of dataloaders for one dataset, where the keys are 'train', 'validation', and 'test'.
@@ -123,6 +238,10 @@ def static_loader(
             "either 'image_condition' or 'image_ids' can be passed. They can not both be true."
         )
 
+    stage_done = StageTimer(timings)
+    # appended to below, so the caller's list (and the lists of other sessions) are not changed
+    exclude = list(exclude) if exclude is not None else []
+
     data_keys = [
         "images",
         "responses",
@@ -147,11 +266,18 @@ def static_loader(
         exclude.append('state')  # exclude it from normalization
 
     if file_tree:
-        dat = FileTreeDataset(path, *data_keys)
-        if preload_from_merged_data:
-            dat.load_data_to_cache()
+        dat = FileTreeDataset(path, *data_keys, unzip=not read_from_zip)
+        stage_done("dataset")
+        if storage_dtypes:
+            if preload_from_merged_data == "mmap":
+                raise ValueError("storage_dtypes cannot convert memory-mapped merged_data, use "
+                                 "preload_from_merged_data=True or 'shared'")
+            dat.set_storage_dtypes(LOW_PRECISION_STORAGE if storage_dtypes is True else storage_dtypes)
     else:
-        dat = StaticImageSet(path, *data_keys)
+        if storage_dtypes:
+            raise ValueError("storage_dtypes is only available for file tree datasets")
+        dat = StaticImageSet(path, *data_keys, chunk_cache_bytes=chunk_cache_bytes)
+        stage_done("dataset")
 
     assert (
         include_behavior and select_input_channel
@@ -166,58 +292,106 @@ def static_loader(
         conds &= np.isin(dat.neurons.layer, layers)
     idx = np.where(conds)[0]
     if neuron_n is not None:
-        random_state = np.random.get_state()
-        if neuron_base_seed is not None:
-            np.random.seed(
-                neuron_base_seed * neuron_n
-            )  # avoid nesting by making seed dependent on number of neurons
+        # avoid nesting by making seed dependent on number of neurons
+        random_state = selection_random_state(None if neuron_base_seed is None else neuron_base_seed * neuron_n)
         assert (
             len(dat.neurons.unit_ids) >= exclude_neuron_n + neuron_n
         ), "After excluding {} neurons, there are not {} neurons left".format(
             exclude_neuron_n, neuron_n
         )
-        neuron_ids = np.random.choice(
+        neuron_ids = random_state.choice(
             dat.neurons.unit_ids, size=exclude_neuron_n + neuron_n, replace=False
         )[exclude_neuron_n:]
-        np.random.set_state(random_state)
     if neuron_ids is not None:
-        idx = [
-            np.where(dat.neurons.unit_ids == unit_id)[0][0] for unit_id in neuron_ids
-        ]
+        idx = first_positions(dat.neurons.unit_ids, neuron_ids)
+    stage_done("neurons")
 
-    more_transforms = [Subsample(idx), ToTensor(cuda)]
+    # file tree datasets keep only the selected neurons in the stored responses. Otherwise, the NeuroNormalizer
+    # subsamples the responses while it normalizes them, or a Subsample transform does without normalization
+    normalize_in_model = normalize == "model"
+    subsample_idx = idx
+    if file_tree:
+        if not np.array_equal(idx, np.arange(len(dat.neurons.unit_ids))):
+            # before preloading, so that only the responses of the selected neurons are read into RAM
+            dat.select_neurons(idx)
+        subsample_idx = None
+        if preload_from_merged_data == "mmap":
+            dat.memory_map_merged_data()
+        elif preload_from_merged_data == "shared":
+            dat.share_merged_data()
+        elif preload_from_merged_data:
+            dat.load_data_to_cache()
+        stage_done("preload")
+
+    # the batches are moved to the gpu as a whole by a DeviceLoader, not sample by sample
+    if subsample_idx is None or (normalize and not normalize_in_model):
+        more_transforms = [ToTensor(cuda=False)]
+    else:
+        more_transforms = [Subsample(subsample_idx), ToTensor(cuda=False)]
 
     if include_px_position is True:
         more_transforms.insert(0, AddPositionAsChannels())
 
+    rescale_transform = None
     if scale is not None:
-        more_transforms.insert(0, ScaleInputs(scale=scale))
+        cache = None
+        if rescale_cache or rescale_cache_in_memory:
+            if not file_tree:
+                raise ValueError("The rescale cache needs the item indices passed on by FileTreeDataset")
+            if rescale_cache is True:
+                # archives are read-only, so the cache of an archive is kept next to it
+                cache_root = dat.basepath if dat.archive is None else Path(dat.archive.filename[:-4] + "_cache")
+                rescale_cache = cache_root / "cache" / "rescaled_images"
+            cache = RescaleCache(rescale_cache or None, in_memory=rescale_cache_in_memory)
+        rescale_transform = ScaleInputs(scale=scale, cache=cache)
+        more_transforms.insert(0, rescale_transform)
 
     if select_input_channel is not None:
+        if lazy_constant_channels:
+            raise ValueError("select_input_channel cannot select channels that are not part of the images, "
+                             "set lazy_constant_channels=False")
         more_transforms.insert(0, SelectInputChannel(select_input_channel))
 
     if add_eye_pos_as_channels:
-        more_transforms.insert(0, AddPupilCenterAsChannels())
+        more_transforms.insert(0, AddPupilCenterAsChannels(lazy=lazy_constant_channels))
 
     if include_behavior and add_behavior_as_channels:
-        more_transforms.insert(0, AddBehaviorAsChannels())
+        more_transforms.insert(0, AddBehaviorAsChannels(lazy=lazy_constant_channels))
 
     if image_reshape_list is not None:
         more_transforms.insert(0, ReshapeImages(image_reshape_list))
 
     if normalize:
         try:
-            more_transforms.insert(
-                0,
-                NeuroNormalizer(
-                    dat, exclude=exclude, inputs_mean=inputs_mean, inputs_std=inputs_std,
-                    adjusted_normalization=adjusted_normalization,
-                ),
+            normalizer = NeuroNormalizer(
+                dat, exclude=exclude, inputs_mean=inputs_mean, inputs_std=inputs_std,
+                adjusted_normalization=adjusted_normalization, subsample_idx=subsample_idx,
             )
         except:
-            more_transforms.insert(0, NeuroNormalizer(dat, exclude=exclude))
+            normalizer = NeuroNormalizer(dat, exclude=exclude, subsample_idx=subsample_idx)
+        if normalize_in_model:
+            # the channels appended to the images (or passed as channel_constants) are normalized like their sources
+            appended = []
+            if include_behavior and add_behavior_as_channels:
+                appended.append(("behavior", len(np.atleast_1d(normalizer.affine["behavior"][0]))))
+            if add_eye_pos_as_channels:
+                appended.append(("pupil_center", len(np.atleast_1d(normalizer.affine["pupil_center"][0]))))
+            if appended and select_input_channel is not None:
+                raise ValueError("normalize='model' cannot normalize channels chosen by select_input_channel")
+            if lazy_constant_channels:
+                channels = {"channel_constants": appended}
+            else:
+                channels = {normalizer._in_name: [(normalizer._in_name, None)] + appended}
+            # the model builders add the module to the model (see sensorium.models.utility.prepare_normalizer)
+            dat.deferred_normalizer = normalizer.to_module(channels=channels, subsample=False)
+        else:
+            more_transforms.insert(0, normalizer)
 
     dat.transforms.extend(more_transforms)
+    if rescale_transform is not None and rescale_transform.cache is not None:
+        # the cached images depend on the data and all transforms applied before rescaling
+        rescale_transform.cache.set_source(dat, dat.transforms[: dat.transforms.index(rescale_transform)])
+    stage_done("transforms")
 
     # create the data_key for a specific data path
     if "preproc" in path:
@@ -279,22 +453,16 @@ def static_loader(
     for tier in keys:
         # sample images
         if tier == "train" and image_ids is not None and image_condition is None:
-            subset_idx = [
-                np.where(image_id_array == image_id)[0][0] for image_id in image_ids
-            ]
+            subset_idx = first_positions(image_id_array, image_ids)
             assert (
                 sum(tier_array[subset_idx] != "train") == 0
             ), "image_ids contain validation or test images"
         elif tier == "train" and image_n is not None and image_condition is None:
-            random_state = np.random.get_state()
-            if image_base_seed is not None:
-                np.random.seed(
-                    image_base_seed * image_n
-                )  # avoid nesting by making seed dependent on number of images
-            subset_idx = np.random.choice(
+            # avoid nesting by making seed dependent on number of images
+            random_state = selection_random_state(None if image_base_seed is None else image_base_seed * image_n)
+            subset_idx = random_state.choice(
                 np.where(tier_array == "train")[0], size=image_n, replace=False
             )
-            np.random.set_state(random_state)
         elif image_condition is not None and image_ids is None:
             subset_idx = np.where(
                 np.logical_and(image_condition_filter, tier_array == tier)
@@ -305,23 +473,42 @@ def static_loader(
         else:
             subset_idx = np.where(tier_array == tier)[0]
 
-        sampler = (
-            SubsetRandomSampler(subset_idx)
-            if tier == "train"
-            else SubsetSequentialSampler(subset_idx)
-        )
+        if tier != "train":
+            sampler = SubsetSequentialSampler(subset_idx)
+        elif block_shuffle:
+            sampler = BlockShuffleSampler(subset_idx, block_size=block_shuffle)
+        else:
+            sampler = SubsetRandomSampler(subset_idx)
+        stage_done("tiers")
         
-        # ensure reproducibility in DataLoader
-        def seed_worker(worker_id):
-            worker_seed = torch.initial_seed() % 2**32
-            np.random.seed(worker_seed)
-            random.seed(worker_seed)
-
         g = torch.Generator()
         g.manual_seed(8654)
 
-        dataloaders[tier] = DataLoader(dat, sampler=sampler, batch_size=batch_size,
-                                      worker_init_fn=seed_worker, generator=g)
+        loader_kwargs = dict(worker_init_fn=seed_worker, generator=g)
+        if num_workers > 0:
+            # DataLoader rejects these arguments without worker processes
+            loader_kwargs.update(
+                num_workers=num_workers, persistent_workers=persistent_workers, prefetch_factor=prefetch_factor
+            )
+        if cuda:
+            # batches are built in page-locked memory to copy them to the gpu asynchronously. pinned_collate stacks
+            # the samples directly into pinned buffers, but can only run in the main process
+            if num_workers == 0 and not fetch_batches:
+                loader_kwargs.update(collate_fn=pinned_collate)
+            else:
+                loader_kwargs.update(pin_memory=True)
+
+        if in_memory:
+            dataloaders[tier] = InMemoryLoader(dat, sampler, batch_size, device="cuda" if cuda else "cpu")
+        elif fetch_batches:
+            # the dataset is indexed with the list of indices of a batch and returns the transformed batch
+            dataloaders[tier] = DataLoader(dat, sampler=BatchSampler(sampler, batch_size, drop_last=False),
+                                           batch_size=None, **loader_kwargs)
+        else:
+            dataloaders[tier] = DataLoader(dat, sampler=sampler, batch_size=batch_size, **loader_kwargs)
+        if cuda and not in_memory:
+            dataloaders[tier] = DeviceLoader(dataloaders[tier], device="cuda")
+        stage_done("loaders")
 
     return (data_key, dataloaders) if get_key else dataloaders
 
@@ -341,11 +528,11 @@ def static_loaders(
     image_n=None,
     image_base_seed=None,
     cuda: bool = True,
-    normalize: bool = True,
+    normalize=True,
     include_behavior: bool = False,
     add_behavior_as_channels: bool = True,
     # exclude: str = None,
-    exclude: list = [],
+    exclude: list = None,
     select_input_channel: int = None,
     file_tree: bool = True,
     image_condition=None,
@@ -367,6 +554,20 @@ def static_loaders(
     adjusted_normalization=False,
     use_ensemble_tier=False,
     ensemble_nr=0,
+    fetch_batches=False,
+    num_workers=0,
+    persistent_workers=False,
+    prefetch_factor=2,
+    in_memory=False,
+    rescale_cache=None,
+    rescale_cache_in_memory=False,
+    lazy_constant_channels=False,
+    chunk_cache_bytes=None,
+    block_shuffle=None,
+    read_from_zip=False,
+    storage_dtypes=None,
+    session_workers=1,
+    timings=None,
 ):
     """
     Returns a dictionary of dataloaders (i.e., trainloaders, valloaders, and testloaders) for >= 1 dataset(s).
@@ -387,8 +588,12 @@ def static_loaders(
         image_n (int, optional): number of images to select randomly. Can not be set together with image_ids
         image_base_seed (float, optional): base seed for image selection. Get's multiplied by image_n to obtain final seed
         cuda (bool, optional): whether to place the data on gpu or not.
-        normalize (bool, optional): whether to normalize the data (see also exclude)
-        exclude (str, optional): data to exclude from data-normalization. Only relevant if normalize=True. Defaults to 'images'
+        normalize (bool or str, optional): whether to normalize the data (see also exclude). With "model", the
+                                          loader returns the data without normalization and the model normalizes
+                                          the batches on its device, with the module of
+                                          NeuroNormalizer.to_module that the model builders take from
+                                          `dataset.deferred_normalizer` and store with the weights of the model
+        exclude (list, optional): data to exclude from data-normalization. Only relevant if normalize=True. Defaults to none
         include_behavior (bool, optional): whether to include behavioral data
         select_input_channel (int, optional): Only for color images. Select a color channel
         file_tree (bool, optional): whether to use the file tree dataset format. If False, equivalent to the HDF5 format
@@ -396,10 +601,57 @@ def static_loaders(
             scale = 1: full iamge resolution (144 x 256)
             scale = 0.25: resolution used for model training (36 x 64)
         add_trial_idx_to_batch (bool, optional): return the trial index of the samples with the batch data
-        preload_from_merged_data (bool, optional): Parameter to use data from .npy matrix with all trials instead of
-                                                   indiviual files to speed up first run through the data
+        preload_from_merged_data (bool or str, optional): Parameter to use data from .npy matrix with all trials instead of
+                                                   indiviual files to speed up first run through the data.
+                                                   If True, the matrices are copied into the dataset cache. If "mmap",
+                                                   the matrices are memory-mapped and trials are read on access.
+                                                   If "shared", the matrices are copied once into shared memory
+                                                   (/dev/shm) and memory-mapped from there by all processes on the
+                                                   node, e.g. the members of an ensemble trained at the same time
+                                                   (see FileTreeDataset.share_merged_data).
         include_trial_id (bool, optional): Include trial_id in batch along with other data to reconstruct later
                                            the order of the predictions from different split parts
+        fetch_batches (bool, optional): Load each batch with one call to the dataset and apply the transforms to the
+                                        stacked batch instead of to every sample (see FileTreeDataset.get_batch
+                                        and StaticImageSet.get_batch)
+        num_workers (int, optional): number of worker processes of the DataLoader that load and transform the data.
+        persistent_workers (bool, optional): keep the worker processes alive between epochs. Only used if
+                                             num_workers > 0.
+        prefetch_factor (int, optional): number of batches loaded in advance by each worker. Only used if
+                                         num_workers > 0.
+        in_memory (bool, optional): transform all samples of a tier once and keep them as tensors on the gpu (or
+                                    the cpu if cuda=False), from which the batches are sliced
+                                    (see neuralpredictors.data.loaders.InMemoryLoader). Replaces the DataLoader, so
+                                    fetch_batches and the worker arguments are not used.
+        rescale_cache (bool or str, optional): store the images rescaled with `scale` on disk and read them from
+                                               there when they are needed again (see
+                                               neuralpredictors.data.transforms.RescaleCache). If True, the cache
+                                               is the folder cache/rescaled_images of the dataset, if a str, the
+                                               folder with that path.
+        rescale_cache_in_memory (bool, optional): additionally keep the rescaled images in memory
+        lazy_constant_channels (bool, optional): instead of expanding behavior and pupil center into image channels,
+                                                 pass them as one value per sample and channel in the field
+                                                 channel_constants. The first layer of the core broadcasts them
+                                                 (see Stacked2dCore's constant_input_channels).
+        chunk_cache_bytes (int, optional): size of the HDF5 chunk cache per dataset in bytes. Only used if
+                                           file_tree=False, defaults to the HDF5 default of 1 MB.
+        block_shuffle (int, optional): shuffle the training set in blocks of this many neighbouring trials, and
+                                       within the blocks, instead of trial by trial. Improves readahead and page
+                                       cache use of memory-mapped and HDF5 data (see
+                                       neuralpredictors.data.samplers.BlockShuffleSampler).
+        read_from_zip (bool, optional): if the path is a zip file of a file tree dataset, read the data directly
+                                        from the archive instead of extracting it first. Fastest for archives
+                                        written without compression (see FileTreeDataset.zip).
+        storage_dtypes (bool or dict, optional): keep the data of these data_keys in a smaller dtype in the cache and
+                                                 in merged_data loaded into RAM or shared memory, and cast it to
+                                                 float32 when batches are loaded (see
+                                                 FileTreeDataset.set_storage_dtypes). If True, LOW_PRECISION_STORAGE
+                                                 (uint8 images, float16 responses, behavior and history). Check the
+                                                 effect on a model with scripts/check_storage_dtypes.py.
+        session_workers (int, optional): number of datasets that are built concurrently, in threads. The dataloaders
+                                         are the same as when the datasets are built one after the other.
+        timings (dict, optional): if given, filled with the seconds spent in each stage of building the loaders of
+                                  every data_key (see static_loader), plus their total
                                            
     Returns:
         dict: dictionary of dictionaries where the first level keys are 'train', 'validation', and 'test', and second level keys are data_keys.
@@ -417,12 +669,13 @@ def static_loaders(
     )
 
     basepath = "/data/mouse/toliaslab/static/"
-    for path, neuron_id, image_id, trial_idx_selection in zip_longest(
-        paths, neuron_ids, image_ids, trial_idx_selection, fillvalue=None
-    ):
+
+    def build(path, neuron_id, image_id, trial_idx_selection):
         if (overwrite_data_path) and (os.path.exists(basepath)):
             path = os.path.join(basepath, path)
 
+        session_timings = {} if timings is not None else None
+        start = time.perf_counter()
         out = static_loader(
             path,
             batch_size,
@@ -462,8 +715,36 @@ def static_loaders(
             adjusted_normalization=adjusted_normalization,
             use_ensemble_tier=use_ensemble_tier,
             ensemble_nr=ensemble_nr,
+            fetch_batches=fetch_batches,
+            num_workers=num_workers,
+            persistent_workers=persistent_workers,
+            prefetch_factor=prefetch_factor,
+            in_memory=in_memory,
+            rescale_cache=rescale_cache,
+            rescale_cache_in_memory=rescale_cache_in_memory,
+            lazy_constant_channels=lazy_constant_channels,
+            chunk_cache_bytes=chunk_cache_bytes,
+            block_shuffle=block_shuffle,
+            read_from_zip=read_from_zip,
+            storage_dtypes=storage_dtypes,
+            timings=session_timings,
         )
+        if session_timings is not None:
+            session_timings["total"] = time.perf_counter() - start
+        return out, session_timings
+
+    sessions = list(zip_longest(paths, neuron_ids, image_ids, trial_idx_selection, fillvalue=None))
+    if session_workers > 1 and len(sessions) > 1:
+        with ThreadPoolExecutor(max_workers=session_workers) as pool:
+            # map returns the results in the order of the paths, so the dictionaries are ordered as if built serially
+            results = list(pool.map(lambda session: build(*session), sessions))
+    else:
+        results = [build(*session) for session in sessions]
+
+    for out, session_timings in results:
         for k in dls:
             dls[k][out[0]] = out[1][k]
+        if timings is not None:
+            timings[out[0]] = session_timings
 
     return dls
@@ -0,0 +1,190 @@
+"""
+Synthetic sessions in the layout of the FileTreeDatasets of the Sensorium data, to measure and test the data pipeline
+without the real sessions
+"""
+
+import datetime
+from pathlib import Path
+
+import numpy as np
+
+from neuralpredictors.data.statistics import build_statistics
+from neuralpredictors.data.utils import build_merged_data
+
+# image sizes of the sessions: as recorded, and downsampled to the size the models see
+IMAGE_SHAPES = {
+    "full": (144, 256),
+    "small": (36, 64),
+}
+
+# lags of the history regressor, see notebooks/submission_m4/01_create_additional_variables.py
+HISTORY_LAGS = (1, 2, 5, 10, 30)
+
+
+def _causal_history(responses, available, lags):
+    """
+    History regressor of 01_create_additional_variables: for every trial (in time order) and lag, the mean of the
+    responses of the last `lag` earlier trials that are `available` (train and validation), zero padded at the start
+    """
+    positions = np.where(available)[0]
+    cumsum = np.zeros((len(positions) + 1, responses.shape[1]))
+    np.cumsum(responses[positions], axis=0, out=cumsum[1:])
+    n_before = np.searchsorted(positions, np.arange(len(responses)))
+    history = np.empty(responses.shape + (len(lags),), dtype=np.float32)
+    for i, lag in enumerate(lags):
+        history[..., i] = (cumsum[n_before] - cumsum[np.maximum(n_before - lag, 0)]) / lag
+    return history
+
+
+def make_synthetic_session(
+    path,
+    n_trials=6000,
+    n_neurons=8000,
+    image_shape=IMAGE_SHAPES["full"],
+    n_test_images=100,
+    n_repeats=10,
+    n_ensembles=5,
+    n_state=10,
+    history_lags=HISTORY_LAGS,
+    animal_id=1,
+    session=1,
+    scan_idx=1,
+    n_workers=0,
+    seed=0,
+):
+    """
+    Writes a synthetic session to `path` with the files a real session has after the notebooks of submission_m4 ran:
+    data/{images,responses,behavior,pupil_center}/<trial>.npy, meta/neurons, meta/trials (tiers, ensemble_tiers,
+    frame_image_id, frame_image_class, frame_trial_ts, trial_idx), merged_data (the stacked data, trial_id, sort_id,
+    rank_id, history and state) and meta/statistics of all data_keys.
+
+    The test and final_test tiers each show `n_test_images` images `n_repeats` times, the remaining trials show unique
+    images and are split 9:1 into train and validation. The trials are stored in a random order with respect to their
+    timestamps, like the real sessions. Responses are non-negative and depend on the image, so repeats of an image
+    evoke correlated responses.
+
+    Args:
+        path (str or Path): folder of the session, created if it does not exist
+        n_trials (int): number of trials, at least the 2 * n_test_images * n_repeats trials of the test tiers
+        n_neurons (int): number of neurons
+        image_shape (tuple): height and width of the images, see IMAGE_SHAPES
+        n_test_images (int): number of images of each of the test tiers
+        n_repeats (int): repeats of every image of the test tiers
+        n_ensembles (int): number of reshuffled train/validation splits in meta/trials/ensemble_tiers.npy
+        n_state (int): dimensions of the behavioral state regressor
+        history_lags (tuple): lags of the history regressor
+        animal_id (int), session (int), scan_idx (int): ids of the session, the data_key of the session in the
+            dataloaders is "<animal_id>-<session>-<scan_idx>"
+        n_workers (int): processes for merged_data and the statistics, 0 builds in this process
+        seed (int): seed of the random data
+
+    Returns:
+        Path: folder of the session
+    """
+    path = Path(path)
+    rng = np.random.RandomState(seed)
+    n_test_trials = n_test_images * n_repeats
+    n_unique = n_trials - 2 * n_test_trials
+    if n_unique < 2:
+        raise ValueError("{} trials are too few for two test tiers of {} trials".format(n_trials, n_test_trials))
+
+    # tiers and image ids in time order
+    n_validation = max(1, n_unique // 10)
+    tiers = np.array(
+        ["train"] * (n_unique - n_validation)
+        + ["validation"] * n_validation
+        + ["test"] * n_test_trials
+        + ["final_test"] * n_test_trials
+    )
+    image_ids = np.concatenate([
+        np.arange(n_unique),
+        np.repeat(n_unique + np.arange(n_test_images), n_repeats),
+        np.repeat(n_unique + n_test_images + np.arange(n_test_images), n_repeats),
+    ])
+    time_order = rng.permutation(n_trials)
+    tiers, image_ids = tiers[time_order], image_ids[time_order]
+
+    # latent features of every image drive the responses
+    n_latents = 16
+    latents = rng.randn(n_unique + 2 * n_test_images, n_latents).astype(np.float32)
+    weights = rng.randn(n_latents, n_neurons).astype(np.float32) / np.sqrt(n_latents)
+    gains = rng.gamma(2.0, 0.5, size=n_neurons).astype(np.float32)
+    responses = np.exp(latents[image_ids] @ weights) * gains
+    responses *= rng.gamma(4.0, 0.25, size=responses.shape).astype(np.float32)
+
+    # slowly changing behavior: pupil dilation, its derivative and running speed
+    pupil = 15 + 5 * np.sin(np.cumsum(rng.randn(n_trials)) / 20)
+    running = np.abs(np.cumsum(rng.randn(n_trials))) / 5
+    behavior = np.stack([pupil, np.gradient(pupil), running], axis=1).astype(np.float32)
+    pupil_center = (np.cumsum(rng.randn(n_trials, 2), axis=0) / 10 + [120, 80]).astype(np.float32)
+    state = np.abs(np.cumsum(rng.randn(n_trials, n_state), axis=0) / 10).astype(np.float32)
+    history = _causal_history(responses, np.isin(tiers, ["train", "validation"]), history_lags)
+
+    # trial i of the files is trial rank[i] in time
+    rank = rng.permutation(n_trials)
+    data = {
+        "responses": responses[rank],
+        "behavior": behavior[rank],
+        "pupil_center": pupil_center[rank],
+    }
+    tiers, image_ids = tiers[rank], image_ids[rank]
+
+    for data_key in ["images"] + list(data):
+        (path / "data" / data_key).mkdir(parents=True, exist_ok=True)
+    test_images = {}
+    for i, image_id in enumerate(image_ids):
+        if image_id < n_unique:
+            image = rng.randint(0, 256, size=(1,) + tuple(image_shape))
+        else:
+            if image_id not in test_images:
+                test_images[image_id] = rng.randint(0, 256, size=(1,) + tuple(image_shape))
+            image = test_images[image_id]
+        np.save(path / "data" / "images" / "{}.npy".format(i), image.astype(np.float32))
+        for data_key, values in data.items():
+            np.save(path / "data" / data_key / "{}.npy".format(i), values[i])
+
+    neurons = {
+        "unit_ids": np.arange(1, n_neurons + 1),
+        "area": np.full(n_neurons, "V1"),
+        "layer": np.full(n_neurons, "L2/3"),
+        "animal_ids": np.full(n_neurons, animal_id),
+        "sessions": np.full(n_neurons, session),
+        "scan_idx": np.full(n_neurons, scan_idx),
+        "cell_motor_coordinates": (rng.rand(n_neurons, 3) * [600, 600, 200]).astype(np.float32),
+    }
+    start = datetime.datetime(2022, 1, 1, 10)
+    ensemble_tiers = np.tile(tiers.astype("<U10"), (n_ensembles, 1))
+    train_validation = np.isin(tiers, ["train", "validation"])
+    for i in range(n_ensembles):
+        ensemble_tiers[i, train_validation] = rng.permutation(tiers[train_validation])
+    trials = {
+        "tiers": tiers,
+        "ensemble_tiers": ensemble_tiers,
+        "frame_image_id": image_ids,
+        "frame_image_class": np.full(n_trials, "imagenet"),
+        "frame_trial_ts": np.array(
+            ["Timestamp('{}')".format(start + datetime.timedelta(seconds=10 * int(t))) for t in rank]
+        ),
+        "trial_idx": np.arange(n_trials),
+    }
+    for folder, meta in [("neurons", neurons), ("trials", trials)]:
+        (path / "meta" / folder).mkdir(parents=True, exist_ok=True)
+        for name, values in meta.items():
+            np.save(path / "meta" / folder / "{}.npy".format(name), values)
+
+    build_merged_data(path, n_workers=n_workers, overwrite=True)
+    sort_id = np.argsort(rank)
+    for name, values in [
+        ("trial_id", np.arange(n_trials)),
+        ("sort_id", sort_id),
+        ("rank_id", rank),
+    ]:
+        # ids are 2d, like the other data of a batch
+        np.save(path / "merged_data" / "{}.npy".format(name), values[:, None])
+    for name, values in [
+        ("history", history[rank]),
+        ("state", state[rank]),
+    ]:
+        np.save(path / "merged_data" / "{}.npy".format(name), values)
+    build_statistics(path, n_workers=n_workers, overwrite=True)
+    return path
@@ -10,6 +10,11 @@ class EnsemblePrediction(nn.Module):
         self.model_list = nn.ModuleList( model_list )
         self.mode = mode
        
+    @property
+    def normalizer(self):
+        """ Normalizer of the models that normalize the batches themselves, see models.utility.prepare_normalizer """
+        return getattr(self.model_list[0], 'normalizer', None)
+
     def forward(self, *args, **kwargs):
         """ Forward function passes all arguments to individual models """
         
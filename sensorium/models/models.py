@@ -15,7 +15,7 @@ from neuralpredictors.layers.cores import (
 )
 
 from .readouts import MultipleFullGaussian2d
-from .utility import prepare_grid
+from .utility import prepare_constant_input_channels, prepare_grid, prepare_normalizer
 
 
 def modulated_stacked_core_full_gauss_readout(
@@ -103,6 +103,8 @@ def modulated_stacked_core_full_gauss_readout(
         if isinstance(input_channels, dict)
         else input_channels[0]
     )
+    constant_input_channels = prepare_constant_input_channels(session_shape_dict)
+    core_input_channels += constant_input_channels
 
     set_random_seed(seed)
     grid_mean_predictor, grid_mean_predictor_type, source_grids = prepare_grid(
@@ -130,6 +132,7 @@ def modulated_stacked_core_full_gauss_readout(
         attention_conv=attention_conv,
         hidden_padding=hidden_padding,
         use_avg_reg=use_avg_reg,
+        constant_input_channels=constant_input_channels,
     )
 
     in_shapes_dict = {
@@ -197,6 +200,7 @@ def modulated_stacked_core_full_gauss_readout(
         shifter=shifter,
         modulator=modulator,
         elu_offset=elu_offset,
+        normalizer=prepare_normalizer(dataloaders),
     )
 
     return model
@@ -284,6 +288,8 @@ def stacked_core_full_gauss_readout(
         if isinstance(input_channels, dict)
         else input_channels[0]
     )
+    constant_input_channels = prepare_constant_input_channels(session_shape_dict)
+    core_input_channels += constant_input_channels
 
     set_random_seed(seed)
     grid_mean_predictor, grid_mean_predictor_type, source_grids = prepare_grid(
@@ -311,6 +317,7 @@ def stacked_core_full_gauss_readout(
         attention_conv=attention_conv,
         hidden_padding=hidden_padding,
         use_avg_reg=use_avg_reg,
+        constant_input_channels=constant_input_channels,
     )
 
     in_shapes_dict = {
@@ -356,6 +363,7 @@ def stacked_core_full_gauss_readout(
         readout=readout,
         shifter=shifter,
         elu_offset=elu_offset,
+        normalizer=prepare_normalizer(dataloaders),
     )
 
     return model
@@ -1,5 +1,7 @@
 import copy
 
+from torch import nn
+
 
 def prepare_grid(grid_mean_predictor, dataloaders):
     """
@@ -36,4 +38,38 @@ def prepare_grid(grid_mean_predictor, dataloaders):
                 k: v.dataset.neurons.cell_motor_coordinates[:, :input_dim]
                 for k, v in dataloaders.items()
             }
-    return grid_mean_predictor, grid_mean_predictor_type, source_grids
\ No newline at end of file
+    return grid_mean_predictor, grid_mean_predictor_type, source_grids
+
+
+def prepare_normalizer(dataloaders):
+    """
+    Utility function for normalizing the batches inside the model, for loaders built with normalize="model" (see
+    sensorium.datasets.mouse_loaders.static_loader).
+
+    Args:
+        dataloaders: a dictionary of dataloaders, one PyTorch DataLoader per session
+            in the format {'data_key': dataloader object, .. }
+    Returns:
+        normalizer (nn.ModuleDict): a FusedNeuroNormalizer for each data_key, or None if the loaders normalize
+            the data themselves
+    """
+    normalizers = {k: getattr(v.dataset, "deferred_normalizer", None) for k, v in dataloaders.items()}
+    if all(normalizer is None for normalizer in normalizers.values()):
+        return None
+    if any(normalizer is None for normalizer in normalizers.values()):
+        raise ValueError("Either all or none of the dataloaders have to be built with normalize='model'")
+    return nn.ModuleDict({k: copy.deepcopy(normalizer) for k, normalizer in normalizers.items()})
+
+
+def prepare_constant_input_channels(session_shape_dict):
+    """
+    Utility function for the input channels that are constant over space and passed to the core as vectors
+    (lazy_constant_channels of sensorium.datasets.mouse_loaders.static_loader).
+
+    Args:
+        session_shape_dict (dict): shapes of the batch fields of each data_key, see get_dims_for_loader_dict
+    Returns:
+        constant_input_channels (int): number of constant channels, 0 if the batches have no "channel_constants"
+    """
+    shapes = next(iter(session_shape_dict.values()))
+    return shapes["channel_constants"][1] if "channel_constants" in shapes else 0
@@ -3,11 +3,13 @@ import numpy as np
 import torch
 from tqdm import tqdm
 
+from neuralpredictors.data.loaders import to_device
 from neuralpredictors.measures import modules
 from neuralpredictors.training import (
     early_stopping,
     MultipleObjectiveTracker,
     LongCycler,
+    PrefetchCycler,
 )
 from nnfabrik.utility.nn_helpers import set_random_seed
 
@@ -41,6 +43,7 @@ def standard_trainer(
     track_training=False,
     detach_core=False,
     disable_tqdm=False,
+    prefetch_batches=0,
     **kwargs
 ):
     """
@@ -69,6 +72,8 @@ def standard_trainer(
         min_lr: minimum learning rate
         cb: whether to execute callback function
         track_training: whether to track and print out the training progress
+        prefetch_batches: number of training batches that are loaded ahead in a background thread (see PrefetchCycler),
+            0 loads them in the training loop. The counters of every epoch are returned in output["prefetch_stats"]
         **kwargs:
 
     Returns:
@@ -93,7 +98,7 @@ def standard_trainer(
             loss_scale
             * criterion(
                 model(args[0].to(device), data_key=data_key, **kwargs),
-                args[1].to(device),
+                scores.normalized_targets(model, args[1].to(device), data_key),
             )
             + regularizers
         )
@@ -112,7 +117,11 @@ def standard_trainer(
         avg=True,
     )
 
-    n_iterations = len(LongCycler(dataloaders["train"]))
+    train_cycler = LongCycler(dataloaders["train"])
+    if prefetch_batches:
+        train_cycler = PrefetchCycler(train_cycler, queue_size=prefetch_batches)
+    prefetch_stats = []
+    n_iterations = len(train_cycler)
 
     optimizer = torch.optim.Adam(model.parameters(), lr=lr_init)
     scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
@@ -186,7 +195,7 @@ def standard_trainer(
         # train over batches
         optimizer.zero_grad()
         for batch_no, (data_key, data) in tqdm(
-            enumerate(LongCycler(dataloaders["train"])),
+            enumerate(train_cycler),
             total=n_iterations,
             desc="Epoch {}".format(epoch),
             disable=disable_tqdm,
@@ -194,6 +203,7 @@ def standard_trainer(
 
             batch_args = list(data)
             batch_kwargs = data._asdict() if not isinstance(data, dict) else data
+            batch_kwargs = to_device(batch_kwargs, device)
             loss = full_objective(
                 model,
                 dataloaders["train"],
@@ -207,6 +217,15 @@ def standard_trainer(
                 optimizer.step()
                 optimizer.zero_grad()
 
+        if prefetch_batches:
+            prefetch_stats.append(train_cycler.stats)
+            if verbose:
+                print(
+                    "prefetching: {stalls}/{batches} batches stalled for {stall_s:.2f}s, "
+                    "mean queue depth {mean_queue_depth:.2f}".format(**prefetch_stats[-1]),
+                    flush=True,
+                )
+
     ##### Model evaluation ####################################################################################################
     model.eval()
     tracker.finalize() if track_training else None
@@ -219,6 +238,8 @@ def standard_trainer(
     # return the whole tracker output as a dict
     output = {k: v for k, v in tracker.log.items()} if track_training else {}
     output["validation_corr"] = validation_correlation
+    if prefetch_batches:
+        output["prefetch_stats"] = prefetch_stats
 
     score = np.mean(validation_correlation)
 
@@ -1,4 +1,5 @@
 import numpy as np
+from neuralpredictors.data.utils import repeat_groups
 from neuralpredictors.measures.np_functions import corr, fev
 
 
@@ -22,6 +23,8 @@ class Metrics:
         self.trial_idx = trial_idx
         self.image_ids = image_ids
         self.neuron_ids = neuron_ids
+        # trials of every image, shared by all metrics that average across repeats
+        _, self.repeat_groups = repeat_groups(image_ids)
 
     def order(self, responses, trial_idx, image_ids, neuron_ids):
         """
@@ -75,12 +78,7 @@ class Metrics:
             list: responses or predictios split across images. [n_images] np.array(n_repeats, n_neurons)
         """
 
-        per_image_repeats = []
-        for image_id in np.unique(self.image_ids):
-            responses_across_repeats = responses[self.image_ids == image_id]
-            per_image_repeats.append(responses_across_repeats)
-
-        return per_image_repeats
+        return [responses[group] for group in self.repeat_groups]
 
     def correlation_to_single_trials(
         self,
@@ -8,8 +8,11 @@ import numpy as np
 import torch
 from tqdm import tqdm
 
+from neuralpredictors.data.loaders import to_device
 from neuralpredictors.training import eval_state, device_state
 
+from .scores import normalized_targets
+
 
 def single_prediction_with_trial(model, dataloader, data_key, device="cuda"):
     """
@@ -30,6 +33,7 @@ def single_prediction_with_trial(model, dataloader, data_key, device="cuda"):
             else (batch["inputs"], batch["targets"])
         )
         batch_kwargs = batch._asdict() if not isinstance(batch, dict) else batch
+        batch_kwargs = to_device(batch_kwargs, device)
 
         # make sure trial_id is in the batch arguments
         if not 'trial_id' in batch_kwargs:
@@ -53,7 +57,7 @@ def single_prediction_with_trial(model, dataloader, data_key, device="cuda"):
                     ),
                     dim=0,
                 )
-            target = torch.cat((target, responses.detach().cpu()), dim=0)
+                target = torch.cat((target, normalized_targets(model, responses, data_key).detach().cpu()), dim=0)
             trial_ids = torch.cat((trial_ids, ids.detach().cpu()), dim=0)
 
     return target.numpy(), output.numpy(), trial_ids.numpy().flatten().astype(int)
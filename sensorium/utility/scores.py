@@ -2,30 +2,53 @@ import warnings
 import numpy as np
 import torch
 
+from neuralpredictors.data.loaders import to_device
+from neuralpredictors.data.utils import repeat_groups
 from neuralpredictors.measures.np_functions import corr, fev
 from neuralpredictors.training import eval_state, device_state
 
 from .submission import get_data_filetree_loader
 
 
-def split_images(responses, image_ids):
+def split_images(responses, image_ids, groups=None):
     """
     Split the responses (or predictions) array based on image ids. Each element of the list contains
     the responses to repeated presentations of a single image.
 
     Args:
         responses (np.array): Recorded neural responses, or predictions. Shape: (n_trials, n_neurons)
+        image_ids (np.array): image ids of the trials. Shape: (n_trials,)
+        groups (list, optional): trials of every image, as returned by neuralpredictors.data.utils.repeat_groups
+                                 for image_ids. Pass them to split several arrays of the same trials without
+                                 grouping the image ids again.
 
     Returns:
         list: responses or predictios split across images. [n_images] np.array(n_repeats, n_neurons)
     """
+    if groups is None:
+        _, groups = repeat_groups(image_ids)
+    return [responses[group] for group in groups]
 
-    per_image_repeats = []
-    for image_id in np.unique(image_ids):
-        responses_across_repeats = responses[image_ids == image_id]
-        per_image_repeats.append(responses_across_repeats)
 
-    return per_image_repeats
+def normalized_targets(model, responses, data_key):
+    """
+    Responses in the units of the predictions: models that normalize the batches themselves (dataloaders with
+    normalize="model") predict normalized responses, so the responses are normalized by the normalizer of the model.
+
+    Args:
+        model (torch.nn.Module): Model that predicts the responses
+        responses (torch.Tensor): responses of a batch, as returned by the dataloader
+        data_key (str): session of the batch
+
+    Returns:
+        torch.Tensor: the responses, on the device of the normalizer if they were normalized
+    """
+    normalizer = getattr(model, "normalizer", None)
+    if normalizer is None:
+        return responses
+    normalizer = normalizer[data_key]
+    device = next(normalizer.buffers(), responses).device
+    return normalizer.normalize_targets(responses.to(device))
 
 
 def model_predictions(model, dataloader, data_key, device="cpu"):
@@ -44,6 +67,7 @@ def model_predictions(model, dataloader, data_key, device="cpu"):
             else (batch["inputs"], batch["targets"])
         )
         batch_kwargs = batch._asdict() if not isinstance(batch, dict) else batch
+        batch_kwargs = to_device(batch_kwargs, device)
 
         with torch.no_grad():
             with device_state(model, device):
@@ -58,7 +82,7 @@ def model_predictions(model, dataloader, data_key, device="cpu"):
                     ),
                     dim=0,
                 )
-            target = torch.cat((target, responses.detach().cpu()), dim=0)
+                target = torch.cat((target, normalized_targets(model, responses, data_key).detach().cpu()), dim=0)
 
     return target.numpy(), output.numpy()
 
@@ -122,8 +146,9 @@ def get_signal_correlations(
             model, dataloader, data_key=data_key, device=device
         )
 
-        repeats_responses = split_images(responses, image_ids)
-        repeats_predictions = split_images(predictions, image_ids)
+        _, groups = repeat_groups(image_ids)
+        repeats_responses = split_images(responses, image_ids, groups)
+        repeats_predictions = split_images(predictions, image_ids, groups)
 
         mean_responses, mean_predictions = [], []
         for repeat_responses, repeat_predictions in zip(
@@ -170,9 +195,11 @@ def get_fev(model, dataloaders, tier, device="cpu", per_neuron=True, fev_thresho
         _, predictions = model_predictions(
             model, dataloader, data_key=data_key, device=device
         )
+        responses = normalized_targets(model, torch.from_numpy(responses), data_key).cpu().numpy()
+        _, groups = repeat_groups(image_ids)
         fev_val, feve_val = fev(
-            split_images(responses, image_ids),
-            split_images(predictions, image_ids),
+            split_images(responses, image_ids, groups),
+            split_images(predictions, image_ids, groups),
             return_exp_var=True,
         )
 
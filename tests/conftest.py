@@ -0,0 +1,20 @@
+import shutil
+
+import pytest
+
+from sensorium.datasets.synthetic import make_synthetic_session
+
+
+@pytest.fixture(scope="session")
+def static_session(tmp_path_factory):
+    """ Small synthetic session (see sensorium.datasets.synthetic), shared by the tests that only read it """
+    path = tmp_path_factory.mktemp("sessions") / "static"
+    return make_synthetic_session(
+        path, n_trials=60, n_neurons=20, image_shape=(12, 16), n_test_images=2, n_repeats=5, n_ensembles=2, seed=0
+    )
+
+
+@pytest.fixture
+def static_session_copy(static_session, tmp_path):
+    """ Copy of `static_session` for tests that change the files of the session """
+    return shutil.copytree(static_session, tmp_path / "static")
@@ -0,0 +1,93 @@
+import h5py
+import numpy as np
+import pytest
+import torch
+
+from neuralpredictors.data.datasets import FileTreeDataset, MovieFileTreeDataset
+from neuralpredictors.data.datasets.statics.base import H5ArraySet
+from neuralpredictors.data.transforms import (
+    AddBehaviorAsChannels,
+    AddPupilCenterAsChannels,
+    Delay,
+    NeuroNormalizer,
+    ScaleInputs,
+    Subsample,
+    Subsequence,
+    ToTensor,
+)
+
+ITEMS = [5, 0, 17, 3, 3, 42]
+
+
+@pytest.fixture(scope="module")
+def movie_session(tmp_path_factory):
+    """ Clips of 15 frames with inputs (channels, time, height, width), behavior and responses (time, *) """
+    path = tmp_path_factory.mktemp("sessions") / "movie"
+    rng = np.random.default_rng(0)
+    shapes = {"inputs": (1, 15, 6, 8), "behavior": (15, 3), "responses": (15, 10)}
+    for data_key, shape in shapes.items():
+        (path / "data" / data_key).mkdir(parents=True)
+        for trial in range(50):
+            np.save(path / "data" / data_key / "{}.npy".format(trial), rng.random(shape, dtype=np.float32))
+    (path / "meta" / "trials").mkdir(parents=True)
+    np.save(path / "meta" / "trials" / "tiers.npy", np.array(["train"] * 50))
+    return path
+
+
+def assert_batch_equals_items(dataset, items):
+    batch = dataset[items]
+    for field in batch._fields:
+        expected = torch.stack([getattr(dataset[item], field) for item in items])
+        assert getattr(batch, field).shape == expected.shape, field
+        torch.testing.assert_close(getattr(batch, field), expected, rtol=1e-5, atol=1e-5, msg=field)
+
+
+@pytest.mark.parametrize("preload", [False, True])
+def test_static_batch_equals_items(static_session, preload):
+    dataset = FileTreeDataset(str(static_session), "images", "responses", "behavior", "pupil_center")
+    if preload:
+        dataset.load_data_to_cache()
+    dataset.transforms = [
+        NeuroNormalizer(dataset),
+        ScaleInputs(scale=0.5),
+        AddBehaviorAsChannels(),
+        AddPupilCenterAsChannels(),
+        Subsample([3, 0, 7, 12]),
+        ToTensor(),
+    ]
+    assert_batch_equals_items(dataset, ITEMS)
+
+
+@pytest.mark.parametrize("offset", [4, -1])
+def test_movie_batch_equals_items(movie_session, offset):
+    dataset = MovieFileTreeDataset(str(movie_session), "inputs", "behavior", "responses")
+    dataset.transforms = [Subsequence(8, offset=offset), Delay(2), Subsample([9, 2, 4]), ToTensor()]
+
+    # the random offsets of the batch are drawn in the order of the items, like those of single items
+    np.random.seed(0)
+    batch = dataset[ITEMS]
+    np.random.seed(0)
+    items = [dataset[item] for item in ITEMS]
+    assert batch.inputs.shape == (len(ITEMS), 1, 6, 6, 8)
+    assert batch.responses.shape == (len(ITEMS), 6, 3)
+    for field in batch._fields:
+        expected = torch.stack([getattr(item, field) for item in items])
+        torch.testing.assert_close(getattr(batch, field), expected, rtol=0, atol=0, msg=field)
+
+
+@pytest.mark.parametrize("loaded", [False, True])
+@pytest.mark.parametrize("items", [[4, 1, 4, 9], []])
+def test_h5_batch_equals_items(tmp_path, loaded, items):
+    rng = np.random.default_rng(0)
+    with h5py.File(tmp_path / "static.h5", "w") as fid:
+        fid["images"] = rng.random((10, 1, 6, 8), dtype=np.float32)
+        fid["responses"] = rng.random((10, 5), dtype=np.float32)
+    dataset = H5ArraySet(str(tmp_path / "static.h5"), "images", "responses")
+    if loaded:
+        dataset.load_content()
+
+    batch = dataset[items]
+    assert batch.images.shape == (len(items), 1, 6, 8)
+    for field in batch._fields:
+        expected = [getattr(dataset[item], field) for item in items]
+        np.testing.assert_array_equal(getattr(batch, field), np.reshape(expected, getattr(batch, field).shape))
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from neuralpredictors.data.datasets import FileTreeDataset
+from neuralpredictors.data.transforms import Subsample
+
+BACKENDS = ("files", "cache", "mmap", "shared")
+
+
+def load(dataset, backend, tmp_path):
+    """ Serves the data of `dataset` like static_loader does for preload_from_merged_data """
+    if backend == "cache":
+        dataset.load_data_to_cache()
+    elif backend == "mmap":
+        dataset.memory_map_merged_data()
+    elif backend == "shared":
+        # a folder of the test instead of /dev/shm, which keeps the copies after the test
+        dataset.share_merged_data(root=tmp_path / "shared")
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("select_first", [True, False])
+def test_select_neurons_equals_subsample(static_session, tmp_path, backend, select_first):
+    first, second = np.array([15, 2, 9, 4, 11, 0]), np.array([5, 1, 3])
+    reference = FileTreeDataset(str(static_session), "images", "responses")
+    dataset = FileTreeDataset(str(static_session), "images", "responses")
+    if select_first:
+        dataset.select_neurons(first)
+    load(dataset, backend, tmp_path)
+    # cached trials are subset as well
+    dataset[0], dataset[[1, 2]]
+    if not select_first:
+        dataset.select_neurons(first)
+
+    items = [0, 7, 3, 59]
+
+    def assert_subsample(idx):
+        reference.transforms = [Subsample(idx)]
+        for item in items:
+            np.testing.assert_array_equal(dataset[item].responses, reference[item].responses)
+            np.testing.assert_array_equal(dataset[item].images, reference[item].images)
+        np.testing.assert_array_equal(dataset[items].responses, reference[items].responses)
+        np.testing.assert_array_equal(dataset.neurons.unit_ids, reference.neurons.unit_ids)
+        np.testing.assert_array_equal(dataset.neuron_idx, idx)
+
+    assert_subsample(first)
+    # a subset of the selected neurons
+    dataset.select_neurons(second)
+    assert_subsample(first[second])
+
+
+def test_select_neurons_boolean_index(static_session):
+    dataset = FileTreeDataset(str(static_session), "images", "responses")
+    mask = np.zeros(20, dtype=bool)
+    mask[[1, 5, 6]] = True
+    dataset.select_neurons(mask)
+    np.testing.assert_array_equal(dataset.neuron_idx, [1, 5, 6])
+    assert dataset[0].responses.shape == (3,)
+
+
+def test_add_neuron_meta_after_select_neurons(static_session_copy):
+    dataset = FileTreeDataset(str(static_session_copy), "images", "responses")
+    neurons = dataset.neurons
+    animal_ids, sessions, scan_idx, unit_ids = neurons.animal_ids, neurons.sessions, neurons.scan_idx, neurons.unit_ids
+    values = np.arange(len(unit_ids), dtype=float) * 10
+
+    idx = np.array([7, 3, 12])
+    dataset.select_neurons(idx)
+    assert len(dataset.neurons.unit_ids) == 3
+    # the values of all neurons, in a different order than in meta/neurons
+    order = np.random.RandomState(0).permutation(len(unit_ids))
+    dataset.add_neuron_meta(
+        "depth", animal_ids[order], sessions[order], scan_idx[order], unit_ids[order], values[order]
+    )
+
+    np.testing.assert_array_equal(np.load(static_session_copy / "meta" / "neurons" / "depth.npy"), values)
+    np.testing.assert_array_equal(dataset.neurons.depth, values[idx])
+    np.testing.assert_array_equal(FileTreeDataset(str(static_session_copy), "images", "responses").neurons.depth, values)
+
+    with pytest.raises(Exception, match="not consistent"):
+        dataset.add_neuron_meta("subset", animal_ids[idx], sessions[idx], scan_idx[idx], unit_ids[idx], values[idx])
+
+
+@pytest.mark.parametrize("backend", ["mmap", "shared"])
+def test_storage_dtypes_of_memory_mapped_data(static_session, tmp_path, backend):
+    dataset = FileTreeDataset(str(static_session), "images", "responses")
+    load(dataset, backend, tmp_path)
+    with pytest.raises(ValueError, match="memory_map_merged_data") as error:
+        dataset.set_storage_dtypes({"responses": "float16"})
+    assert "share_merged_data" in str(error.value) and "on-disk dtype" in str(error.value)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import torch
+
+from neuralpredictors.data.datasets import FileTreeDataset
+from neuralpredictors.data.transforms import NeuroNormalizer
+
+DATA_KEYS = ("images", "responses", "behavior", "pupil_center", "trial_idx")
+
+
+def reference_transforms(normalizer):
+    """
+    The per-field normalizations that NeuroNormalizer applied before it was precomputed as one affine map per field,
+    followed by Subsample(subsample_idx) of the responses
+    """
+    n = normalizer
+    transforms = {
+        "images": lambda x: (x - n._inputs_mean) / n._inputs_std,
+        "responses": lambda x: x * n._response_precision,
+        "trial_idx": lambda x: (x - n._trial_idx_mean) / n._trial_idx_std,
+        "pupil_center": lambda x: (x - n._eye_mean) / n._eye_std,
+    }
+    if n._behavior_normalization == "precision":
+        transforms["behavior"] = lambda x: x * n._behavior_precision
+    else:
+        mins, maxs, stds = n._behavior_min, n._behavior_max, n._behavior_std
+        transforms["behavior"] = lambda x: np.stack(
+            [
+                (x[..., 0] - mins[0]) / (maxs[0] - mins[0]),
+                x[..., 1] / stds[1],
+                np.abs(x[..., 2]) / np.max([-mins[2], maxs[2]]),
+            ],
+            axis=-1,
+        )
+    if n.subsample_idx is not None:
+        responses = transforms["responses"]
+        transforms["responses"] = lambda x: np.take(responses(x), n.subsample_idx, -1)
+    return transforms
+
+
+@pytest.fixture
+def dataset(static_session):
+    return FileTreeDataset(str(static_session), *DATA_KEYS)
+
+
+@pytest.mark.parametrize("adjusted_normalization", [True, False])
+@pytest.mark.parametrize("subsample_idx", [None, [3, 0, 7, 12]])
+def test_affine_equals_reference(dataset, adjusted_normalization, subsample_idx):
+    normalizer = NeuroNormalizer(dataset, adjusted_normalization=adjusted_normalization, subsample_idx=subsample_idx)
+    reference = reference_transforms(normalizer)
+    assert set(normalizer.affine) == set(DATA_KEYS)
+
+    items = np.arange(10)
+    batch = dataset[items]
+    normalized = normalizer.batch_transform(batch)
+    for field in DATA_KEYS:
+        expected = reference[field](getattr(batch, field))
+        values = getattr(batch, field)
+        if field == "responses" and subsample_idx is not None:
+            values = np.take(values, subsample_idx, -1)
+        # float32 rounding of x * scale, before the offset cancels most of it (e.g. the pupil center is far from 0)
+        atol = 4 * np.finfo(np.float32).eps * np.abs(values).max() * np.abs(normalizer.affine[field][0]).max()
+        np.testing.assert_allclose(getattr(normalized, field), expected, rtol=1e-6, atol=atol, err_msg=field)
+        assert getattr(normalized, field).dtype == np.float32
+
+    for item in items:
+        sample = normalizer(dataset[item])
+        for field in DATA_KEYS:
+            np.testing.assert_allclose(getattr(sample, field), getattr(normalized, field)[item], rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize("adjusted_normalization", [True, False])
+@pytest.mark.parametrize("subsample_idx", [None, [3, 0, 7, 12]])
+def test_module_equals_normalizer(dataset, adjusted_normalization, subsample_idx):
+    normalizer = NeuroNormalizer(dataset, adjusted_normalization=adjusted_normalization, subsample_idx=subsample_idx)
+    batch = dataset[np.arange(10)]
+    expected = normalizer.batch_transform(batch)
+
+    module = normalizer.to_module()
+    tensors = batch.__class__(*(torch.from_numpy(np.asarray(v, dtype=np.float32)) for v in batch))
+    normalized = module(tensors)
+    for field in DATA_KEYS:
+        np.testing.assert_allclose(
+            getattr(normalized, field).numpy(), getattr(expected, field), rtol=1e-5, atol=1e-5, err_msg=field
+        )
+
+
+def test_inverse(dataset):
+    normalizer = NeuroNormalizer(dataset, adjusted_normalization=False)
+    batch = dataset[np.arange(10)]
+    restored = normalizer.inv(normalizer.batch_transform(batch))
+    for field in DATA_KEYS:
+        np.testing.assert_allclose(getattr(restored, field), getattr(batch, field), rtol=1e-4, atol=1e-3, err_msg=field)
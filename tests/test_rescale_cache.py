@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+from neuralpredictors.data import transforms
+from neuralpredictors.data.datasets import FileTreeDataset
+from neuralpredictors.data.transforms import RescaleCache, ScaleInputs
+
+
+@pytest.fixture
+def rescale_calls(monkeypatch):
+    """ Counts the calls of skimage's rescale by ScaleInputs """
+    calls = []
+
+    def counted(*args, **kwargs):
+        calls.append(1)
+        return rescale(*args, **kwargs)
+
+    rescale = transforms.rescale
+    monkeypatch.setattr(transforms, "rescale", counted)
+    return calls
+
+
+def cached_dataset(path, cache_path):
+    dataset = FileTreeDataset(str(path), "images", "responses")
+    cache = RescaleCache(cache_path)
+    cache.set_source(dataset, [])
+    dataset.transforms = [ScaleInputs(scale=0.5, cache=cache)]
+    return dataset
+
+
+def test_second_epoch_does_not_rescale(static_session, tmp_path, rescale_calls):
+    dataset = cached_dataset(static_session, tmp_path / "cache")
+    first_epoch = [dataset[item].images for item in range(len(dataset))]
+    assert len(rescale_calls) == len(dataset)
+
+    second_epoch = [dataset[item].images for item in range(len(dataset))]
+    # also the batches and a new dataset, which read the cache on disk
+    batch = dataset[list(range(len(dataset)))].images
+    other = cached_dataset(static_session, tmp_path / "cache")
+    other_epoch = [other[item].images for item in range(len(other))]
+    assert len(rescale_calls) == len(dataset)
+    for images in (second_epoch, batch, other_epoch):
+        np.testing.assert_array_equal(np.stack(images), np.stack(first_epoch))
+
+
+def test_changed_source_invalidates_cache(static_session_copy, tmp_path, rescale_calls):
+    dataset = cached_dataset(static_session_copy, tmp_path / "cache")
+    [dataset[item] for item in range(len(dataset))]
+    calls = len(rescale_calls)
+
+    # rewrite an image in place, keeping the modification time of its folder
+    folder = static_session_copy / "data" / "images"
+    folder_stat = os.stat(folder)
+    image = np.load(folder / "3.npy")
+    np.save(folder / "3.npy", 255 - image)
+    os.utime(folder, ns=(folder_stat.st_atime_ns, folder_stat.st_mtime_ns))
+
+    dataset = cached_dataset(static_session_copy, tmp_path / "cache")
+    rescaled = dataset[3].images
+    assert len(rescale_calls) == calls + 1
+    expected = ScaleInputs(scale=0.5)._rescale(255 - image)
+    np.testing.assert_array_equal(rescaled, expected)